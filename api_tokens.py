@@ -0,0 +1,116 @@
+"""
+API bearer tokens for NeuroSight
+Short-lived tokens for machine clients (e.g. a PACS gateway) of the JSON endpoints. A token is
+a signed, timestamped set of claims (user id, role, hospital), so checking one needs no
+database lookup; only the small list of revoked token ids is read, and that is cached in memory.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import delete, select
+
+from identity_cache import UserIdentity
+from models import db, RevokedToken
+
+
+class ApiTokens:
+    """
+    Issues and verifies bearer tokens
+    Revocations made in this process apply at once; those made by other workers are picked up
+    when the revoked list is next reloaded, at most revocation_refresh seconds later.
+    """
+
+    def __init__(self, secret_key, ttl=3600, revocation_refresh=30):
+        self.ttl = ttl
+        self.revocation_refresh = revocation_refresh
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='api-token',
+                                                  signer_kwargs={'digest_method': hashlib.sha256})
+        self._lock = threading.Lock()
+        self._revoked = frozenset()
+        self._revoked_loaded_at = None
+
+    def issue(self, user):
+        """Return (token, lifetime in seconds) for a user"""
+        claims = {
+            'sub': user.id,
+            'role': user.role,
+            'hospital': user.hospital,
+            'jti': secrets.token_hex(16)
+        }
+        return self._serializer.dumps(claims), self.ttl
+
+    def verify(self, token):
+        """Return the token's claims, or None if it is forged, expired or revoked"""
+        try:
+            claims, issued_at = self._serializer.loads(token, max_age=self.ttl, return_timestamp=True)
+        except (BadSignature, SignatureExpired):
+            return None
+        if claims.get('jti') in self._revoked_ids():
+            return None
+        claims['exp'] = issued_at + timedelta(seconds=self.ttl)
+        return claims
+
+    def authenticate(self, token, identities):
+        """
+        UserIdentity for a bearer token, or None if the token is invalid or its user is gone or deactivated
+        identities is the IdentityCache, so the user check usually needs no query.
+        """
+        claims = self.verify(token)
+        if claims is None:
+            return None
+        identity = identities.load(claims['sub'])
+        if identity is None or not identity.is_active:
+            return None
+        return UserIdentity({'id': claims['sub'], 'role': claims['role'], 'hospital': claims['hospital'], 'is_active': True})
+
+    def revoke(self, claims):
+        """Revoke a verified token until it would have expired"""
+        db.session.merge(RevokedToken(jti=claims['jti'], user_id=claims['sub'],
+                                      expires_at=claims['exp'].replace(tzinfo=None)))
+        db.session.commit()
+        with self._lock:
+            self._revoked = self._revoked | {claims['jti']}
+
+    def _revoked_ids(self):
+        loaded_at = self._revoked_loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.revocation_refresh:
+            self._reload_revoked()
+        return self._revoked
+
+    def _reload_revoked(self):
+        table = RevokedToken.__table__
+        # Read-only, in its own connection so the request's session is left alone; expired rows are
+        # removed by purge_expired_revocations(), off the request path
+        with db.engine.connect() as connection:
+            revoked = frozenset(connection.execute(
+                select(table.c.jti).where(table.c.expires_at >= datetime.utcnow())
+            ).scalars())
+        with self._lock:
+            self._revoked = revoked
+            self._revoked_loaded_at = time.monotonic()
+
+
+def purge_expired_revocations():
+    """Delete revocations of tokens that have expired anyway (they fail the signature age check); returns the count"""
+    table = RevokedToken.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(delete(table).where(table.c.expires_at < datetime.utcnow())).rowcount
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from neurosight_app_with_auth import app
+
+    parser = argparse.ArgumentParser(description='Maintain the revoked API token list')
+    parser.add_argument('--purge', action='store_true', help='Delete revocations of expired tokens')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.purge:
+            print(f"✓ Purged {purge_expired_revocations()} expired revocations")
+        print(f"⊙ {RevokedToken.query.count()} revocations stored")
@@ -0,0 +1,165 @@
+"""
+Database Benchmark - SQLite engine profiles under concurrent requests
+Runs request-shaped work (saving an analysis as /detect does, updating last_login as /login
+does, reading the dashboard's recent analyses) from several worker processes and threads at
+once, against the default engine, WAL with pragmas, and WAL with the per-process write lock.
+Lock wait is the mean write time above the time the same write takes with no other clients.
+"""
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from db_engine import sqlite_connection_class
+from models import db, User, AnalysisHistory
+
+
+DURATION = 5.0  # Seconds per measurement
+LAYOUTS = [(1, 8), (2, 4)]  # (worker processes, threads per worker)
+USERS = 50
+MIX = [('detect', 0.3), ('login', 0.2), ('read', 0.5)]
+BUSY_TIMEOUT = 5000  # Milliseconds, as in the app's default
+PROFILES = ['default', 'wal', 'wal + write lock']
+
+
+def make_engine(path, profile):
+    if profile == 'default':
+        return create_engine(f'sqlite:///{path}')
+    factory = sqlite_connection_class(BUSY_TIMEOUT, write_lock=profile == 'wal + write lock')
+    return create_engine(f'sqlite:///{path}', connect_args={'factory': factory, 'timeout': BUSY_TIMEOUT / 1000})
+
+
+def prepare(path, profile):
+    engine = make_engine(path, profile)  # WAL is a property of the file, so create it under the profile being measured
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(User(email=f'doctor{i}@example.com', full_name=f'Doctor {i}', role='doctor') for i in range(USERS))
+        session.commit()
+    engine.dispose()
+
+
+def request(session, operation, rng):
+    user_id = rng.randrange(1, USERS + 1)
+    if operation == 'detect':
+        session.add(AnalysisHistory(user_id=user_id, patient_name='Benchmark', patient_id=f'P-{rng.randrange(1000)}',
+                                    disease_type=rng.choice(['ms', 'alzheimer', 'stroke']),
+                                    prediction='No finding', confidence=rng.random()))
+        session.commit()
+    elif operation == 'login':
+        session.execute(update(User).where(User.id == user_id).values(last_login=datetime.utcnow()))
+        session.commit()
+    else:
+        session.execute(select(AnalysisHistory).where(AnalysisHistory.user_id == user_id)
+                        .order_by(AnalysisHistory.created_at.desc()).limit(5)).all()
+        session.rollback()
+
+
+def worker(path, profile, threads, duration, seed, results):
+    """One worker process: `threads` request loops for `duration` seconds"""
+    engine = make_engine(path, profile)
+    stop = threading.Event()
+    times = {operation: [] for operation, _ in MIX}
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random(seed * 100 + index)
+        operations, weights = zip(*MIX)
+        with Session(engine) as session:
+            while not stop.is_set():
+                operation = rng.choices(operations, weights)[0]
+                start = time.perf_counter()
+                try:
+                    request(session, operation, rng)
+                except OperationalError:  # database is locked
+                    session.rollback()
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    times[operation].append(time.perf_counter() - start)
+
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(threads)]
+    for thread in clients:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in clients:
+        thread.join()
+    engine.dispose()
+    results.put((times, errors[0]))
+
+
+def idle_write_ms(path, profile):
+    """Median time of a save with no other clients"""
+    engine = make_engine(path, profile)
+    rng = random.Random(0)
+    samples = []
+    with Session(engine) as session:
+        for _ in range(50):
+            start = time.perf_counter()
+            request(session, 'detect', rng)
+            samples.append(time.perf_counter() - start)
+    engine.dispose()
+    return statistics.median(samples) * 1000
+
+
+def run(profile, processes, threads):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        prepare(path, profile)
+        idle_ms = idle_write_ms(path, profile)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker, args=(path, profile, threads, DURATION, seed, results))
+                   for seed in range(processes)]
+        for process in workers:
+            process.start()
+        collected = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+
+    times = {operation: [] for operation, _ in MIX}
+    for worker_times, _ in collected:
+        for operation, samples in worker_times.items():
+            times[operation].extend(samples)
+    writes = sorted(times['detect'] + times['login'])
+    reads = sorted(times['read'])
+    percentile = lambda samples, p: samples[int(len(samples) * p)] * 1000 if samples else float('nan')
+    return {
+        'requests_per_s': (len(writes) + len(reads)) / DURATION,
+        'write_p95_ms': percentile(writes, 0.95),
+        'write_max_ms': writes[-1] * 1000 if writes else float('nan'),
+        'lock_wait_ms': max(statistics.mean(times['detect']) * 1000 - idle_ms, 0) if times['detect'] else float('nan'),
+        'read_p95_ms': percentile(reads, 0.95),
+        'errors': sum(errors for _, errors in collected)
+    }
+
+
+def main():
+    print("=" * 96)
+    print(f"  DATABASE BENCHMARK (SQLite, {DURATION:.0f}s per run, busy timeout {BUSY_TIMEOUT} ms)")
+    print("  " + ", ".join(f"{share:.0%} {operation}" for operation, share in MIX))
+    print("=" * 96)
+    print(f"{'Workers x threads':<20}{'Profile':<20}{'Req/s':>8}{'Write p95':>11}{'Write max':>11}"
+          f"{'Lock wait':>11}{'Read p95':>10}{'Locked':>8}")
+    print("-" * 96)
+    for processes, threads in LAYOUTS:
+        for profile in PROFILES:
+            result = run(profile, processes, threads)
+            print(f"{f'{processes} x {threads}':<20}{profile:<20}{result['requests_per_s']:>8.0f}"
+                  f"{result['write_p95_ms']:>11.1f}{result['write_max_ms']:>11.1f}{result['lock_wait_ms']:>11.1f}"
+                  f"{result['read_p95_ms']:>10.1f}{result['errors']:>8}")
+        print("-" * 96)
+    print("Times in ms; Locked = requests that failed with 'database is locked'")
+
+
+if __name__ == "__main__":
+    main()
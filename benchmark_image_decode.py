@@ -0,0 +1,119 @@
+"""
+Image Decode Benchmark - Compare full decode against reduced-resolution decode
+Run this to measure decode time and peak memory per image format
+"""
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_utils import open_image, decode_for_model
+
+
+SCAN_SIZE = (4096, 4096)
+TARGET_SIZES = [(224, 224), (128, 128)]
+FORMATS = ['JPEG', 'PNG', 'TIFF']
+REPEATS = 5
+
+
+def make_scan(fmt, size=SCAN_SIZE):
+    """Create a synthetic grayscale scan encoded in the given format"""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    radius = np.hypot(x - width / 2, y - height / 2)
+    pixels = np.clip(255 - radius / (width / 2) * 255, 0, 255)
+    pixels = (pixels + np.random.default_rng(0).normal(0, 8, pixels.shape)).clip(0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8), mode='L').save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def decode_full(data, target_size):
+    """Original path: full decode, RGB conversion, then resize"""
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    return image.resize(target_size)
+
+
+def decode_reduced(data, target_size):
+    """New path: header check, draft/reduce decode, RGB conversion at model size"""
+    image = open_image(data, max_pixels=0)
+    image = decode_for_model(image, target_size)
+    return image.resize(target_size).convert('RGB')
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def _write_scans(directory):
+    for fmt in FORMATS:
+        with open(os.path.join(directory, f"scan.{fmt.lower()}"), 'wb') as f:
+            f.write(make_scan(fmt))
+
+
+def _measure(decoder, path, target_size, queue):
+    """Run in a fresh process so peak RSS reflects only this decoder"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        decoder(data, target_size)
+    elapsed_ms = (time.perf_counter() - start) / REPEATS * 1000
+    queue.put((elapsed_ms, max(_peak_rss_kb() - baseline, 0) / 1024))
+
+
+# Peak RSS survives fork/exec, so the parent must stay small: scans are generated
+# in a throwaway process and every measurement runs in its own spawned process
+_ctx = multiprocessing.get_context('spawn')
+
+
+def prepare_scans(directory):
+    """Encode the synthetic scans to disk without growing this process"""
+    process = _ctx.Process(target=_write_scans, args=(directory,))
+    process.start()
+    process.join()
+
+
+def measure(decoder, path, target_size):
+    """Return (mean decode time in ms, peak memory growth in MB)"""
+    queue = _ctx.Queue()
+    process = _ctx.Process(target=_measure, args=(decoder, path, target_size, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    print("=" * 78)
+    print(f"  IMAGE DECODE BENCHMARK ({SCAN_SIZE[0]}x{SCAN_SIZE[1]} grayscale scan)")
+    print("=" * 78)
+    print(f"{'Format':<8}{'Target':<12}{'Full (ms)':>12}{'Reduced (ms)':>14}"
+          f"{'Full (MB)':>12}{'Reduced (MB)':>14}{'Speedup':>9}")
+    print("-" * 78)
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_scans(directory)
+        for fmt in FORMATS:
+            path = os.path.join(directory, f"scan.{fmt.lower()}")
+            for target_size in TARGET_SIZES:
+                full_ms, full_mb = measure(decode_full, path, target_size)
+                reduced_ms, reduced_mb = measure(decode_reduced, path, target_size)
+                target = f"{target_size[0]}x{target_size[1]}"
+                print(f"{fmt:<8}{target:<12}{full_ms:>12.1f}{reduced_ms:>14.1f}"
+                      f"{full_mb:>12.1f}{reduced_mb:>14.1f}{full_ms / reduced_ms:>8.1f}x")
+
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Login Benchmark - Password verification under concurrent logins
+Compares hashing on every request thread with the bounded password service, and measures how
+long a small unrelated request (standing in for /detect) takes while the logins are running
+"""
+import statistics
+import threading
+import time
+
+import numpy as np
+from werkzeug.security import check_password_hash
+
+from password_service import PasswordService, PasswordServiceBusy
+
+
+DURATION = 5.0  # Seconds per measurement
+CLIENTS = 16  # Concurrent login requests
+WORKERS = 2  # Password service pool size
+MAX_PENDING = 12  # Password service queue limit
+SCHEMES = ['pbkdf2:sha256:600000', 'scrypt:32768:8:1', 'argon2:3:65536:4']
+PASSWORD = 'Correct-Horse-42'
+
+
+def other_request(matrix):
+    """A small piece of CPU work that should stay fast while logins are hashing"""
+    start = time.perf_counter()
+    for _ in range(5):
+        matrix = np.tanh(matrix @ matrix.T / len(matrix))
+    return time.perf_counter() - start
+
+
+def run(login):
+    """Run CLIENTS login loops and one other-request loop for DURATION; returns the measurements"""
+    stop = threading.Event()
+    login_times, probe_times = [], []
+    rejected = [0]
+    lock = threading.Lock()
+
+    def client():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                login()
+            except PasswordServiceBusy:
+                with lock:
+                    rejected[0] += 1
+                time.sleep(0.05)  # A client told to retry backs off
+                continue
+            with lock:
+                login_times.append(time.perf_counter() - start)
+
+    def probe():
+        matrix = np.random.default_rng(0).random((200, 200))
+        while not stop.is_set():
+            probe_times.append(other_request(matrix))
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=client) for _ in range(CLIENTS)] + [threading.Thread(target=probe)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    login_times.sort()
+    return {
+        'logins_per_s': len(login_times) / elapsed,
+        'p95_login_ms': login_times[int(len(login_times) * 0.95)] * 1000 if login_times else float('nan'),
+        'rejected': rejected[0],
+        'probe_ms': statistics.median(probe_times) * 1000 if probe_times else float('nan')
+    }
+
+
+def main():
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        SCHEMES.remove('argon2:3:65536:4')
+        print("⚠️  argon2-cffi not installed, skipping argon2")
+
+    matrix = np.random.default_rng(0).random((200, 200))
+    idle_probe = statistics.median(other_request(matrix) for _ in range(20)) * 1000
+
+    print("=" * 84)
+    print(f"  LOGIN BENCHMARK ({CLIENTS} concurrent logins, pool of {WORKERS}, queue limit {MAX_PENDING})")
+    print(f"  Other request on an idle server: {idle_probe:.1f} ms")
+    print("=" * 84)
+    print(f"{'Scheme':<22}{'Path':<16}{'Verify ms':>10}{'Logins/s':>10}{'p95 ms':>10}{'Rejected':>10}{'Other ms':>10}")
+    print("-" * 84)
+
+    for scheme in SCHEMES:
+        service = PasswordService(scheme, max_workers=WORKERS, max_pending=MAX_PENDING)
+        password_hash = service.hash(PASSWORD)
+        start = time.perf_counter()
+        assert service._verify(password_hash, PASSWORD)
+        verify_ms = (time.perf_counter() - start) * 1000
+
+        if scheme.startswith('argon2'):
+            direct = lambda: service._verify(password_hash, PASSWORD)
+        else:
+            direct = lambda: check_password_hash(password_hash, PASSWORD)
+        paths = (('request thread', direct), ('service', lambda: service.verify(password_hash, PASSWORD)))
+        for label, login in paths:
+            result = run(login)
+            print(f"{scheme:<22}{label:<16}{verify_ms:>10.1f}{result['logins_per_s']:>10.1f}"
+                  f"{result['p95_login_ms']:>10.0f}{result['rejected']:>10}{result['probe_ms']:>10.1f}")
+
+    print("=" * 84)
+
+
+if __name__ == "__main__":
+    main()
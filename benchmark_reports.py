@@ -0,0 +1,87 @@
+"""
+Report Rendering Benchmark - Compare the per-request report path against the precompiled template
+Run this to measure report throughput (reports per second)
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from report_renderer import ReportTemplate, build_report, render_report
+
+
+DURATION = 3.0  # Seconds per measurement
+
+REPORT = {
+    'patient_name': 'Benchmark Patient',
+    'patient_id': 'BENCH-0001',
+    'patient_age': 67,
+    'scan_date': '2026-01-15',
+    'disease_name': "Alzheimer's Disease",
+    'prediction': 'Mild Demented',
+    'confidence': 87.4,
+    'image_path': 'scan.jpg',
+    'notes': 'Follow-up MRI in six months.\nCompare with prior study.',
+    'generated_at': datetime(2026, 1, 15, 9, 30)
+}
+
+
+def make_rendition(path):
+    """Write a report-sized synthetic scan, as the derivative cache would"""
+    y, x = np.mgrid[0:600, 0:600]
+    pixels = np.clip(255 - np.hypot(x - 300, y - 300) / 300 * 255, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels, mode='L').save(path, format='JPEG', quality=85)
+
+
+def render_per_request(report, image_path, reports_dir):
+    """Original path: styles and static blocks rebuilt per call, PDF written to disk and read back"""
+    pdf_path = os.path.join(reports_dir, f"report_{time.perf_counter_ns()}.pdf")
+    build_report(pdf_path, report, image_path, template=ReportTemplate())
+    with open(pdf_path, 'rb') as f:
+        return f.read()
+
+
+def render_precompiled(report, image_path, reports_dir):
+    """New path: shared template, rendered into memory"""
+    return render_report(report, image_path)
+
+
+def measure(renderer, report, image_path, reports_dir):
+    """Return (reports per second, mean ms per report)"""
+    renderer(report, image_path, reports_dir)  # Warm-up
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        renderer(report, image_path, reports_dir)
+        count += 1
+    elapsed = time.perf_counter() - start
+    return count / elapsed, elapsed / count * 1000
+
+
+def main():
+    print("=" * 60)
+    print("  REPORT RENDERING BENCHMARK")
+    print("=" * 60)
+    print(f"{'Path':<16}{'Image':<8}{'Reports/s':>12}{'ms/report':>12}{'Speedup':>10}")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = os.path.join(directory, 'scan.jpg')
+        make_rendition(image_path)
+        reports_dir = os.path.join(directory, 'reports')
+        os.makedirs(reports_dir)
+
+        for label, report, source in (('yes', REPORT, image_path), ('no', dict(REPORT, image_path=''), None)):
+            old_rate, old_ms = measure(render_per_request, report, source, reports_dir)
+            new_rate, new_ms = measure(render_precompiled, report, source, reports_dir)
+            print(f"{'per-request':<16}{label:<8}{old_rate:>12.1f}{old_ms:>12.1f}")
+            print(f"{'precompiled':<16}{label:<8}{new_rate:>12.1f}{new_ms:>12.1f}{new_rate / old_rate:>9.1f}x")
+
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Upload compaction job for NeuroSight
+Re-encodes stored scans losslessly and moves old originals to the cold tier
+Run periodically (e.g. nightly from cron); it is safe to re-run and to interrupt
+"""
+import io
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+
+from neurosight_app_with_auth import app, db, upload_store
+from models import UploadBlob
+from upload_store import shard_key
+
+BATCH_SIZE = 100
+
+# Lossy sources (JPEG) are left alone: a lossless re-encode of decoded JPEG pixels is larger
+COMPACTABLE_FORMATS = ('PNG', 'TIFF', 'BMP')
+# Modes the PNG encoder can write (CMYK, F, LAB etc. cannot be re-encoded losslessly here)
+COMPACTABLE_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I;16')
+
+
+def _encode_candidates(image):
+    """Lossless encodings to try, as (encoding name, extension, bytes)"""
+    candidates = []
+    if image.mode in ('L', 'RGB', 'RGBA'):
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', lossless=True, quality=100, method=6)
+        candidates.append(('webp-lossless', '.webp', buffer.getvalue()))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    candidates.append(('png-optimized', '.png', buffer.getvalue()))
+    return candidates
+
+
+def _pixels_equal(original, encoded_data):
+    """Decode the re-encoded bytes and verify every pixel matches the original"""
+    with Image.open(io.BytesIO(encoded_data)) as decoded:
+        decoded.load()
+        reference = original
+        # Lossless WebP stores grayscale as RGB with equal channels
+        if original.mode == 'L' and decoded.mode == 'RGB':
+            reference = original.convert('RGB')
+        if reference.mode != decoded.mode or reference.size != decoded.size:
+            return False
+        return np.array_equal(np.asarray(reference), np.asarray(decoded))
+
+
+def compact_blob(blob, dry_run=False):
+    """Re-encode one blob losslessly if that makes it smaller; returns bytes reclaimed"""
+    backend = upload_store.backend_for(blob)
+    data = backend.read(blob.storage_key)
+
+    with Image.open(io.BytesIO(data)) as image:
+        compactable = (image.format in COMPACTABLE_FORMATS and getattr(image, 'n_frames', 1) == 1
+                       and image.mode in COMPACTABLE_MODES)
+        if compactable:
+            image.load()
+            candidates = sorted(_encode_candidates(image), key=lambda candidate: len(candidate[2]))
+        else:
+            candidates = []
+        for encoding, ext, encoded in candidates:
+            if len(encoded) >= len(data):
+                break
+            if not _pixels_equal(image, encoded):
+                print(f"⚠️  {encoding} failed pixel verification for {blob.sha256[:12]}, skipping")
+                continue
+            if dry_run:
+                return len(data) - len(encoded)
+
+            old_key = blob.storage_key
+            new_key = shard_key(blob.sha256, ext)
+            backend.write(new_key, encoded)
+            blob.storage_key = new_key
+            blob.encoding = encoding
+            blob.stored_size = len(encoded)
+            # Repoint the index before removing the old object, so reads never dangle
+            db.session.commit()
+            if new_key != old_key:
+                backend.delete(old_key)
+            return len(data) - len(encoded)
+
+    # Nothing smaller, or not a format/mode we re-encode; record that so the blob is not retried every run
+    if not dry_run:
+        blob.encoding = 'original'
+        blob.stored_size = len(data)
+        db.session.commit()
+    return 0
+
+
+def move_to_cold(blob, dry_run=False):
+    """Move a blob from the hot backend to the cold tier; returns bytes moved"""
+    hot = upload_store.backend
+    data = hot.read(blob.storage_key)
+    if dry_run:
+        return len(data)
+    upload_store.cold_backend.write(blob.storage_key, data)
+    blob.tier = 'cold'
+    db.session.commit()
+    hot.delete(blob.storage_key)
+    return len(data)
+
+
+def _batches(query):
+    """Iterate a query in primary-key order, one committed batch at a time"""
+    last_sha = ''
+    while True:
+        blobs = query.filter(UploadBlob.sha256 > last_sha).order_by(UploadBlob.sha256).limit(BATCH_SIZE).all()
+        if not blobs:
+            return
+        last_sha = blobs[-1].sha256
+        yield blobs
+
+
+def run_compaction(cold_after_days=None, dry_run=False):
+    """Run one compaction pass and report the bytes reclaimed"""
+    with app.app_context():
+        if cold_after_days is None:
+            cold_after_days = app.config['UPLOAD_COLD_AFTER_DAYS']
+
+        reclaimed = compacted = failed = 0
+        for blobs in _batches(UploadBlob.query.filter(UploadBlob.encoding.is_(None))):
+            for blob in blobs:
+                try:
+                    saved = compact_blob(blob, dry_run=dry_run)
+                except Exception as e:
+                    db.session.rollback()
+                    failed += 1
+                    print(f"✗ Could not compact {blob.sha256[:12]}: {e}")
+                    continue
+                if saved:
+                    compacted += 1
+                    reclaimed += saved
+
+        moved_bytes = moved = 0
+        if upload_store.cold_backend is not None:
+            cutoff = datetime.utcnow() - timedelta(days=cold_after_days)
+            old_blobs = UploadBlob.query.filter(UploadBlob.tier == 'hot', UploadBlob.created_at < cutoff)
+            for blobs in _batches(old_blobs):
+                for blob in blobs:
+                    try:
+                        moved_bytes += move_to_cold(blob, dry_run=dry_run)
+                        moved += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        failed += 1
+                        print(f"✗ Could not move {blob.sha256[:12]} to cold storage: {e}")
+
+        prefix = "[dry run] " if dry_run else ""
+        print(f"\n✅ {prefix}Compaction completed!")
+        print(f"   Re-encoded: {compacted} blobs, {reclaimed / (1024 * 1024):.2f} MB reclaimed")
+        print(f"   Cold tier: {moved} blobs older than {cold_after_days} days, "
+              f"{moved_bytes / (1024 * 1024):.2f} MB moved off hot storage")
+        if failed:
+            print(f"   ⚠️  {failed} blobs failed and will be retried next run")
+        return reclaimed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compact and tier the upload store')
+    parser.add_argument('--cold-after-days', type=int, help='Move originals older than this to the cold tier')
+    parser.add_argument('--dry-run', action='store_true', help='Report savings without changing anything')
+    args = parser.parse_args()
+
+    run_compaction(cold_after_days=args.cold_after_days, dry_run=args.dry_run)
@@ -0,0 +1,150 @@
+"""
+Database engine profiles for NeuroSight
+Engine options for SQLALCHEMY_ENGINE_OPTIONS, chosen from the database URL:
+
+SQLite: every connection runs in WAL mode (readers never wait for the writer) with
+synchronous=NORMAL, a busy timeout and memory-mapped reads. Writers in one process also
+queue on a lock, held from a transaction's first write until it commits or rolls back, so
+threads hand the database over directly instead of polling it through SQLite's busy handler.
+Other processes still wait through the busy timeout.
+
+Postgres: a connection pool sized to the request threads plus the background workers, with
+pre-ping (connections dropped by the server are replaced before use) and recycling.
+"""
+import sqlite3
+import threading
+
+
+READ_STATEMENTS = {'SELECT', 'PRAGMA', 'EXPLAIN', 'ANALYZE'}
+END_STATEMENTS = {'COMMIT', 'END', 'ROLLBACK'}
+
+
+def database_url(url):
+    """SQLAlchemy URL for DATABASE_URL; hosting providers hand out postgres://, which SQLAlchemy rejects"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that applies the profile's pragmas and takes the process-wide write lock
+    Subclassed per engine by sqlite_connection_class(), which sets the class attributes.
+    """
+    PRAGMAS = ()
+    write_lock = None  # threading.Lock shared by the engine's connections, or None
+    lock_timeout = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.holds_write_lock = False
+        for pragma in self.PRAGMAS:
+            self.execute(f'PRAGMA {pragma}')
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or SQLiteCursor)
+
+    # The built-in shortcuts run their statement in C, past SQLiteCursor.execute
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def acquire_write_lock(self):
+        if self.write_lock is None or self.holds_write_lock:
+            return
+        if not self.write_lock.acquire(timeout=self.lock_timeout):
+            raise sqlite3.OperationalError('database is locked (timed out waiting for the write lock)')
+        self.holds_write_lock = True
+
+    def release_write_lock(self):
+        if self.holds_write_lock:
+            self.holds_write_lock = False
+            self.write_lock.release()
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self.release_write_lock()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self.release_write_lock()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.release_write_lock()
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """Takes the connection's write lock before the first statement that is not a read"""
+
+    def _before(self, sql):
+        words = sql.split(None, 1)
+        if words and words[0].upper() not in READ_STATEMENTS:
+            self.connection.acquire_write_lock()
+
+    def _after(self, sql):
+        words = sql.split(None, 2)
+        # A transaction ended with a statement rather than commit()/rollback()
+        if words and words[0].upper() in END_STATEMENTS and (len(words) == 1 or words[1].upper() != 'TO'):
+            self.connection.release_write_lock()
+
+    def execute(self, sql, parameters=()):
+        self._before(sql)
+        result = super().execute(sql, parameters)
+        self._after(sql)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        self._before(sql)
+        result = super().executemany(sql, seq_of_parameters)
+        self._after(sql)
+        return result
+
+
+def sqlite_connection_class(busy_timeout=5000, mmap_size=256 * 1024 * 1024, write_lock=True):
+    """
+    Connection class for one engine; pass as connect_args={'factory': ...}
+    busy_timeout is in milliseconds and also bounds the wait for the write lock.
+    """
+    pragmas = ('journal_mode = WAL', 'synchronous = NORMAL',
+               f'busy_timeout = {int(busy_timeout)}', f'mmap_size = {int(mmap_size)}')
+    return type('SQLiteConnection', (SQLiteConnection,), {
+        'PRAGMAS': pragmas,
+        'write_lock': threading.Lock() if write_lock else None,
+        'lock_timeout': busy_timeout / 1000
+    })
+
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at url, from the DB_* / SQLITE_* settings in config"""
+    options = {'query_cache_size': config['DB_STATEMENT_CACHE_SIZE']}  # Compiled SQL reused across requests
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            return options  # Nothing to tune for an in-memory database
+        options['connect_args'] = {
+            'factory': sqlite_connection_class(config['SQLITE_BUSY_TIMEOUT'], config['SQLITE_MMAP_SIZE'],
+                                               config['SQLITE_WRITE_LOCK']),
+            'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000
+        }
+        return options
+
+    if url.startswith('postgresql'):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_pre_ping=True
+        )
+        if url.startswith('postgresql+psycopg:'):
+            # psycopg 3 prepares a statement on the server once it has run this many times on a connection
+            options['connect_args'] = {'prepare_threshold': config['DB_PREPARE_THRESHOLD']}
+    return options
@@ -5,7 +5,6 @@ Run this script to add, view, update, or delete users from the database
 
 from neurosight_app_with_auth import app, db
 from models import User
-from werkzeug.security import generate_password_hash
 import sys
 
 
@@ -214,7 +213,7 @@ def add_test_user():
         )
         
         if password:
-            user.password_hash = generate_password_hash(password)
+            user.set_password(password)
         
         # Optional: Add professional details
         add_details = input("\nAdd professional details? (y/n): ").strip().lower()
@@ -0,0 +1,202 @@
+"""
+Email outbox for NeuroSight
+Request handlers queue messages in the email_outbox table and return immediately;
+a background sender delivers them, retrying failures with exponential backoff
+"""
+import random
+import threading
+from datetime import datetime, timedelta
+from email.utils import formataddr
+
+from flask_mail import Message
+from sqlalchemy import func
+
+from models import db, EmailOutbox
+
+
+DUE_STATUSES = ('pending', 'sending')
+
+
+class OutboxSender:
+    """
+    Background thread that delivers queued email
+    Each row is claimed with a conditional UPDATE that also leases it for EMAIL_SEND_TIMEOUT
+    seconds, so senders in several worker processes never deliver the same row twice, and a
+    row left in 'sending' by a crashed worker is retried once its lease runs out.
+    """
+
+    def __init__(self, app, transport, batch_size=20):
+        self.app = app
+        self.transport = transport  # mail_transport.MailTransport
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def queue(self, msg, kind):
+        """Store a Flask-Mail message in the outbox and nudge the sender; returns the queued rows"""
+        sender = msg.sender
+        if isinstance(sender, tuple):
+            sender = formataddr(sender)
+        rows = [
+            EmailOutbox(kind=kind, recipient=recipient, sender=sender, subject=msg.subject,
+                        html_body=msg.html, text_body=msg.body)
+            for recipient in msg.recipients
+        ]
+        try:
+            db.session.add_all(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.wake()
+        return rows
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+        print("✓ Email outbox sender started")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Deliver now instead of waiting for the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Cleared before delivering, so a message queued mid-batch still wakes the next pass
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    processed = self.deliver_due()
+            except Exception as e:
+                print(f"✗ Email outbox error: {e}")
+                processed = 0
+            # A full batch means more may be due; otherwise sleep until woken or the next poll
+            if processed < self.batch_size:
+                self._wake.wait(self.app.config['EMAIL_POLL_INTERVAL'])
+
+    def deliver_due(self):
+        """Deliver up to batch_size due messages over one SMTP connection; returns how many were attempted"""
+        now = datetime.utcnow()
+        due_ids = [row_id for (row_id,) in db.session.query(EmailOutbox.id).filter(
+            EmailOutbox.status.in_(DUE_STATUSES),
+            EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at).limit(self.batch_size)]
+
+        rows = list(self._claim(due_ids, now))
+        if not rows:
+            return 0
+        errors = self.transport.send_batch([self._message(row) for row in rows])
+        for row, error in zip(rows, errors):
+            if error is None:
+                row.status = 'sent'
+                row.sent_at = datetime.utcnow()
+                row.last_error = None
+                self._clear_bodies(row)
+                print(f"✓ {row.kind} email sent to {row.recipient}")
+            else:
+                self._record_failure(row, error)
+        db.session.commit()
+        return len(rows)
+
+    def _claim(self, due_ids, now):
+        """Claim rows one at a time, skipping any another sender got to first"""
+        lease_until = now + timedelta(seconds=self.app.config['EMAIL_SEND_TIMEOUT'])
+        for row_id in due_ids:
+            claimed = EmailOutbox.query.filter(
+                EmailOutbox.id == row_id,
+                EmailOutbox.status.in_(DUE_STATUSES),
+                EmailOutbox.next_attempt_at <= now
+            ).update({
+                'status': 'sending',
+                'next_attempt_at': lease_until,
+                'attempts': EmailOutbox.attempts + 1
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                yield db.session.get(EmailOutbox, row_id)
+
+    def _message(self, row):
+        return Message(subject=row.subject, recipients=[row.recipient], sender=row.sender,
+                       html=row.html_body, body=row.text_body)
+
+    def _record_failure(self, row, error):
+        row.last_error = str(error)[:1000]
+        if row.attempts >= self.app.config['EMAIL_MAX_ATTEMPTS']:
+            row.status = 'failed'
+            self._clear_bodies(row)
+            print(f"✗ Giving up on {row.kind} email to {row.recipient} after {row.attempts} attempts: {error}")
+            return
+        delay = self.retry_delay(row.attempts)
+        row.status = 'pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        print(f"⚠️  {row.kind} email to {row.recipient} failed ({error}), retrying in {delay:.0f}s")
+
+    @staticmethod
+    def _clear_bodies(row):
+        """Drop the body once a row is finished with; OTP codes and reset links must not outlive delivery"""
+        row.html_body = None
+        row.text_body = None
+
+    def retry_delay(self, attempts):
+        """Exponential backoff with +/-20% jitter, so retries from a burst do not line up"""
+        base = self.app.config['EMAIL_RETRY_BASE_SECONDS']
+        delay = min(base * 2 ** (attempts - 1), self.app.config['EMAIL_RETRY_MAX_SECONDS'])
+        return delay * random.uniform(0.8, 1.2)
+
+
+def outbox_status():
+    """Row counts per delivery status"""
+    return dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+
+
+def clear_finished_bodies():
+    """Blank the bodies of sent and failed rows (the sender does this as it goes; for rows from before it did)"""
+    cleared = EmailOutbox.query.filter(
+        EmailOutbox.status.in_(('sent', 'failed')),
+        (EmailOutbox.html_body.isnot(None)) | (EmailOutbox.text_body.isnot(None))
+    ).update({'html_body': None, 'text_body': None}, synchronize_session=False)
+    db.session.commit()
+    return cleared
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Inspect and deliver the email outbox')
+    parser.add_argument('--drain', action='store_true', help='Deliver every due message now, in the foreground')
+    parser.add_argument('--clear-bodies', action='store_true', help='Blank the bodies of already sent and failed messages')
+    args = parser.parse_args()
+
+    # The foreground run does the delivering; don't also start the app's background sender
+    os.environ['EMAIL_SENDER_THREAD'] = 'False'
+    from neurosight_app_with_auth import app, email_sender, mail_transport
+
+    with app.app_context():
+        if args.clear_bodies:
+            print(f"✓ Cleared the bodies of {clear_finished_bodies()} sent/failed messages")
+        if args.drain:
+            total = 0
+            while True:
+                attempted = email_sender.deliver_due()
+                total += attempted
+                if attempted < email_sender.batch_size:
+                    break
+            print(f"\n✅ Attempted {total} deliveries")
+            print("\n📈 SMTP transport:")
+            for name, value in mail_transport.metrics.snapshot().items():
+                print(f"   {name}: {value}")
+
+        print("\n📬 Outbox status:")
+        for status, count in sorted(outbox_status().items()):
+            print(f"   {status}: {count}")
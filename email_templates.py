@@ -0,0 +1,153 @@
+"""
+Email templates for NeuroSight
+Emails are Jinja templates under templates/email/, compiled once and kept in the environment's cache.
+Shared CSS is inlined into the template source at compile time, and the plain-text part of each
+email is compiled from its HTML template, so rendering a message only fills in the variables.
+"""
+import os
+import re
+from html.parser import HTMLParser
+
+from flask_mail import Message
+from jinja2 import Environment, FileSystemLoader, TemplateNotFound, select_autoescape
+
+
+# /* @inline email/styles.css */ in a template is replaced by that file's contents
+INLINE_PATTERN = re.compile(r'/\*\s*@inline\s+([\w./-]+)\s*\*/')
+JINJA_STATEMENT = re.compile(r'\{%.*?%\}', re.S)
+TEMPLATE_REFERENCE = re.compile(r'(\{%-?\s*(?:extends|include|import)\s+["\'][^"\']+)\.html(["\'])')
+
+BLOCK_TAGS = {'p', 'div', 'center', 'table', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr'}
+LINE_TAGS = {'br', 'li', 'tr'}
+SKIPPED_TAGS = {'head', 'style', 'script', 'title'}
+
+
+class _TextTemplateBuilder(HTMLParser):
+    """Turns an HTML template into a plain-text template; Jinja expressions pass through as text"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+        self.links = []  # (href, index of the first part of the link text)
+        self.lists = []  # Item counter per open list; None for <ul>
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n\n')
+        elif tag in LINE_TAGS:
+            self.parts.append('\n')
+        if tag == 'ul':
+            self.lists.append(None)
+        elif tag == 'ol':
+            self.lists.append(0)
+        elif tag == 'li' and self.lists:
+            if self.lists[-1] is None:
+                self.parts.append('- ')
+            else:
+                self.lists[-1] += 1
+                self.parts.append(f"{self.lists[-1]}. ")
+        elif tag == 'a':
+            self.links.append((dict(attrs).get('href'), len(self.parts)))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n\n')
+        if tag in ('ul', 'ol') and self.lists:
+            self.lists.pop()
+        elif tag == 'a' and self.links:
+            href, start = self.links.pop()
+            if href and not href.startswith('mailto:') and ''.join(self.parts[start:]).strip() != href:
+                self.parts.append(f" ({href})")
+
+    def handle_data(self, data):
+        if self.skipping:
+            # Keep block/if tags from skipped regions so the template stays balanced
+            self.parts.append(' '.join(JINJA_STATEMENT.findall(data)))
+        else:
+            self.parts.append(re.sub(r'\s+', ' ', data))
+
+    def template(self):
+        return TEMPLATE_REFERENCE.sub(r'\1.txt\2', ''.join(self.parts))
+
+
+def html_to_text_template(source):
+    builder = _TextTemplateBuilder()
+    builder.feed(source)
+    builder.close()
+    return builder.template()
+
+
+def tidy_text(text):
+    """Strip the indentation and blank-line runs left by markup and template tags"""
+    lines = [line.strip() for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip() + '\n'
+
+
+class EmailTemplateLoader(FileSystemLoader):
+    """
+    Template loader that expands @inline markers in .html templates and serves name.txt
+    as a plain-text template generated from name.html, unless name.txt exists on disk
+    """
+
+    def get_source(self, environment, template):
+        if template.endswith('.txt'):
+            try:
+                return FileSystemLoader.get_source(self, environment, template)
+            except TemplateNotFound:
+                source, filename, uptodate = FileSystemLoader.get_source(self, environment, template[:-4] + '.html')
+                return html_to_text_template(source), filename, uptodate
+
+        source, filename, uptodate = FileSystemLoader.get_source(self, environment, template)
+        inlined = []
+
+        def inline(match):
+            contents, _, is_current = FileSystemLoader.get_source(self, environment, match.group(1))
+            inlined.append(is_current)
+            return contents
+
+        source = INLINE_PATTERN.sub(inline, source)
+        return source, filename, lambda: uptodate() and all(is_current() for is_current in inlined)
+
+
+class EmailTemplates:
+    """Compiled email templates; render() returns the HTML and plain-text bodies"""
+
+    def __init__(self, template_folder, auto_reload=False):
+        self.env = Environment(
+            loader=EmailTemplateLoader(template_folder),
+            autoescape=select_autoescape(['html']),
+            auto_reload=auto_reload,
+            cache_size=-1  # Never evict: the set of email templates is small and fixed
+        )
+
+    def names(self):
+        """Email templates that can be sent; files starting with _ are layouts and shared styles"""
+        return sorted(
+            os.path.basename(name)[:-5]
+            for name in self.env.list_templates(extensions=['html'])
+            if name.startswith('email/') and not os.path.basename(name).startswith('_')
+        )
+
+    def precompile(self):
+        """Compile every email template (HTML and text) up front, so the first send is as cheap as the rest"""
+        names = self.names()
+        for name in names:
+            self.env.get_template(f"email/{name}.html")
+            self.env.get_template(f"email/{name}.txt")
+        return len(names)
+
+    def render(self, name, **context):
+        """Return (html, text) for templates/email/<name>.html"""
+        html = self.env.get_template(f"email/{name}.html").render(**context)
+        text = tidy_text(self.env.get_template(f"email/{name}.txt").render(**context))
+        return html, text
+
+    def message(self, name, subject, recipients, sender=None, **context):
+        """Build a Flask-Mail message with both parts rendered from the template"""
+        html, text = self.render(name, **context)
+        return Message(subject=subject, recipients=recipients, sender=sender, html=html, body=text)
@@ -6,7 +6,9 @@ backlog = 2048
 
 # Worker processes
 workers = 1  # Free tier has limited memory
-worker_class = 'sync'
+# Threads share the loaded models; slow work (password hashing, report rendering) runs on bounded pools
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
 worker_connections = 1000
 timeout = 120  # AI models take time to load
 keepalive = 5
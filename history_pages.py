@@ -0,0 +1,103 @@
+"""
+History pagination for NeuroSight
+Analyses are listed newest first and paged with a cursor on (created_at, id) instead of an
+offset, so every page is an index seek from where the previous one ended, however long the
+history is. Filters map onto the composite indexes declared on AnalysisHistory.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import defer
+
+from models import AnalysisHistory
+
+
+class HistoryQueryError(ValueError):
+    """Invalid filter or cursor; the message is shown to the client"""
+
+
+def encode_cursor(analysis):
+    """Opaque cursor pointing just past this analysis"""
+    position = f"{analysis.created_at.isoformat()}|{analysis.id}"
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        created_at, analysis_id = position.split('|')
+        return datetime.fromisoformat(created_at), int(analysis_id)
+    except ValueError:
+        raise HistoryQueryError('Invalid cursor')
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise HistoryQueryError(f'{name} must be a date in YYYY-MM-DD format')
+
+
+def _parse_confidence(value, name):
+    try:
+        confidence = float(value)
+    except ValueError:
+        raise HistoryQueryError(f'{name} must be a number between 0 and 1')
+    if not 0 <= confidence <= 1:
+        raise HistoryQueryError(f'{name} must be a number between 0 and 1')
+    return confidence
+
+
+def parse_filters(args):
+    """
+    Read the history filters from query arguments
+    disease, prediction, min_confidence / max_confidence (0-1) and date_from / date_to
+    (YYYY-MM-DD, both inclusive); empty values are ignored.
+    """
+    filters = {}
+    for name in ('disease', 'prediction'):
+        if args.get(name):
+            filters[name] = args.get(name)
+    for name in ('min_confidence', 'max_confidence'):
+        if args.get(name):
+            filters[name] = _parse_confidence(args.get(name), name)
+    for name in ('date_from', 'date_to'):
+        if args.get(name):
+            filters[name] = _parse_date(args.get(name), name)
+    return filters
+
+
+def history_query(user_id, filters=None, cursor=None):
+    """A user's analyses after the cursor, newest first, with the filters applied"""
+    filters = filters or {}
+    query = AnalysisHistory.query.filter(AnalysisHistory.user_id == user_id)\
+        .options(defer(AnalysisHistory.series_details))  # Per-slice JSON is only needed on the report
+
+    if 'disease' in filters:
+        query = query.filter(AnalysisHistory.disease_type == filters['disease'])
+    if 'prediction' in filters:
+        query = query.filter(AnalysisHistory.prediction == filters['prediction'])
+    if 'min_confidence' in filters:
+        query = query.filter(AnalysisHistory.confidence >= filters['min_confidence'])
+    if 'max_confidence' in filters:
+        query = query.filter(AnalysisHistory.confidence <= filters['max_confidence'])
+    if 'date_from' in filters:
+        query = query.filter(AnalysisHistory.created_at >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(AnalysisHistory.created_at < filters['date_to'] + timedelta(days=1))
+    if cursor:
+        query = query.filter(tuple_(AnalysisHistory.created_at, AnalysisHistory.id) < decode_cursor(cursor))
+    return query.order_by(AnalysisHistory.created_at.desc(), AnalysisHistory.id.desc())
+
+
+def history_page(user_id, filters=None, cursor=None, limit=25):
+    """
+    One page of a user's analyses, newest first
+    Returns (analyses, next_cursor); next_cursor is None on the last page.
+    """
+    # One extra row tells whether there is a next page
+    rows = history_query(user_id, filters, cursor).limit(limit + 1).all()
+    analyses = rows[:limit]
+    next_cursor = encode_cursor(analyses[-1]) if len(rows) > limit else None
+    return analyses, next_cursor
@@ -0,0 +1,147 @@
+"""
+Identity cache for NeuroSight
+Flask-Login reloads the user on every authenticated request; this keeps a slim copy of the few
+columns most requests need in process memory, and loads the full users row only when a view
+reads or changes anything else.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User
+
+
+# Columns kept in the cache; everything else is read from the full row
+IDENTITY_FIELDS = ('id', 'email', 'full_name', 'role', 'is_active', 'is_verified', 'email_verified',
+                   'onboarding_completed', 'profile_photo_url')
+
+
+class UserDeleted(Exception):
+    """The users row behind a cached identity is gone (deleted by another process since it was cached)"""
+
+    def __init__(self, user_id):
+        super().__init__(f"User {user_id} no longer exists")
+        self.user_id = user_id
+
+
+class UserIdentity(UserMixin):
+    """
+    Stand-in for User as current_user
+    Reads of the cached columns are served from the cache. Any other attribute or method, and any
+    assignment, loads the User row for this request; from then on everything goes to the row, so a
+    view that edits the user sees its own changes. API token identities carry only the token's claims.
+    """
+
+    def __init__(self, fields):
+        object.__setattr__(self, '_fields', fields)  # Shared with the cache; never modified
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def user(self):
+        """The full User row, loaded on first use; raises UserDeleted if the row is gone"""
+        if self._user is None:
+            user = db.session.get(User, self._fields['id'])
+            if user is None:
+                raise UserDeleted(self._fields['id'])
+            object.__setattr__(self, '_user', user)
+        return self._user
+
+    @property
+    def is_active(self):
+        return self._fields['is_active'] if self._user is None else self._user.is_active
+
+    def needs_onboarding(self):
+        return not self.onboarding_completed
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._user is None and name in self._fields:
+            return self._fields[name]
+        return getattr(self.user, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.user, name, value)
+
+    def __repr__(self):
+        return f"<UserIdentity {self._fields['id']} {self._fields.get('email', 'token')}>"
+
+
+class IdentityCache:
+    """
+    Per-process TTL cache of user identities for the Flask-Login user_loader
+    Entries are dropped when this process updates or deletes the user (and again once that commits,
+    so a concurrent request cannot re-cache the old row). Changes made by other processes,
+    such as db_manager.py, are picked up when the entry expires after ttl seconds.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user id -> (expires at, fields)
+        self.hits = 0
+        self.misses = 0
+
+        event.listen(User, 'after_update', self._user_changed)
+        event.listen(User, 'after_delete', self._user_changed)
+        event.listen(Session, 'after_commit', self._session_finished)
+        event.listen(Session, 'after_soft_rollback', self._session_finished)
+        event.listen(Session, 'do_orm_execute', self._bulk_statement)
+
+    def load(self, user_id):
+        """Return a UserIdentity for user_id, or None if there is no such user"""
+        fields = self._get(user_id)
+        if fields is None:
+            row = db.session.query(*[getattr(User, name) for name in IDENTITY_FIELDS]).filter(User.id == user_id).first()
+            if row is None:
+                return None
+            fields = dict(row._mapping)
+            self._put(user_id, fields)
+        return UserIdentity(fields)
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+    def _put(self, user_id, fields):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, fields)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _user_changed(self, mapper, connection, target):
+        self.invalidate(target.id)
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('identity_cache_changed', set()).add(target.id)
+
+    def _session_finished(self, session, *args):
+        for user_id in session.info.pop('identity_cache_changed', ()):
+            self.invalidate(user_id)
+
+    def _bulk_statement(self, orm_execute_state):
+        # query.update() / query.delete() on users bypass the per-row events
+        if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+                orm_execute_state.bind_mapper is not None and orm_execute_state.bind_mapper.class_ is User:
+            self.clear()
@@ -0,0 +1,98 @@
+"""
+Derivative images for NeuroSight uploads
+Thumbnails and report-sized renditions are generated once per upload and cached on disk by content hash
+"""
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+# Longest side in pixels; the report rendition is 4 inches at 150 DPI
+RENDITIONS = {
+    'thumbnail': 256,
+    'report': 600,
+}
+
+# What Pillow raises for an upload it cannot decode (truncated, corrupt, or over MAX_IMAGE_PIXELS)
+RENDER_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+_generator = ThreadPoolExecutor(max_workers=1, thread_name_prefix='derivatives')
+
+
+def _report_generation_error(future):
+    error = future.exception()
+    if error is not None:
+        print(f"✗ Failed to generate image derivatives: {error}")
+
+
+class DerivativeCache:
+    """On-disk cache of derivative renditions, sharded like the upload store"""
+
+    def __init__(self, root, upload_store):
+        self.root = os.path.abspath(root)
+        self.upload_store = upload_store
+        os.makedirs(self.root, exist_ok=True)
+
+    def _cache_key(self, image_path):
+        """Content hash for content-addressed uploads; a hash of the name for legacy files"""
+        if self.upload_store.is_content_addressed(image_path):
+            return image_path.split('.', 1)[0]
+        return hashlib.sha256(image_path.encode('utf-8')).hexdigest()
+
+    def path(self, image_path, kind):
+        key = self._cache_key(image_path)
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}_{kind}.jpg")
+
+    def _render(self, source, kind, target):
+        """Render one rendition from a path or stream and write it atomically"""
+        size = RENDITIONS[kind]
+        with Image.open(source) as image:
+            # thumbnail() uses JPEG draft mode and reduce() internally, so large scans decode cheaply
+            image.thumbnail((size, size))
+            if image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Unique per render, so concurrent first requests for one rendition never share a temporary file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, format='JPEG', quality=85, optimize=True)
+                os.replace(tmp_path, target)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return target
+
+    def generate(self, image_path, data=None):
+        """Generate every missing rendition, from bytes already in memory when available"""
+        for kind in RENDITIONS:
+            target = self.path(image_path, kind)
+            if os.path.exists(target):
+                continue
+            source = io.BytesIO(data) if data is not None else self.upload_store.open(image_path)
+            if source is None:
+                return
+            self._render(source, kind, target)
+
+    def generate_async(self, image_path, data):
+        """Generate renditions in the background at upload time"""
+        future = _generator.submit(self.generate, image_path, data)
+        future.add_done_callback(_report_generation_error)
+        return future
+
+    def get(self, image_path, kind):
+        """
+        Path to a cached rendition, generating it on first request; None if the upload is missing
+        Raises one of RENDER_ERRORS if the upload cannot be decoded.
+        """
+        target = self.path(image_path, kind)
+        if os.path.exists(target):
+            return target
+        source = self.upload_store.open(image_path)
+        if source is None:
+            return None
+        return self._render(source, kind, target)
@@ -0,0 +1,54 @@
+"""
+Image upload helpers for NeuroSight
+Decodes uploads straight from memory, close to the size the models need
+"""
+import io
+
+from PIL import Image
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured pixel-count limit"""
+
+
+def open_image(data, max_pixels):
+    """
+    Open an uploaded image from an in-memory buffer
+    Only the header is read here, so oversized images are rejected before decoding
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} pixels; the limit is {max_pixels:,} pixels"
+        )
+    return image
+
+
+def decode_for_model(image, target_size):
+    """
+    Decode an opened image at a resolution close to (but not below) target_size
+    JPEGs use draft mode so the decoder applies DCT scaling; other formats are
+    shrunk with reduce(). The image keeps its original mode (e.g. grayscale 'L')
+    so RGB conversion can be deferred until the final model-sized tensor.
+    """
+    target_w, target_h = target_size
+    if image.format == 'JPEG':
+        image.draft(image.mode, (target_w, target_h))
+    image.load()
+    
+    factor = min(image.width // target_w, image.height // target_h)
+    if factor >= 2:
+        try:
+            image = image.reduce(factor)
+        except ValueError:
+            # Some modes (e.g. 16-bit 'I;16') are not supported by reduce()
+            pass
+    return image
+
+
+def encode_png(image):
+    """Encode a PIL image as PNG bytes"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
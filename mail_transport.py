@@ -0,0 +1,225 @@
+"""
+Pooled SMTP transport for NeuroSight
+Keeps a few authenticated SMTP connections open and sends queued messages in batches over them,
+so a burst of emails pays for one STARTTLS handshake and login instead of one per message
+"""
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Errors after which a connection cannot be trusted for the next message
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+def connection_lost(error):
+    """True if the session is gone, rather than the server refusing this one message"""
+    # SMTPException derives from OSError, so a refused recipient would otherwise count as a dropped session
+    return isinstance(error, CONNECTION_ERRORS) and (
+        not isinstance(error, smtplib.SMTPException)
+        or isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)))
+
+
+class TransportMetrics:
+    """Handshake and send-latency counters for one process"""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+        self.reconnects = 0
+        self.sent = 0
+        self.failed = 0
+        self._latencies = deque(maxlen=window)  # Seconds per message, most recent sends
+
+    def record_handshake(self, seconds):
+        with self._lock:
+            self.handshakes += 1
+            self.handshake_seconds += seconds
+
+    def record_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+
+    def record_send(self, seconds, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+                self._latencies.append(seconds)
+            else:
+                self.failed += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            count = len(latencies)
+            return {
+                'handshakes': self.handshakes,
+                'avg_handshake_ms': round(self.handshake_seconds / self.handshakes * 1000, 1) if self.handshakes else None,
+                'reconnects': self.reconnects,
+                'sent': self.sent,
+                'failed': self.failed,
+                'messages_per_handshake': round(self.sent / self.handshakes, 1) if self.handshakes else None,
+                'avg_send_ms': round(sum(latencies) / count * 1000, 1) if count else None,
+                'p95_send_ms': round(latencies[min(count - 1, int(count * 0.95))] * 1000, 1) if count else None,
+                'max_send_ms': round(latencies[-1] * 1000, 1) if count else None,
+            }
+
+
+class _ConnectionLost(Exception):
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+class _PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection  # flask_mail.Connection with an open, authenticated host
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def close(self):
+        host, self.connection.host = self.connection.host, None
+        if host is None:
+            return
+        try:
+            host.quit()
+        except Exception:
+            host.close()
+
+
+class MailTransport:
+    """
+    Pool of up to pool_size authenticated Flask-Mail connections
+    Connections idle for longer than idle_timeout are closed and re-established on next use,
+    since SMTP servers drop idle sessions. Must be used inside an app context.
+    """
+
+    def __init__(self, mail, pool_size=2, idle_timeout=60.0, timeout=30.0):
+        self.mail = mail
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.metrics = TransportMetrics()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _handshake(self, state):
+        """Open and authenticate an SMTP session, as flask_mail.Connection.configure_host does but with a timeout"""
+        start = time.perf_counter()
+        if state.use_ssl:
+            host = smtplib.SMTP_SSL(state.server, state.port, timeout=self.timeout)
+        else:
+            host = smtplib.SMTP(state.server, state.port, timeout=self.timeout)
+        host.set_debuglevel(int(state.debug))
+        try:
+            if state.use_tls:
+                host.starttls()
+            if state.username and state.password:
+                host.login(state.username, state.password)
+        except Exception:
+            host.close()
+            raise
+        self.metrics.record_handshake(time.perf_counter() - start)
+        return host
+
+    def _connect(self, connection):
+        # With MAIL_SUPPRESS_SEND (or TESTING) Flask-Mail expects no host and only signals the send
+        if not connection.mail.suppress:
+            connection.host = self._handshake(connection.mail)
+
+    def _checkout(self):
+        with self._lock:
+            pooled = self._idle.pop() if self._idle else None
+        if pooled is None:
+            pooled = _PooledConnection(self.mail.connect())  # Not entered: the pool manages the host
+            self._connect(pooled.connection)
+        elif time.monotonic() - pooled.last_used > self.idle_timeout:
+            pooled.close()
+            self.metrics.record_reconnect()
+            self._connect(pooled.connection)
+        return pooled
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; it is returned to the pool unless it broke"""
+        with self._slots:
+            pooled = self._checkout()
+            try:
+                yield pooled
+            except BaseException:
+                pooled.close()
+                raise
+            if pooled.broken:
+                pooled.close()
+                return
+            pooled.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(pooled)
+
+    def _send(self, pooled, message):
+        """Send one message, reconnecting once if the server dropped the session"""
+        try:
+            pooled.connection.send(message)
+            return
+        except CONNECTION_ERRORS as e:
+            if not connection_lost(e):
+                raise
+        try:
+            pooled.close()
+            self.metrics.record_reconnect()
+            self._connect(pooled.connection)
+            pooled.connection.send(message)
+        except CONNECTION_ERRORS as e:
+            if connection_lost(e):
+                raise _ConnectionLost(e)
+            if pooled.connection.host is None and not pooled.connection.mail.suppress:
+                raise _ConnectionLost(e)  # Reconnect failed (e.g. login refused)
+            raise
+
+    def send_batch(self, messages):
+        """
+        Send messages over one pooled connection; returns a list of errors (None for success)
+        A failure of one message does not affect the others, except when the server cannot be
+        reached: then this and the remaining messages fail with the connection error.
+        """
+        errors = []
+        try:
+            with self.connection() as pooled:
+                for message in messages:
+                    start = time.perf_counter()
+                    try:
+                        self._send(pooled, message)
+                    except _ConnectionLost as lost:
+                        pooled.broken = True
+                        errors.append(lost.error)
+                        self.metrics.record_send(time.perf_counter() - start, ok=False)
+                        break
+                    except Exception as e:
+                        errors.append(e)
+                    else:
+                        errors.append(None)
+                    self.metrics.record_send(time.perf_counter() - start, ok=errors[-1] is None)
+        except Exception as e:
+            # Could not open a connection at all
+            if not errors:
+                errors.append(e)
+        # Messages not attempted fail with the error that stopped the batch
+        if messages:
+            errors.extend([errors[-1]] * (len(messages) - len(errors)))
+        return errors
+
+    def send(self, message):
+        """Send one message, raising on failure"""
+        error = self.send_batch([message])[0]
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
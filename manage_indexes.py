@@ -0,0 +1,231 @@
+"""
+Index management for NeuroSight
+The indexes declared on the models are the managed set. This command compares them with the
+database, creates missing ones without blocking the app (CREATE INDEX CONCURRENTLY on
+Postgres; one short write transaction per index on SQLite), drops indexes that are no longer
+declared, and prints the query plan of each hot query.
+
+    python manage_indexes.py                   # Status of the managed indexes
+    python manage_indexes.py --create          # Create missing (and rebuild invalid) indexes
+    python manage_indexes.py --drop-unmanaged  # Drop non-unique indexes not declared on the models
+    python manage_indexes.py --explain         # Query plans of the hot queries
+"""
+import time
+
+from sqlalchemy import func, inspect, text
+
+from models import db, AnalysisHistory, UserStats
+from history_pages import history_query, encode_cursor
+from patient_search import POSTGRES_INDEX as SEARCH_INDEX
+
+
+def managed_indexes():
+    """Every index declared on the models, as (table, index)"""
+    return [(table, index) for table in db.metadata.sorted_tables
+            for index in sorted(table.indexes, key=lambda index: index.name)]
+
+
+def _existing_indexes(engine):
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    return {table.name: {index['name']: index for index in inspector.get_indexes(table.name)}
+            for table in db.metadata.sorted_tables if table.name in tables}
+
+
+def _invalid_indexes(connection):
+    """Postgres indexes left invalid by an interrupted CREATE INDEX CONCURRENTLY"""
+    if connection.dialect.name != 'postgresql':
+        return set()
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    ))
+    return {name for (name,) in rows}
+
+
+def index_status(engine):
+    """(table, index, state) for each managed index; state is 'present', 'missing' or 'invalid'"""
+    existing = _existing_indexes(engine)
+    with engine.connect() as connection:
+        invalid = _invalid_indexes(connection)
+    status = []
+    for table, index in managed_indexes():
+        if index.name in invalid:
+            state = 'invalid'
+        elif index.name in existing.get(table.name, {}):
+            state = 'present'
+        else:
+            state = 'missing'
+        status.append((table, index, state))
+    return status
+
+
+def unmanaged_indexes(engine):
+    """
+    Non-unique indexes in the database that are not declared on the models
+    Returns (table, index, columns, covering) where covering names a managed index that starts
+    with the same columns (so dropping this one loses nothing), or None.
+    """
+    existing = _existing_indexes(engine)
+    unmanaged = []
+    for table in db.metadata.sorted_tables:
+        declared = {index.name: [column.name for column in index.columns] for index in table.indexes}
+        for name, reflected in existing.get(table.name, {}).items():
+            columns = reflected['column_names']
+            # Unique indexes back constraints, and the search index belongs to patient_search.py
+            if name in declared or not name or reflected.get('unique') or name == SEARCH_INDEX:
+                continue
+            covering = [other for other, other_columns in declared.items() if other_columns[:len(columns)] == columns]
+            unmanaged.append((table.name, name, columns, covering[0] if covering else None))
+    return unmanaged
+
+
+def _quote(engine, name):
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def create_indexes(engine, pause=1.0):
+    """Create the missing managed indexes without holding long locks; returns the names created"""
+    created = []
+    for table, index, state in index_status(engine):
+        if state == 'present':
+            continue
+        columns = ', '.join(_quote(engine, column.name) for column in index.columns)
+        unique = 'UNIQUE ' if index.unique else ''
+        start = time.perf_counter()
+        if engine.dialect.name == 'postgresql':
+            # CONCURRENTLY cannot run inside a transaction block
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                if state == 'invalid':
+                    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(engine, index.name)}"))
+                connection.execute(text(
+                    f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {_quote(engine, index.name)} "
+                    f"ON {_quote(engine, table.name)} ({columns})"
+                ))
+                connection.execute(text(f"ANALYZE {_quote(engine, table.name)}"))
+        else:
+            # SQLite builds an index in one step, so each index gets its own short write transaction
+            # and the app's writes run in between
+            with engine.begin() as connection:
+                if engine.dialect.name == 'sqlite':
+                    connection.execute(text('PRAGMA busy_timeout = 30000'))
+                connection.execute(text(
+                    f"CREATE {unique}INDEX IF NOT EXISTS {_quote(engine, index.name)} "
+                    f"ON {_quote(engine, table.name)} ({columns})"
+                ))
+            time.sleep(pause)
+        print(f"✓ Created {index.name} in {time.perf_counter() - start:.1f}s")
+        created.append(index.name)
+    if created and engine.dialect.name != 'postgresql':
+        with engine.begin() as connection:
+            connection.execute(text('ANALYZE'))
+    return created
+
+
+def drop_unmanaged_indexes(engine):
+    """Drop the indexes found by unmanaged_indexes(); returns their names"""
+    dropped = []
+    for table_name, name, columns, covering in unmanaged_indexes(engine):
+        if engine.dialect.name == 'postgresql':
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(engine, name)}"))
+        else:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP INDEX IF EXISTS {_quote(engine, name)}"))
+        print(f"✓ Dropped {name} ({', '.join(columns)})" + (f", covered by {covering}" if covering else ''))
+        dropped.append(name)
+    return dropped
+
+
+def hot_queries(session):
+    """The queries the managed indexes exist for, built for the user with the most analyses"""
+    top = session.query(AnalysisHistory.user_id, func.count()).group_by(AnalysisHistory.user_id)\
+        .order_by(func.count().desc()).first()
+    if top is None:
+        return []
+    user_id = top[0]
+    sample = session.query(AnalysisHistory).filter_by(user_id=user_id)\
+        .order_by(AnalysisHistory.created_at.desc(), AnalysisHistory.id.desc()).first()
+    cursor = encode_cursor(sample)
+    patient_ref_id = session.query(AnalysisHistory.patient_ref_id)\
+        .filter(AnalysisHistory.user_id == user_id, AnalysisHistory.patient_ref_id.isnot(None)).limit(1).scalar()
+    return [
+        ('dashboard counters', session.query(UserStats.period, UserStats.disease_type, UserStats.analysis_count)
+            .filter(UserStats.user_id == user_id, UserStats.period.in_((UserStats.ALL_TIME, UserStats.month_of(sample.created_at))))),
+        ('dashboard recent', AnalysisHistory.query.filter_by(user_id=user_id)
+            .order_by(AnalysisHistory.created_at.desc()).limit(5)),
+        ('history page', history_query(user_id, cursor=cursor).limit(26)),
+        ('history by disease', history_query(user_id, {'disease': sample.disease_type}, cursor).limit(26)),
+        ('history by prediction', history_query(user_id, {'prediction': sample.prediction}, cursor).limit(26)),
+        ('patient export', AnalysisHistory.query.filter_by(patient_ref_id=patient_ref_id)
+            .order_by(AnalysisHistory.created_at, AnalysisHistory.id)),
+        ('upload ownership', session.query(AnalysisHistory.id)
+            .filter_by(user_id=user_id, image_path=sample.image_path).limit(1)),
+    ]
+
+
+def explain(session, query):
+    """The database's plan for a query, one line per step"""
+    connection = session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        return [row[-1] for row in rows]
+    return [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {compiled}", params)]
+
+
+def is_index_seek(plan):
+    """False if any step reads the whole table or sorts the matching rows"""
+    for line in plan:
+        step = line.strip(' ->')
+        if step.startswith('SCAN ') and ' INDEX ' not in step:  # SQLite full scan
+            return False
+        if step.startswith('USE TEMP B-TREE'):  # SQLite sort
+            return False
+        if step.startswith('Seq Scan') or step.startswith('Sort '):  # Postgres
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from neurosight_app_with_auth import app
+
+    parser = argparse.ArgumentParser(description='Manage the database indexes declared on the models')
+    parser.add_argument('--create', action='store_true', help='Create missing indexes (concurrently on Postgres)')
+    parser.add_argument('--drop-unmanaged', action='store_true', help='Drop non-unique indexes not declared on the models')
+    parser.add_argument('--explain', action='store_true', help='Show the query plan of each hot query')
+    parser.add_argument('--pause', type=float, default=1.0, help='Seconds between index builds on SQLite')
+    args = parser.parse_args()
+
+    with app.app_context():
+        engine = db.engine
+        print("=" * 60)
+        print(f"  INDEXES ({engine.dialect.name})")
+        print("=" * 60)
+
+        if args.create:
+            create_indexes(engine, pause=args.pause)
+        if args.drop_unmanaged:
+            drop_unmanaged_indexes(engine)
+
+        for table, index, state in index_status(engine):
+            mark = {'present': '✓', 'missing': '✗', 'invalid': '⚠️ '}[state]
+            columns = ', '.join(column.name for column in index.columns)
+            print(f"{mark} {table.name}.{index.name} ({columns}) {state}")
+        for table_name, name, columns, covering in unmanaged_indexes(engine):
+            note = f"redundant, covered by {covering}" if covering else "not managed"
+            print(f"⊙ {table_name}.{name} ({', '.join(columns)}) {note}")
+
+        if args.explain:
+            queries = hot_queries(db.session)
+            if not queries:
+                print("\n⚠️  No analyses yet, nothing to explain")
+            for label, query in queries:
+                plan = explain(db.session, query)
+                print(f"\n{'✓' if is_index_seek(plan) else '✗'} {label}")
+                for line in plan:
+                    print(f"    {line}")
@@ -0,0 +1,52 @@
+"""
+Database migration script to link analyses to patient records
+Adds analysis_history.patient_ref_id and fills the patients table from the patient fields
+already stored on each analysis, one batch of analyses per transaction
+Run this script to update the database schema
+"""
+from neurosight_app_with_auth import app, db
+from patients import link_analyses
+from sqlalchemy import text, inspect
+
+BATCH_SIZE = 2000
+
+def migrate_add_patients(batch_size=BATCH_SIZE):
+    """Add the patient_ref_id column, then create/merge patients and link their analyses"""
+    with app.app_context():
+        try:
+            existing_columns = [col['name'] for col in inspect(db.engine).get_columns('analysis_history')]
+            if 'patient_ref_id' not in existing_columns:
+                with db.engine.begin() as conn:
+                    conn.execute(text('ALTER TABLE analysis_history ADD COLUMN patient_ref_id INTEGER REFERENCES patients(id)'))
+                print("✓ Added column: patient_ref_id")
+            else:
+                print("⊙ Column already exists: patient_ref_id")
+            
+            linked, patients = link_analyses(
+                db.engine, batch_size,
+                progress=lambda last_id, linked: print(f"  ... up to analysis {last_id}: {linked} linked"))
+            
+            print(f"\n✅ Migration completed! Linked {linked} analyses ({patients} patient upserts).")
+            print("   Run `python manage_indexes.py --create` to add the patient index,")
+            print("   then `python rebuild_patient_trends.py` to summarise each patient's analyses.")
+            
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  PATIENT RECORDS MIGRATION")
+    print("=" * 60)
+    print("\nThis will:")
+    print("  - add patient_ref_id (INTEGER, references patients) to analysis_history")
+    print("  - create one patient per user and patient ID, with the latest name and age")
+    print(f"  - link existing analyses to their patient, {BATCH_SIZE} rows per transaction")
+    print("\n" + "=" * 60)
+    
+    confirm = input("\nProceed with migration? (yes/no): ").strip().lower()
+    
+    if confirm == 'yes':
+        migrate_add_patients()
+    else:
+        print("\n❌ Migration cancelled.")
@@ -0,0 +1,51 @@
+"""
+Database migration script to add series analysis fields
+Run this script to update the database schema
+"""
+
+from neurosight_app_with_auth import app, db
+from sqlalchemy import text, inspect
+
+def migrate_add_series_fields():
+    """Add series analysis fields to analysis_history table"""
+    with app.app_context():
+        try:
+            existing_columns = [col['name'] for col in inspect(db.engine).get_columns('analysis_history')]
+            
+            columns_to_add = {
+                'slice_count': 'ALTER TABLE analysis_history ADD COLUMN slice_count INTEGER',
+                'series_details': 'ALTER TABLE analysis_history ADD COLUMN series_details TEXT'
+            }
+            
+            added_count = 0
+            with db.engine.connect() as conn:
+                for column_name, sql in columns_to_add.items():
+                    if column_name not in existing_columns:
+                        conn.execute(text(sql))
+                        conn.commit()
+                        print(f"✓ Added column: {column_name}")
+                        added_count += 1
+                    else:
+                        print(f"⊙ Column already exists: {column_name}")
+            
+            print(f"\n✅ Migration completed! Added {added_count} new columns.")
+            
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  SERIES ANALYSIS FIELDS MIGRATION")
+    print("=" * 60)
+    print("\nThis will add the following columns to the analysis_history table:")
+    print("  - slice_count (INTEGER)")
+    print("  - series_details (TEXT)")
+    print("\n" + "=" * 60)
+    
+    confirm = input("\nProceed with migration? (yes/no): ").strip().lower()
+    
+    if confirm == 'yes':
+        migrate_add_series_fields()
+    else:
+        print("\n❌ Migration cancelled.")
@@ -0,0 +1,53 @@
+"""
+Database migration script to add compaction and retention fields to the upload index
+Run this script to update the database schema
+"""
+
+from neurosight_app_with_auth import app, db
+from sqlalchemy import text, inspect
+
+def migrate_add_upload_blob_fields():
+    """Add tier, encoding and stored_size to the upload_blobs table"""
+    with app.app_context():
+        try:
+            existing_columns = [col['name'] for col in inspect(db.engine).get_columns('upload_blobs')]
+            
+            columns_to_add = {
+                'tier': "ALTER TABLE upload_blobs ADD COLUMN tier VARCHAR(10) NOT NULL DEFAULT 'hot'",
+                'encoding': 'ALTER TABLE upload_blobs ADD COLUMN encoding VARCHAR(30)',
+                'stored_size': 'ALTER TABLE upload_blobs ADD COLUMN stored_size INTEGER'
+            }
+            
+            added_count = 0
+            with db.engine.connect() as conn:
+                for column_name, sql in columns_to_add.items():
+                    if column_name not in existing_columns:
+                        conn.execute(text(sql))
+                        conn.commit()
+                        print(f"✓ Added column: {column_name}")
+                        added_count += 1
+                    else:
+                        print(f"⊙ Column already exists: {column_name}")
+            
+            print(f"\n✅ Migration completed! Added {added_count} new columns.")
+            
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  UPLOAD STORE RETENTION FIELDS MIGRATION")
+    print("=" * 60)
+    print("\nThis will add the following columns to the upload_blobs table:")
+    print("  - tier (VARCHAR(10), default 'hot')")
+    print("  - encoding (VARCHAR(30))")
+    print("  - stored_size (INTEGER)")
+    print("\n" + "=" * 60)
+    
+    confirm = input("\nProceed with migration? (yes/no): ").strip().lower()
+    
+    if confirm == 'yes':
+        migrate_add_upload_blob_fields()
+    else:
+        print("\n❌ Migration cancelled.")
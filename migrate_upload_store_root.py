@@ -0,0 +1,56 @@
+"""
+Migration script to move content-addressed uploads out of static/uploads
+Earlier versions stored blobs under the Flask static folder, where /static/uploads/<shard>/<digest>
+served them to anyone. Moves each indexed hot blob to UPLOAD_STORE_ROOT; it is safe to re-run
+"""
+import os
+import shutil
+
+from neurosight_app_with_auth import app, db, upload_store, UPLOAD_FOLDER
+from models import UploadBlob
+
+BATCH_SIZE = 500
+
+
+def move_blobs(old_root=UPLOAD_FOLDER):
+    """Move blobs from old_root to the local store root, keeping their storage keys"""
+    with app.app_context():
+        old_root = os.path.abspath(old_root)
+        new_root = getattr(upload_store.backend, 'root', None)
+        if new_root is None:
+            print("⊙ The upload store is not on local disk; nothing to move")
+            return
+        if new_root == old_root:
+            print(f"⚠️  UPLOAD_STORE_ROOT is {old_root}; point it outside the static folder first")
+            return
+
+        moved = already = 0
+        last_sha = ''
+        while True:
+            blobs = db.session.query(UploadBlob.sha256, UploadBlob.storage_key).filter(
+                UploadBlob.sha256 > last_sha, UploadBlob.tier == 'hot'
+            ).order_by(UploadBlob.sha256).limit(BATCH_SIZE).all()
+            if not blobs:
+                break
+            last_sha = blobs[-1].sha256
+            for blob in blobs:
+                source = os.path.join(old_root, blob.storage_key)
+                if not os.path.isfile(source):
+                    already += 1
+                    continue
+                target = os.path.join(new_root, blob.storage_key)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(source, target)
+                moved += 1
+            print(f"✓ Processed blobs up to {last_sha[:12]} ({moved} moved so far)")
+
+        # Remove the emptied ab/cd shard directories; legacy flat files stay where they are
+        for directory, _, _ in sorted(os.walk(old_root), key=lambda entry: -len(entry[0])):
+            if directory != old_root and not os.listdir(directory):
+                os.rmdir(directory)
+
+        print(f"\n✅ Migration completed! Moved {moved} blobs to {new_root}, {already} were already moved or missing.")
+
+
+if __name__ == "__main__":
+    move_blobs()
@@ -0,0 +1,68 @@
+"""
+Migration script to move legacy flat uploads into the content-addressed upload store
+Run this script once after upgrading; it is safe to re-run
+"""
+
+from neurosight_app_with_auth import app, db, upload_store
+from models import AnalysisHistory
+
+BATCH_SIZE = 200
+
+
+def migrate_uploads(delete_legacy=False):
+    """Store each legacy upload by content hash and repoint AnalysisHistory.image_path"""
+    with app.app_context():
+        migrated = missing = 0
+        legacy_names = set()
+        blob_paths = set()
+        last_id = 0
+
+        while True:
+            rows = AnalysisHistory.query.filter(
+                AnalysisHistory.id > last_id,
+                AnalysisHistory.image_path.isnot(None)
+            ).order_by(AnalysisHistory.id).limit(BATCH_SIZE).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            pending = []
+            for row in rows:
+                if upload_store.is_content_addressed(row.image_path):
+                    continue
+                data = upload_store.read(row.image_path)
+                if data is None:
+                    missing += 1
+                    continue
+                legacy_name = row.image_path
+                # Strip the '<YYYYmmdd_HHMMSS>_' prefix to recover the original name
+                original_name = legacy_name[16:] if legacy_name[8:9] == '_' and legacy_name[15:16] == '_' else legacy_name
+                image_path, saved = upload_store.save(data, original_name)
+                pending.append(saved)
+                row.image_path = image_path
+                legacy_names.add(legacy_name)
+                blob_paths.add(image_path)
+                migrated += 1
+
+            for saved in pending:
+                upload_store.index(saved)
+            db.session.commit()
+            print(f"✓ Processed analyses up to ID {last_id} ({migrated} migrated so far)")
+
+        if delete_legacy:
+            for name in legacy_names:
+                upload_store.legacy_backend.delete(name)
+            print(f"🗑️  Deleted {len(legacy_names)} legacy files")
+
+        print(f"\n✅ Migration completed! Migrated {migrated} uploads into {len(blob_paths)} blobs "
+              f"({migrated - len(blob_paths)} duplicates), {missing} files were missing.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Move legacy uploads into the content-addressed store')
+    parser.add_argument('--delete-legacy', action='store_true', help='Delete legacy files after migrating')
+    args = parser.parse_args()
+
+    migrate_uploads(delete_legacy=args.delete_legacy)
@@ -3,8 +3,10 @@ Database models for NeuroSight authentication system
 """
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from collections import Counter
+from sqlalchemy import event, update, select, text
+from password_service import passwords
+from datetime import datetime, date, timezone
 import secrets
 
 db = SQLAlchemy()
@@ -60,16 +62,23 @@ class User(UserMixin, db.Model):
     
     # Relationships
     analyses = db.relationship('AnalysisHistory', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    stats = db.relationship('UserStats', lazy='dynamic', cascade='all, delete-orphan')
+    patients = db.relationship('Patient', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash(password)
     
     def check_password(self, password):
-        """Verify password against hash"""
-        if not self.password_hash:
+        """
+        Verify password against hash
+        On success, a hash made with an older scheme or parameters is replaced (the caller commits)
+        """
+        if not passwords.verify(self.password_hash, password):
             return False
-        return check_password_hash(self.password_hash, password)
+        if passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
     def generate_reset_token(self):
         """Generate a secure password reset token"""
@@ -149,11 +158,24 @@ class User(UserMixin, db.Model):
 class AnalysisHistory(db.Model):
     """Analysis history for tracking patient scans"""
     __tablename__ = 'analysis_history'
+    # Every listing is per user, so each index leads with user_id; together they also cover the
+    # user_id foreign key. Existing databases are brought in line with manage_indexes.py.
+    __table_args__ = (
+        # Dashboard and history pages: newest first, seeking on (created_at, id)
+        db.Index('ix_analysis_history_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_analysis_history_user_disease_created', 'user_id', 'disease_type', 'created_at', 'id'),
+        db.Index('ix_analysis_history_user_prediction_created', 'user_id', 'prediction', 'created_at', 'id'),
+        # Patient exports and timelines
+        db.Index('ix_analysis_history_patient_created', 'patient_ref_id', 'created_at', 'id'),
+        # Upload ownership check on every image and thumbnail request
+        db.Index('ix_analysis_history_user_image', 'user_id', 'image_path'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
-    # Patient information
+    # Patient information, as entered for this scan (the age is the age at scan time)
+    patient_ref_id = db.Column(db.Integer, db.ForeignKey('patients.id'))  # NULL when no patient ID was given
     patient_name = db.Column(db.String(255))
     patient_id = db.Column(db.String(100))
     patient_age = db.Column(db.Integer)
@@ -164,18 +186,370 @@ class AnalysisHistory(db.Model):
     prediction = db.Column(db.String(255), nullable=False)
     confidence = db.Column(db.Float)
     
+    # Series analysis (DICOM/NIfTI studies); NULL for single-image analyses
+    slice_count = db.Column(db.Integer)  # Slices actually analysed
+    series_details = db.Column(db.Text)  # JSON: aggregation, early stop and per-slice results
+    
     # File paths
     image_path = db.Column(db.String(500))
     report_path = db.Column(db.String(500))
     
     # Metadata
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)  # Doctor's notes
     
     def __repr__(self):
         return f'<Analysis {self.id} - {self.disease_type}>'
 
 
+class Patient(db.Model):
+    """A patient, identified by the patient ID a user enters; each user has their own patients"""
+    __tablename__ = 'patients'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'external_id', name='uq_patients_user_external_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    external_id = db.Column(db.String(100), nullable=False)  # The hospital's patient ID
+    name = db.Column(db.String(255))  # Latest name and age entered for the patient
+    age = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    analyses = db.relationship('AnalysisHistory', backref='patient', lazy='dynamic')
+    trends = db.relationship('PatientTrend', lazy='dynamic', cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<Patient {self.id} {self.external_id} user={self.user_id}>'
+
+
+class PatientTrend(db.Model):
+    """
+    Count, first and latest of a patient's analyses for one disease, in scan-date order
+    Updated in the same transaction as each analysis insert or delete, so a timeline never has
+    to summarise the patient's history. rebuild_patient_trends.py recomputes them from analysis_history.
+    """
+    __tablename__ = 'patient_trends'
+    
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    disease_type = db.Column(db.String(50), primary_key=True)
+    analysis_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    first_analysis_id = db.Column(db.Integer)
+    first_scan_date = db.Column(db.Date)
+    first_prediction = db.Column(db.String(255))
+    first_confidence = db.Column(db.Float)
+    latest_analysis_id = db.Column(db.Integer)
+    latest_scan_date = db.Column(db.Date)
+    latest_prediction = db.Column(db.String(255))
+    latest_confidence = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @staticmethod
+    def timeline_date(analysis):
+        """Date an analysis sits at on the timeline: the scan date, or the day it was analysed if none was entered"""
+        return analysis.scan_date or (analysis.created_at or datetime.utcnow()).date()
+    
+    @classmethod
+    def point(cls, analysis):
+        return {'analysis_id': analysis.id, 'date': cls.timeline_date(analysis).isoformat(),
+                'prediction': analysis.prediction, 'confidence': analysis.confidence}
+    
+    @staticmethod
+    def end_values(prefix, point):
+        """Column values for the 'first' or 'latest' end of a trend (an empty point clears it)"""
+        return {
+            f'{prefix}_analysis_id': point.get('analysis_id'),
+            f'{prefix}_scan_date': date.fromisoformat(point['date']) if point else None,
+            f'{prefix}_prediction': point.get('prediction'),
+            f'{prefix}_confidence': point.get('confidence')
+        }
+    
+    @classmethod
+    def summarise(cls, points):
+        """Column values for a trend made of these points (sorted by date, then analysis id)"""
+        values = {'analysis_count': len(points), 'updated_at': datetime.utcnow()}
+        values.update(cls.end_values('first', points[0] if points else {}))
+        values.update(cls.end_values('latest', points[-1] if points else {}))
+        return values
+    
+    def to_dict(self):
+        change = None
+        if self.first_confidence is not None and self.latest_confidence is not None:
+            change = round(self.latest_confidence - self.first_confidence, 4)
+        ends = {}
+        for prefix in ('first', 'latest'):
+            scan_date = getattr(self, f'{prefix}_scan_date')
+            ends[prefix] = {
+                'analysis_id': getattr(self, f'{prefix}_analysis_id'),
+                'date': scan_date.isoformat() if scan_date else None,
+                'prediction': getattr(self, f'{prefix}_prediction'),
+                'confidence': getattr(self, f'{prefix}_confidence')
+            }
+        return {
+            'disease_type': self.disease_type,
+            'analysis_count': self.analysis_count,
+            'first': ends['first'],
+            'latest': ends['latest'],
+            'prediction_changed': self.first_prediction != self.latest_prediction,
+            'confidence_change': change
+        }
+    
+    def __repr__(self):
+        return f'<PatientTrend {self.patient_id} {self.disease_type} n={self.analysis_count}>'
+
+
+class UserStats(db.Model):
+    """
+    Per-user analysis counters for the dashboard
+    One row per (period, disease) with '' meaning all diseases; updated in the same transaction
+    as each analysis insert or delete. rebuild() recomputes them from analysis_history.
+    """
+    __tablename__ = 'user_stats'
+    
+    ALL_TIME = 'all'
+    zone = None  # tzinfo months are counted in (STATS_TIMEZONE); None is the server's local time
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)  # 'all' or 'YYYY-MM' (month of created_at in cls.zone)
+    disease_type = db.Column(db.String(50), primary_key=True, default='')
+    analysis_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    @classmethod
+    def month_of(cls, moment):
+        """'YYYY-MM' of a naive UTC timestamp (as stored in created_at), in the counting time zone"""
+        return moment.replace(tzinfo=timezone.utc).astimezone(cls.zone).strftime('%Y-%m')
+    
+    @classmethod
+    def summary(cls, user_id, now=None):
+        """Total, this month's and per-disease analysis counts for a user, in one primary key lookup"""
+        month = cls.month_of(now or datetime.utcnow())
+        rows = db.session.query(cls.period, cls.disease_type, cls.analysis_count)\
+            .filter(cls.user_id == user_id, cls.period.in_((cls.ALL_TIME, month))).all()
+        counts = {(period, disease_type): count for period, disease_type, count in rows}
+        return {
+            'total': counts.get((cls.ALL_TIME, ''), 0),
+            'this_month': counts.get((month, ''), 0),
+            'by_disease': {disease_type: count for (period, disease_type), count in counts.items()
+                           if period == cls.ALL_TIME and disease_type and count}
+        }
+    
+    @classmethod
+    def rebuild(cls, user_ids=None, batch_size=5000):
+        """
+        Recompute the counters of the given users (all users by default) in one transaction
+        Returns (counters removed, counters written, users); the caller commits.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            # Hold off new analyses so none is counted twice or missed while the counts are redone
+            db.session.execute(text('LOCK TABLE analysis_history IN SHARE MODE'))
+        
+        stats = cls.query
+        analyses = db.session.query(AnalysisHistory.user_id, AnalysisHistory.disease_type, AnalysisHistory.created_at)
+        if user_ids:
+            stats = stats.filter(cls.user_id.in_(user_ids))
+            analyses = analyses.filter(AnalysisHistory.user_id.in_(user_ids))
+        deleted = stats.delete(synchronize_session=False)
+        
+        counts = Counter()
+        for user_id, disease_type, created_at in analyses.yield_per(batch_size):
+            month = cls.month_of(created_at) if created_at else None
+            for period in (cls.ALL_TIME, month):
+                if period is not None:
+                    counts[(user_id, period, '')] += 1
+                    counts[(user_id, period, disease_type)] += 1
+        
+        db.session.bulk_insert_mappings(cls, [
+            {'user_id': user_id, 'period': period, 'disease_type': disease_type, 'analysis_count': count}
+            for (user_id, period, disease_type), count in counts.items()
+        ])
+        return deleted, len(counts), len({user_id for user_id, _, _ in counts})
+    
+    @classmethod
+    def backfill(cls):
+        """Fill the counters at startup when the table is empty but analyses exist (first run after upgrading)"""
+        if db.session.query(cls.user_id).first() is not None or db.session.query(AnalysisHistory.id).first() is None:
+            return False
+        try:
+            _, counters, users = cls.rebuild()
+            db.session.commit()
+        except Exception as e:
+            # Another worker filling them at the same time is harmless; rebuild_user_stats.py can redo it
+            db.session.rollback()
+            print(f"⚠️  Could not fill the dashboard counters: {e}")
+            return False
+        print(f"✓ Filled {counters} dashboard counters for {users} users")
+        return True
+    
+    def __repr__(self):
+        return f'<UserStats {self.user_id} {self.period} {self.disease_type or "*"}={self.analysis_count}>'
+
+
+def _user_stats_keys(analysis):
+    month = UserStats.month_of(analysis.created_at or datetime.utcnow())
+    return [(period, disease_type) for period in (UserStats.ALL_TIME, month) for disease_type in ('', analysis.disease_type)]
+
+
+@event.listens_for(AnalysisHistory, 'after_insert')
+def _count_analysis(mapper, connection, analysis):
+    """Add the new analysis to its user's counters with one upsert on the flush's connection"""
+    table = UserStats.__table__
+    rows = [{'user_id': analysis.user_id, 'period': period, 'disease_type': disease_type, 'analysis_count': 1}
+            for period, disease_type in _user_stats_keys(analysis)]
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(rows)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.period, table.c.disease_type],
+            set_={'analysis_count': table.c.analysis_count + statement.excluded.analysis_count}
+        ))
+        return
+    # Other databases: update, then insert the counters that did not exist yet
+    for row in rows:
+        updated = connection.execute(update(table).where(
+            table.c.user_id == row['user_id'], table.c.period == row['period'], table.c.disease_type == row['disease_type']
+        ).values(analysis_count=table.c.analysis_count + 1))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(row))
+
+
+@event.listens_for(AnalysisHistory, 'after_delete')
+def _uncount_analysis(mapper, connection, analysis):
+    table = UserStats.__table__
+    keys = _user_stats_keys(analysis)
+    connection.execute(update(table).where(
+        table.c.user_id == analysis.user_id,
+        table.c.period.in_({period for period, _ in keys}),
+        table.c.disease_type.in_({disease_type for _, disease_type in keys}),
+        table.c.analysis_count > 0
+    ).values(analysis_count=table.c.analysis_count - 1))
+
+
+def _update_patient_trend(connection, analysis, removed=False):
+    """
+    Apply one analysis insert (or delete) to its patient trend, on the flush's connection
+    An insert only compares the analysis with the trend's two ends. A delete re-reads the
+    patient's analyses of that disease only when it removes one of the ends.
+    """
+    table = PatientTrend.__table__
+    key = (table.c.patient_id == analysis.patient_ref_id) & (table.c.disease_type == analysis.disease_type)
+    if not removed:
+        row = {'patient_id': analysis.patient_ref_id, 'disease_type': analysis.disease_type, 'analysis_count': 0}
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            connection.execute(insert(table).values(row).on_conflict_do_nothing())
+        elif connection.execute(select(table.c.patient_id).where(key)).first() is None:
+            connection.execute(table.insert().values(row))
+    
+    # Two analyses of one patient saved at once must see each other's changes to the ends. On
+    # Postgres the row lock orders them; SQLite ignores FOR UPDATE, but it runs one write
+    # transaction at a time, so the second already reads the first's committed trend.
+    current = connection.execute(select(table).where(key).with_for_update()).first()
+    if current is None:
+        return
+    point = PatientTrend.point(analysis)
+    position = (point['date'], point['analysis_id'])
+    values = {'updated_at': datetime.utcnow()}
+    if not removed:
+        values['analysis_count'] = current.analysis_count + 1
+        if current.first_analysis_id is None or position < (current.first_scan_date.isoformat(), current.first_analysis_id):
+            values.update(PatientTrend.end_values('first', point))
+        if current.latest_analysis_id is None or position > (current.latest_scan_date.isoformat(), current.latest_analysis_id):
+            values.update(PatientTrend.end_values('latest', point))
+    elif analysis.id in (current.first_analysis_id, current.latest_analysis_id):
+        history = AnalysisHistory.__table__
+        remaining = connection.execute(select(
+            history.c.id, history.c.scan_date, history.c.created_at, history.c.prediction, history.c.confidence
+        ).where(history.c.patient_ref_id == analysis.patient_ref_id, history.c.disease_type == analysis.disease_type))
+        points = sorted((PatientTrend.point(row) for row in remaining), key=lambda p: (p['date'], p['analysis_id']))
+        # Emptied trends are kept with a zero count, like the dashboard counters
+        values.update(PatientTrend.summarise(points))
+    else:
+        values['analysis_count'] = max(current.analysis_count - 1, 0)
+    connection.execute(update(table).where(key).values(**values))
+
+
+@event.listens_for(AnalysisHistory, 'after_insert')
+def _add_to_patient_trend(mapper, connection, analysis):
+    if analysis.patient_ref_id is not None:
+        _update_patient_trend(connection, analysis)
+
+
+@event.listens_for(AnalysisHistory, 'after_delete')
+def _remove_from_patient_trend(mapper, connection, analysis):
+    if analysis.patient_ref_id is not None:
+        _update_patient_trend(connection, analysis, removed=True)
+
+
+class UploadBlob(db.Model):
+    """Index of content-addressed upload blobs (AnalysisHistory.image_path -> stored object)"""
+    __tablename__ = 'upload_blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    storage_key = db.Column(db.String(255), nullable=False)  # Key within the storage backend
+    content_type = db.Column(db.String(100))
+    size_bytes = db.Column(db.Integer)
+    original_filename = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Compaction and retention
+    tier = db.Column(db.String(10), default='hot', server_default='hot', nullable=False)  # 'hot' or 'cold'
+    encoding = db.Column(db.String(30))  # NULL = original bytes, else e.g. 'webp-lossless', 'png-optimized'
+    stored_size = db.Column(db.Integer)  # Bytes on storage after compaction
+    
+    def __repr__(self):
+        return f'<UploadBlob {self.sha256[:12]} {self.tier} {self.storage_key}>'
+
+
+class EmailOutbox(db.Model):
+    """Outgoing email, queued by request handlers and delivered by a background sender"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30))  # 'otp', 'welcome', 'password_reset'
+    recipient = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    subject = db.Column(db.String(255), nullable=False)
+    html_body = db.Column(db.Text)
+    text_body = db.Column(db.Text)
+    
+    # Delivery state
+    status = db.Column(db.String(20), default='pending', nullable=False)  # 'pending', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.kind} {self.status}>'
+
+
+class RevokedToken(db.Model):
+    """API bearer tokens revoked before they expire; rows are purged once the token would have expired"""
+    __tablename__ = 'revoked_tokens'
+    
+    jti = db.Column(db.String(32), primary_key=True)  # Token id claim
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RevokedToken {self.jti} user={self.user_id}>'
+
+
 def init_db(app):
     """Initialize database"""
     db.init_app(app)
@@ -1,33 +1,49 @@
+import io
 import os
 import secrets
 import json
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from authlib.integrations.flask_client import OAuth
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-import requests
 from transformers import ViTFeatureExtractor, ViTForImageClassification, SwinForImageClassification, ConvNextForImageClassification
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import torch
 import torch.nn.functional as F
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.platypus import Image as RLImage
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-
-from models import db, User, AnalysisHistory, init_db
+
+from models import db, User, AnalysisHistory, Patient, UserStats, init_db
+from db_engine import database_url, engine_options
+from email_outbox import OutboxSender
+from email_templates import EmailTemplates
+from mail_transport import MailTransport
+from rate_limiter import create_rate_limiter, RateLimitExceeded
+from identity_cache import IdentityCache, UserDeleted
+from api_tokens import ApiTokens
+from password_service import passwords, PasswordServiceBusy
+from oauth_metadata import OAuthMetadataCache
 from auth_utils import validate_email, validate_password
+from image_utils import open_image, decode_for_model, encode_png, ImageTooLargeError
+from upload_store import create_upload_store
+from image_derivatives import DerivativeCache, RENDER_ERRORS
+from volume_loader import detect_volume_format, load_volume, VolumeError
+from series_analysis import analyze_series, AGGREGATION_METHODS
+from report_renderer import build_report, render_report, REPORT_TEMPLATE_VERSION
+from report_export import iter_zip, iter_combined_pdf
+from report_cache import ReportCache
+from history_pages import history_page, parse_filters, HistoryQueryError
+from patients import PatientCache, patient_timeline
+from patient_search import install_search_index, search_index_ready, search_analyses, SearchQueryError
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 
@@ -39,8 +55,22 @@ load_dotenv()
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'neurosight-secret-key-change-in-production-2024')
 
 # Database Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///neurosight.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url(os.environ.get('DATABASE_URL', 'sqlite:///neurosight.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DB_STATEMENT_CACHE_SIZE'] = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 1000))  # Compiled statements kept per engine
+
+# Database Engine Profiles (see db_engine.py)
+# SQLite: WAL with synchronous=NORMAL; this process's writers queue on a lock, other processes wait up to the busy timeout
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # Milliseconds a write waits for the lock
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # Bytes of the file read through mmap
+app.config['SQLITE_WRITE_LOCK'] = os.environ.get('SQLITE_WRITE_LOCK', 'True') == 'True'
+# Postgres: one connection per request thread plus the email sender and other background work
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', int(os.environ.get('GUNICORN_THREADS', 4)) + 2))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 2))  # Extra connections allowed in a burst
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Reconnect connections older than this
+app.config['DB_PREPARE_THRESHOLD'] = int(os.environ.get('DB_PREPARE_THRESHOLD', 5))  # psycopg 3 only
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
 
 # Email Configuration (Gmail SMTP)
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -50,15 +80,135 @@ app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 
+# Email Outbox (emails are queued and delivered by a background sender, see email_outbox.py)
+app.config['EMAIL_SENDER_THREAD'] = os.environ.get('EMAIL_SENDER_THREAD', 'True') == 'True'
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+app.config['EMAIL_RETRY_BASE_SECONDS'] = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 30))
+app.config['EMAIL_RETRY_MAX_SECONDS'] = int(os.environ.get('EMAIL_RETRY_MAX_SECONDS', 3600))
+app.config['EMAIL_POLL_INTERVAL'] = int(os.environ.get('EMAIL_POLL_INTERVAL', 10))
+app.config['EMAIL_SEND_TIMEOUT'] = int(os.environ.get('EMAIL_SEND_TIMEOUT', 120))  # Lease on a message being sent
+
+# SMTP Connection Pool (authenticated connections reused across messages)
+app.config['MAIL_POOL_SIZE'] = int(os.environ.get('MAIL_POOL_SIZE', 2))
+app.config['MAIL_POOL_IDLE_TIMEOUT'] = float(os.environ.get('MAIL_POOL_IDLE_TIMEOUT', 60))  # Reconnect after this many idle seconds
+app.config['MAIL_TIMEOUT'] = float(os.environ.get('MAIL_TIMEOUT', 30))
+
 # Google OAuth Configuration
 app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
 app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
 app.config['GOOGLE_DISCOVERY_URL'] = os.environ.get('GOOGLE_DISCOVERY_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+app.config['OAUTH_METADATA_CACHE'] = os.environ.get('OAUTH_METADATA_CACHE', os.path.join(app.instance_path, 'oauth_metadata_google.json'))
+app.config['OAUTH_METADATA_TTL'] = int(os.environ.get('OAUTH_METADATA_TTL', 3600))  # Used when the provider sends no max-age
+app.config['OAUTH_HTTP_TIMEOUT'] = float(os.environ.get('OAUTH_HTTP_TIMEOUT', 5))  # Seconds per call to the provider
+
+# Rate Limits ('<count>/<window>', e.g. '10/minute' or '5/15minutes'; empty disables that limit)
+# Checked per client IP and per account before any password hashing or email is sent
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+app.config['RATE_LIMIT_STORAGE_URL'] = os.environ.get('RATE_LIMIT_STORAGE_URL')  # e.g. redis://localhost:6379/0 to share counters across workers
+app.config['RATE_LIMIT_LOGIN_IP'] = os.environ.get('RATE_LIMIT_LOGIN_IP', '20/minute')
+app.config['RATE_LIMIT_LOGIN_ACCOUNT'] = os.environ.get('RATE_LIMIT_LOGIN_ACCOUNT', '10/15minutes')
+app.config['RATE_LIMIT_OTP_IP'] = os.environ.get('RATE_LIMIT_OTP_IP', '30/15minutes')
+app.config['RATE_LIMIT_OTP_ACCOUNT'] = os.environ.get('RATE_LIMIT_OTP_ACCOUNT', '10/15minutes')
+app.config['RATE_LIMIT_EMAIL_IP'] = os.environ.get('RATE_LIMIT_EMAIL_IP', '10/hour')  # Registration, OTP resend and password reset emails
+app.config['RATE_LIMIT_EMAIL_ACCOUNT'] = os.environ.get('RATE_LIMIT_EMAIL_ACCOUNT', '3/15minutes')
+app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', 0))  # Reverse proxies in front of the app (1 on Render)
+
+# Password Hashing (werkzeug method such as 'scrypt:32768:8:1' / 'pbkdf2:sha256:600000', or 'argon2:3:65536:4')
+# Existing hashes keep working and are upgraded to this scheme at the user's next login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # Cores logins may use at once
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))  # Logins waiting beyond this get a 503
+
+# Identity Cache (slim user records for the Flask-Login user_loader, per worker process)
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 60))  # Upper bound on staleness after changes from other processes
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+
+# API Tokens (signed bearer tokens for machine clients of the /api/ endpoints)
+app.config['API_TOKEN_TTL'] = int(os.environ.get('API_TOKEN_TTL', 3600))  # Seconds a token is valid
+app.config['API_TOKEN_REVOCATION_REFRESH'] = float(os.environ.get('API_TOKEN_REVOCATION_REFRESH', 30))  # Seconds before other workers see a revocation
+
+# Upload Limits
+# Requests larger than MAX_CONTENT_LENGTH are rejected by Flask before the body is read;
+# images above MAX_IMAGE_PIXELS are rejected from their header, before decoding
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 128 * 1024 * 1024))
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+
+# Upload Store (content-addressed; 'local' or 's3' for any S3-compatible service)
+app.config['UPLOAD_STORE_BACKEND'] = os.environ.get('UPLOAD_STORE_BACKEND', 'local')
+app.config['UPLOAD_STORE_ROOT'] = os.environ.get('UPLOAD_STORE_ROOT', os.path.join(app.instance_path, 'uploads'))  # Outside static/, so blobs are only served by /uploads after the ownership check
+app.config['UPLOAD_STORE_S3_BUCKET'] = os.environ.get('UPLOAD_STORE_S3_BUCKET')
+app.config['UPLOAD_STORE_S3_ENDPOINT'] = os.environ.get('UPLOAD_STORE_S3_ENDPOINT')
+app.config['UPLOAD_STORE_S3_PREFIX'] = os.environ.get('UPLOAD_STORE_S3_PREFIX', 'uploads')
+
+# Upload Retention (see compact_uploads.py); the cold tier is not web-served
+app.config['UPLOAD_COLD_FOLDER'] = os.environ.get('UPLOAD_COLD_FOLDER', os.path.join(app.instance_path, 'uploads_cold'))
+app.config['UPLOAD_COLD_AFTER_DAYS'] = int(os.environ.get('UPLOAD_COLD_AFTER_DAYS', 180))
+
+# Report Cache (rendered PDFs per analysis; kept out of static/ since reports hold patient data)
+app.config['REPORT_CACHE_FOLDER'] = os.environ.get('REPORT_CACHE_FOLDER', os.path.join(app.instance_path, 'reports'))
+app.config['REPORT_RENDER_TIMEOUT'] = float(os.environ.get('REPORT_RENDER_TIMEOUT', 30))  # Seconds a download waits
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 50))  # Rows fetched per round trip in patient exports
+app.config['EXPORT_MAX_COMBINED_REPORTS'] = int(os.environ.get('EXPORT_MAX_COMBINED_REPORTS', 200))  # A combined PDF is built in full before its first byte is sent; larger exports use ?format=zip
+
+# History Pages (cursor pagination of /history and /api/history)
+app.config['HISTORY_PAGE_SIZE'] = int(os.environ.get('HISTORY_PAGE_SIZE', 25))
+app.config['HISTORY_MAX_PAGE_SIZE'] = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 100))
+app.config['SEARCH_CANDIDATES'] = int(os.environ.get('SEARCH_CANDIDATES', 500))  # Most recent matches ranked per search
+app.config['PATIENT_CACHE_SIZE'] = int(os.environ.get('PATIENT_CACHE_SIZE', 10000))  # Patients remembered per worker when saving analyses
+
+# Series Analysis (DICOM/NIfTI studies)
+app.config['SERIES_MAX_SLICES'] = int(os.environ.get('SERIES_MAX_SLICES', 16))
+app.config['SERIES_BATCH_SIZE'] = int(os.environ.get('SERIES_BATCH_SIZE', 4))
+app.config['SERIES_MIN_SLICES'] = int(os.environ.get('SERIES_MIN_SLICES', 4))
+app.config['SERIES_STOP_CONFIDENCE'] = float(os.environ.get('SERIES_STOP_CONFIDENCE', 0.95))
+app.config['SERIES_AGGREGATION'] = os.environ.get('SERIES_AGGREGATION', 'mean')  # mean, max or attention
+
+# Dashboard Counters
+app.config['STATS_TIMEZONE'] = os.environ.get('STATS_TIMEZONE')  # e.g. 'Africa/Cairo'; months follow this zone (default: server local time)
 
 
 # Initialize extensions
+passwords.configure(app.config['PASSWORD_HASH_METHOD'], max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
 init_db(app)
 mail = Mail(app)
+
+# Dashboard counters: months are counted in STATS_TIMEZONE; an empty table is filled on first start
+if app.config['STATS_TIMEZONE']:
+    from zoneinfo import ZoneInfo
+    UserStats.zone = ZoneInfo(app.config['STATS_TIMEZONE'])
+with app.app_context():
+    UserStats.backfill()
+
+# Patient search index: built here on SQLite; on Postgres run `python patient_search.py --install` (CONCURRENTLY)
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        if install_search_index(db.engine):
+            print("✓ Patient search index built")
+    elif not search_index_ready(db.engine):
+        print("⚠️  Patient search index missing; run: python patient_search.py --install")
+
+# Behind a reverse proxy, take the client address from X-Forwarded-For so rate limits apply per client
+if app.config['PROXY_FIX_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
+
+rate_limiter = create_rate_limiter(app.config, {
+    'login': (app.config['RATE_LIMIT_LOGIN_IP'], app.config['RATE_LIMIT_LOGIN_ACCOUNT']),
+    'otp': (app.config['RATE_LIMIT_OTP_IP'], app.config['RATE_LIMIT_OTP_ACCOUNT']),
+    'email': (app.config['RATE_LIMIT_EMAIL_IP'], app.config['RATE_LIMIT_EMAIL_ACCOUNT'])
+})
+
+# Background email delivery over pooled SMTP connections; request handlers only queue messages
+mail_transport = MailTransport(mail, pool_size=app.config['MAIL_POOL_SIZE'],
+                               idle_timeout=app.config['MAIL_POOL_IDLE_TIMEOUT'],
+                               timeout=app.config['MAIL_TIMEOUT'])
+email_sender = OutboxSender(app, mail_transport)
+if app.config['EMAIL_SENDER_THREAD']:
+    email_sender.start()
+
+# Email bodies come from templates/email/, compiled once at startup
+email_templates = EmailTemplates(os.path.join(app.root_path, app.template_folder))
+print(f"✓ Compiled {email_templates.precompile()} email templates")
 oauth = OAuth(app)
 
 # Register Google OAuth client
@@ -68,10 +218,17 @@ oauth.register(
     client_secret=app.config['GOOGLE_CLIENT_SECRET'],
     server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
     client_kwargs={
-        'scope': 'openid email profile'
+        'scope': 'openid email profile',
+        'default_timeout': app.config['OAUTH_HTTP_TIMEOUT']
     }
 )
 
+# Discovery document and signing keys, prefetched (or read from disk) so logins don't fetch them
+google_metadata = OAuthMetadataCache(app.config['GOOGLE_DISCOVERY_URL'], app.config['OAUTH_METADATA_CACHE'],
+                                     ttl=app.config['OAUTH_METADATA_TTL'], timeout=app.config['OAUTH_HTTP_TIMEOUT'])
+if app.config['GOOGLE_CLIENT_ID']:
+    google_metadata.start(oauth.google)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -79,9 +236,48 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'warning'
 
+# current_user is a cached UserIdentity; the full users row is only loaded if a view needs it
+identity_cache = IdentityCache(ttl=app.config['IDENTITY_CACHE_TTL'], max_size=app.config['IDENTITY_CACHE_SIZE'])
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.load(int(user_id))
+
+patient_cache = PatientCache(max_size=app.config['PATIENT_CACHE_SIZE'])
+
+api_tokens = ApiTokens(app.config['SECRET_KEY'], ttl=app.config['API_TOKEN_TTL'],
+                       revocation_refresh=app.config['API_TOKEN_REVOCATION_REFRESH'])
+
+
+def bearer_token():
+    """The token from an 'Authorization: Bearer' header, if any"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+
+@login_manager.request_loader
+def load_user_from_token(request):
+    """Authenticate machine clients from the token's claims; the users row is only read if a view needs it"""
+    token = bearer_token()
+    # Tokens of deactivated or deleted accounts stop working; the identity cache answers without a query
+    return api_tokens.authenticate(token, identity_cache) if token else None
+
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    """401 for API calls, otherwise the login page"""
+    if request.path.startswith('/api/'):
+        return {'success': False, 'error': 'Authentication required'}, 401, {'WWW-Authenticate': 'Bearer'}
+    flash(login_manager.login_message, login_manager.login_message_category)
+    return redirect(url_for(login_manager.login_view, next=request.url))
+
+
+@app.errorhandler(UserDeleted)
+def user_deleted(error):
+    """The account was deleted while its identity was still cached: log the session out"""
+    identity_cache.invalidate(error.user_id)
+    logout_user()
+    return unauthorized()
 
 # Token serializer for password reset
 serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
@@ -90,386 +286,102 @@ serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
 def send_welcome_email(user):
     """Send welcome email after successful onboarding"""
     try:
-        msg = Message(
+        msg = email_templates.message(
+            'welcome',
             subject='Welcome to NeuroSight - Registration Successful!',
-            recipients=[user.email]
+            recipients=[user.email],
+            user=user,
+            dashboard_url=url_for('dashboard', _external=True)
         )
-        
-        # Create HTML email body
-        msg.html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{
-                    font-family: 'Arial', sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .header {{
-                    background: linear-gradient(135deg, #0EA5E9 0%, #06B6D4 100%);
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                    border-radius: 10px 10px 0 0;
-                }}
-                .header h1 {{
-                    margin: 0;
-                    font-size: 28px;
-                }}
-                .content {{
-                    background: #ffffff;
-                    padding: 30px;
-                    border: 1px solid #e2e8f0;
-                }}
-                .details-box {{
-                    background: #f8fafc;
-                    border-left: 4px solid #0EA5E9;
-                    padding: 20px;
-                    margin: 20px 0;
-                    border-radius: 5px;
-                }}
-                .details-box h3 {{
-                    color: #0EA5E9;
-                    margin-top: 0;
-                }}
-                .detail-row {{
-                    padding: 8px 0;
-                    border-bottom: 1px solid #e2e8f0;
-                }}
-                .detail-row:last-child {{
-                    border-bottom: none;
-                }}
-                .detail-label {{
-                    font-weight: bold;
-                    color: #64748b;
-                    display: inline-block;
-                    width: 180px;
-                }}
-                .detail-value {{
-                    color: #0f172a;
-                }}
-                .footer {{
-                    background: #f8fafc;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 0 0 10px 10px;
-                    color: #64748b;
-                    font-size: 14px;
-                }}
-                .button {{
-                    display: inline-block;
-                    padding: 12px 30px;
-                    background: linear-gradient(135deg, #0EA5E9 0%, #06B6D4 100%);
-                    color: white;
-                    text-decoration: none;
-                    border-radius: 5px;
-                    margin: 20px 0;
-                    font-weight: bold;
-                }}
-                .icon {{
-                    font-size: 48px;
-                    margin-bottom: 10px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <div class="icon">🧠</div>
-                <h1>Welcome to NeuroSight!</h1>
-                <p>Your registration is complete</p>
-            </div>
-            
-            <div class="content">
-                <h2>Dear Dr. {user.full_name},</h2>
-                
-                <p>Congratulations! Your NeuroSight account has been successfully created and verified.</p>
-                
-                <p>We're excited to have you join our community of healthcare professionals using AI-powered brain disease detection technology.</p>
-                
-                <div class="details-box">
-                    <h3>📋 Your Registration Details</h3>
-                    <div class="detail-row">
-                        <span class="detail-label">Full Name:</span>
-                        <span class="detail-value">{user.full_name}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Email:</span>
-                        <span class="detail-value">{user.email}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Medical Reg. No:</span>
-                        <span class="detail-value">{user.medical_registration_no or 'N/A'}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Role:</span>
-                        <span class="detail-value">{user.specialization or 'N/A'}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Years of Experience:</span>
-                        <span class="detail-value">{user.years_of_experience or 'N/A'} years</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Hospital/Clinic:</span>
-                        <span class="detail-value">{user.hospital or 'N/A'}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Department:</span>
-                        <span class="detail-value">{user.department or 'N/A'}</span>
-                    </div>
-                    <div class="detail-row">
-                        <span class="detail-label">Registration Date:</span>
-                        <span class="detail-value">{user.created_at.strftime('%B %d, %Y at %I:%M %p')}</span>
-                    </div>
-                </div>
-                
-                <h3>🚀 What's Next?</h3>
-                <ul>
-                    <li><strong>Upload Brain Scans:</strong> Start analyzing MRI scans for various brain diseases</li>
-                    <li><strong>View Analysis History:</strong> Track all your previous analyses</li>
-                    <li><strong>Generate Reports:</strong> Download professional PDF reports for your patients</li>
-                    <li><strong>Manage Profile:</strong> Update your professional details anytime</li>
-                </ul>
-                
-                <center>
-                    <a href="http://localhost:5000/dashboard" class="button">Go to Dashboard</a>
-                </center>
-                
-                <h3>💡 Quick Tips</h3>
-                <ul>
-                    <li>Ensure MRI scans are in supported formats (JPG, PNG, JPEG)</li>
-                    <li>For best results, use high-quality brain scan images</li>
-                    <li>Review the confidence scores provided with each analysis</li>
-                    <li>Keep your professional credentials up to date</li>
-                </ul>
-                
-                <p><strong>Need Help?</strong> If you have any questions or need assistance, please don't hesitate to contact our support team.</p>
-                
-                <p>Thank you for choosing NeuroSight. We're committed to supporting you in providing the best possible care for your patients.</p>
-                
-                <p>Best regards,<br>
-                <strong>The NeuroSight Team</strong></p>
-            </div>
-            
-            <div class="footer">
-                <p>This is an automated message from NeuroSight Brain Disease Detection System</p>
-                <p>© 2024 NeuroSight. All rights reserved.</p>
-                <p style="font-size: 12px; margin-top: 10px;">
-                    If you did not register for this account, please contact us immediately.
-                </p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text version as fallback
-        msg.body = f"""
-        Welcome to NeuroSight!
-        
-        Dear Dr. {user.full_name},
-        
-        Congratulations! Your NeuroSight account has been successfully created and verified.
-        
-        Your Registration Details:
-        - Full Name: {user.full_name}
-        - Email: {user.email}
-        - Medical Registration No: {user.medical_registration_no or 'N/A'}
-        - Role: {user.specialization or 'N/A'}
-        - Years of Experience: {user.years_of_experience or 'N/A'} years
-        - Hospital/Clinic: {user.hospital or 'N/A'}
-        - Department: {user.department or 'N/A'}
-        - Registration Date: {user.created_at.strftime('%B %d, %Y at %I:%M %p')}
-        
-        What's Next?
-        - Upload Brain Scans for analysis
-        - View your analysis history
-        - Generate professional PDF reports
-        - Manage your profile
-        
-        Visit your dashboard: http://localhost:5000/dashboard
-        
-        Thank you for choosing NeuroSight!
-        
-        Best regards,
-        The NeuroSight Team
-        """
-        
-        mail.send(msg)
-        print(f"✓ Welcome email sent to {user.email}")
+        email_sender.queue(msg, 'welcome')
+        print(f"✓ Welcome email queued for {user.email}")
         return True
     except Exception as e:
-        print(f"✗ Failed to send welcome email to {user.email}: {str(e)}")
+        print(f"✗ Failed to queue welcome email to {user.email}: {str(e)}")
         return False
 
 
 def send_otp_email(user, otp_code):
     """Send OTP email for email verification"""
     try:
-        msg = Message(
+        msg = email_templates.message(
+            'otp',
             subject='NeuroSight - Email Verification Code',
-            recipients=[user.email]
+            recipients=[user.email],
+            user=user,
+            otp_code=otp_code
         )
-        
-        # Create HTML email body
-        msg.html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{
-                    font-family: 'Arial', sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .header {{
-                    background: linear-gradient(135deg, #0EA5E9 0%, #06B6D4 100%);
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                    border-radius: 10px 10px 0 0;
-                }}
-                .header h1 {{
-                    margin: 0;
-                    font-size: 28px;
-                }}
-                .content {{
-                    background: #ffffff;
-                    padding: 40px;
-                    border: 1px solid #e2e8f0;
-                }}
-                .otp-box {{
-                    background: #f8fafc;
-                    border: 3px dashed #0EA5E9;
-                    padding: 30px;
-                    margin: 30px 0;
-                    text-align: center;
-                    border-radius: 10px;
-                }}
-                .otp-code {{
-                    font-size: 48px;
-                    font-weight: bold;
-                    color: #0EA5E9;
-                    letter-spacing: 10px;
-                    font-family: 'Courier New', monospace;
-                }}
-                .warning-box {{
-                    background: #FEF3C7;
-                    border-left: 4px solid #F59E0B;
-                    padding: 15px;
-                    margin: 20px 0;
-                    border-radius: 5px;
-                }}
-                .footer {{
-                    background: #f8fafc;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 0 0 10px 10px;
-                    color: #64748b;
-                    font-size: 14px;
-                }}
-                .icon {{
-                    font-size: 48px;
-                    margin-bottom: 10px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <div class="icon">🔐</div>
-                <h1>Email Verification</h1>
-                <p>Verify your NeuroSight account</p>
-            </div>
-            
-            <div class="content">
-                <h2>Hello {user.full_name},</h2>
-                
-                <p>Thank you for registering with NeuroSight! To complete your registration, please verify your email address using the code below:</p>
-                
-                <div class="otp-box">
-                    <p style="margin: 0; color: #64748b; font-size: 14px; margin-bottom: 10px;">YOUR VERIFICATION CODE</p>
-                    <div class="otp-code">{otp_code}</div>
-                    <p style="margin: 10px 0 0 0; color: #64748b; font-size: 14px;">Valid for 10 minutes</p>
-                </div>
-                
-                <p><strong>How to verify:</strong></p>
-                <ol>
-                    <li>Return to the registration page</li>
-                    <li>Enter the 6-digit code above</li>
-                    <li>Click "Verify Email"</li>
-                </ol>
-                
-                <div class="warning-box">
-                    <strong>⚠️ Security Notice:</strong>
-                    <ul style="margin: 10px 0 0 0;">
-                        <li>Never share this code with anyone</li>
-                        <li>NeuroSight will never ask for this code via phone or email</li>
-                        <li>This code expires in 10 minutes</li>
-                        <li>You have 5 attempts to enter the correct code</li>
-                    </ul>
-                </div>
-                
-                <p>If you didn't request this code, please ignore this email or contact our support team if you have concerns.</p>
-                
-                <p>Best regards,<br>
-                <strong>The NeuroSight Team</strong></p>
-            </div>
-            
-            <div class="footer">
-                <p>This is an automated message from NeuroSight Brain Disease Detection System</p>
-                <p>© 2024 NeuroSight. All rights reserved.</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text version as fallback
-        msg.body = f"""
-        NeuroSight - Email Verification
-        
-        Hello {user.full_name},
-        
-        Thank you for registering with NeuroSight!
-        
-        Your verification code is: {otp_code}
-        
-        This code is valid for 10 minutes.
-        
-        How to verify:
-        1. Return to the registration page
-        2. Enter the 6-digit code
-        3. Click "Verify Email"
-        
-        Security Notice:
-        - Never share this code with anyone
-        - This code expires in 10 minutes
-        - You have 5 attempts to enter the correct code
-        
-        If you didn't request this code, please ignore this email.
-        
-        Best regards,
-        The NeuroSight Team
-        """
-        
-        mail.send(msg)
-        print(f"✓ OTP email sent to {user.email}")
+        email_sender.queue(msg, 'otp')
+        print(f"✓ OTP email queued for {user.email}")
         return True
     except Exception as e:
-        print(f"✗ Failed to send OTP email to {user.email}: {str(e)}")
+        print(f"✗ Failed to queue OTP email to {user.email}: {str(e)}")
         return False
 
 
 
 # Configuration
 UPLOAD_FOLDER = os.path.join(app.static_folder, "uploads")
-REPORTS_FOLDER = os.path.join(app.static_folder, "reports")
+DERIVATIVES_FOLDER = os.path.join(app.static_folder, "derivatives")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(REPORTS_FOLDER, exist_ok=True)
+
+# Content-addressed upload store; files from before it existed stay flat in UPLOAD_FOLDER
+upload_store = create_upload_store(app.config, legacy_root=UPLOAD_FOLDER)
+
+# Thumbnails and report-sized renditions, cached on disk by content hash
+derivative_cache = DerivativeCache(DERIVATIVES_FOLDER, upload_store)
+
+
+def report_fields(analysis):
+    """Everything a report shows for an analysis; the cached PDF is keyed by a hash of this"""
+    return {
+        'template': REPORT_TEMPLATE_VERSION,
+        'patient_name': analysis.patient_name or 'N/A',
+        'patient_id': analysis.patient_id or 'N/A',
+        'patient_age': analysis.patient_age if analysis.patient_age is not None else 'N/A',
+        'scan_date': analysis.scan_date.strftime('%Y-%m-%d') if analysis.scan_date else 'N/A',
+        'disease_name': DISEASE_CONFIG.get(analysis.disease_type, {}).get('name', 'Unknown'),
+        'prediction': analysis.prediction,
+        'confidence': round(analysis.confidence * 100, 2) if analysis.confidence is not None else 'N/A',
+        'image_path': analysis.image_path or '',
+        'notes': analysis.notes or ''
+    }
+
+
+def report_image_source(image_path):
+    """Report-sized rendition of an upload for embedding in a PDF, or None if it is unavailable"""
+    if not image_path:
+        return None
+    try:
+        return derivative_cache.get(image_path, 'report')
+    except Exception as e:
+        print(f"✗ Could not load report image {image_path}: {e}")
+        return None
+
+
+def render_analysis_report(analysis_id, fields, target):
+    """Render a cached report on the worker thread"""
+    with app.app_context():
+        build_report(target, fields, report_image_source(fields['image_path']))
+
+
+def current_report_fingerprint(analysis_id):
+    """Fingerprint of the analysis's report fields as they are now, or None if it was deleted"""
+    with app.app_context():
+        analysis = db.session.get(AnalysisHistory, analysis_id)
+        return ReportCache.fingerprint(report_fields(analysis)) if analysis is not None else None
+
+
+def record_report_path(analysis_id, path):
+    """Point AnalysisHistory.report_path at the freshly cached PDF"""
+    with app.app_context():
+        AnalysisHistory.query.filter_by(id=analysis_id).update({'report_path': path})
+        db.session.commit()
+
+
+# Rendered analysis reports, cached on disk per analysis version
+report_cache = ReportCache(app.config['REPORT_CACHE_FOLDER'], render_analysis_report, record_report_path,
+                           current_report_fingerprint)
 
 # Load feature extractor
 print("Loading ViT feature extractor...")
@@ -480,22 +392,26 @@ DISEASE_CONFIG = {
     'ms': {
         'name': 'Multiple Sclerosis',
         'model_path': 'multiple_sclerosis.pth',
+        'input_size': (224, 224),
         'class_mapping': {0: 'Control-Axial', 1: 'Control-Sagittal', 2: 'MS-Axial', 3: 'MS-Sagittal'}
     },
     'alzheimer': {
         'name': "Alzheimer's Disease",
         'model_path': 'alzhimermodel.pth',
+        'input_size': (224, 224),
         'class_mapping': {0: 'Mild-alzhimer', 1: 'Moderate-alzhimer', 2: 'Non-alzhimer', 3: 'VeryMild-alzhimer'}
     },
    
     'dementia': {
         'name': 'Dementia',
         'model_path': 'dementia_detection_model_2.h5',
+        'input_size': (128, 128),
         'class_mapping': {0: 'Non-Demented', 1: 'Very-Mild-Demented', 2: 'Mild-Demented', 3: 'Moderate-Demented'}
     },
     'stroke': {
         'name': 'Stroke',
         'model_path': 'stroke.pth',
+        'input_size': (224, 224),
         'class_mapping': {0: 'Normal 😊', 1: 'Stroke 💔'}
     }
 }
@@ -605,14 +521,43 @@ for disease_key, config in DISEASE_CONFIG.items():
 print(f"\nLoaded {len(models)} out of {len(DISEASE_CONFIG)} models successfully.\n")
 
 
+def predict_probabilities(disease_type, images):
+    """
+    Run a batch of decoded images through a disease model
+    Returns an (n_images x n_classes) array of class probabilities
+    """
+    model = models[disease_type]
+    
+    if hasattr(model, 'model_type') and model.model_type == 'keras':
+        # Keras/TensorFlow model (EfficientNetB3 for dementia), normalised to [0, 1]
+        input_size = DISEASE_CONFIG[disease_type]['input_size']
+        batch = np.stack([np.array(img.resize(input_size).convert('RGB')) for img in images]) / 255.0
+        return np.asarray(model.predict(batch, verbose=0))
+    
+    # PyTorch model (ViT or ConvNeXt)
+    inputs = feature_extractor(images=[img.convert('RGB') for img in images], return_tensors="pt")
+    with torch.no_grad():
+        logits = model(pixel_values=inputs['pixel_values']).logits
+    
+    if disease_type == 'stroke':
+        # Binary classification with 1 output node (ConvNeXt): sigmoid gives P(Stroke)
+        prob = torch.sigmoid(logits).squeeze(-1)
+        return torch.stack([1 - prob, prob], dim=-1).numpy()
+    
+    # Multi-class classification (ViT)
+    return F.softmax(logits, dim=-1).numpy()
+
+
 # ============ HELPER FUNCTIONS ============
 
 def get_google_provider_cfg():
-    """Fetch Google's OAuth 2.0 provider configuration"""
-    try:
-        return requests.get(app.config['GOOGLE_DISCOVERY_URL']).json()
-    except:
-        return None
+    """Google's OAuth 2.0 provider configuration, from the metadata cache"""
+    if google_metadata.metadata is None:
+        try:
+            google_metadata.refresh()
+        except Exception:
+            return None
+    return google_metadata.metadata
 
 def send_reset_email(user):
     """Send password reset email to user"""
@@ -623,51 +568,18 @@ def send_reset_email(user):
         # Create reset URL
         reset_url = url_for('reset_password', token=token, _external=True)
         
-        # Create email message
-        msg = Message(
+        msg = email_templates.message(
+            'password_reset',
             subject='NeuroSight - Password Reset Request',
             recipients=[user.email],
-            sender=app.config['MAIL_DEFAULT_SENDER']
+            sender=app.config['MAIL_DEFAULT_SENDER'],
+            user=user,
+            reset_url=reset_url
         )
-        
-        # Email body
-        msg.html = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                        <h1 style="color: white; margin: 0;">🧠 NeuroSight</h1>
-                        <p style="color: #f0f0f0; margin: 10px 0 0 0;">AI-Powered Brain Disease Detection</p>
-                    </div>
-                    <div style="background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px;">
-                        <h2 style="color: #667eea;">Password Reset Request</h2>
-                        <p>Hello <strong>{user.full_name}</strong>,</p>
-                        <p>We received a request to reset your password for your NeuroSight account.</p>
-                        <p>Click the button below to reset your password:</p>
-                        <div style="text-align: center; margin: 30px 0;">
-                            <a href="{reset_url}" style="background: #667eea; color: white; padding: 15px 30px; text-decoration: none; border-radius: 5px; display: inline-block; font-weight: bold;">Reset Password</a>
-                        </div>
-                        <p style="color: #666; font-size: 14px;">Or copy and paste this link into your browser:</p>
-                        <p style="background: white; padding: 10px; border-radius: 5px; word-break: break-all; font-size: 12px;">{reset_url}</p>
-                        <p style="color: #666; font-size: 14px; margin-top: 30px;">
-                            <strong>This link will expire in 1 hour.</strong><br>
-                            If you didn't request this password reset, please ignore this email.
-                        </p>
-                        <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
-                        <p style="color: #999; font-size: 12px; text-align: center;">
-                            NeuroSight - Rajalakshmi Engineering College<br>
-                            Contact: asuproject0112@gmail.com
-                        </p>
-                    </div>
-                </div>
-            </body>
-        </html>
-        """
-        
-        mail.send(msg)
+        email_sender.queue(msg, 'password_reset')
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        print(f"Error queueing email: {e}")
         return False
 
 def verify_reset_token(token, expiration=3600):
@@ -681,6 +593,39 @@ def verify_reset_token(token, expiration=3600):
 
 # ============ AUTHENTICATION ROUTES ============
 
+def form_field(name):
+    """Rate limit account key taken from a submitted form field"""
+    return lambda: request.form.get(name)
+
+
+def json_field(name):
+    """Rate limit account key taken from a field of the JSON body"""
+    return lambda: (request.get_json(silent=True) or {}).get(name)
+
+
+@app.errorhandler(RateLimitExceeded)
+def rate_limit_exceeded(e):
+    """Too many attempts from this client or for this account; nothing was hashed or sent"""
+    wait = f"{e.retry_after} seconds" if e.retry_after < 60 else f"{-(-e.retry_after // 60)} minutes"
+    return auth_error_response(f'Too many attempts. Please try again in {wait}.', 429, e.retry_after)
+
+
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(e):
+    """Too many logins already waiting for a password check"""
+    return auth_error_response('The server is busy. Please try again in a moment.', 503, e.retry_after)
+
+
+def auth_error_response(error_msg, status, retry_after):
+    """JSON error for API calls, otherwise the submitted form page with a flash message"""
+    headers = {'Retry-After': str(retry_after)}
+    if request.path.startswith('/api/'):
+        return {'success': False, 'error': error_msg, 'retry_after': retry_after}, status, headers
+    flash(error_msg, 'danger')
+    templates = {'register': 'register.html', 'forgot_password': 'forgot_password.html', 'reset_password': 'reset_password.html'}
+    return render_template(templates.get(request.endpoint, 'login.html'), **(request.view_args or {})), status, headers
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     """User registration"""
@@ -746,6 +691,7 @@ def register():
 # ============================================================================
 
 @app.route('/api/register', methods=['POST'])
+@rate_limiter.limit('email', account=json_field('email'))
 def api_register():
     """API endpoint for email/password registration with OTP verification"""
     try:
@@ -820,6 +766,7 @@ def api_register():
 
 
 @app.route('/api/verify-otp', methods=['POST'])
+@rate_limiter.limit('otp', account=json_field('user_id'))
 def api_verify_otp():
     """API endpoint to verify OTP code"""
     try:
@@ -862,6 +809,7 @@ def api_verify_otp():
 
 
 @app.route('/api/resend-otp', methods=['POST'])
+@rate_limiter.limit('email', account=json_field('user_id'))
 def api_resend_otp():
     """API endpoint to resend OTP code"""
     try:
@@ -912,6 +860,7 @@ def verify_email():
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', account=form_field('email'))
 def login():
     """User login"""
     if current_user.is_authenticated:
@@ -927,8 +876,10 @@ def login():
             return render_template('login.html')
         
         user = User.query.filter_by(email=email).first()
+        # Unknown emails still pay for one hash, so response times don't reveal which accounts exist
+        password_ok = user.check_password(password) if user else passwords.verify(None, password)
         
-        if user and user.check_password(password):
+        if password_ok:
             if not user.is_active:
                 flash('Your account has been deactivated. Please contact support.', 'danger')
                 return render_template('login.html')
@@ -953,6 +904,43 @@ def login():
     return render_template('login.html')
 
 
+@app.route('/api/token', methods=['POST'])
+@rate_limiter.limit('login', account=json_field('email'))
+def api_token():
+    """Issue a bearer token for the JSON endpoints (e.g. to a PACS gateway's service account)"""
+    data = request.get_json(silent=True) or {}
+    email = (data.get('email') or '').strip()
+    password = data.get('password') or ''
+    
+    if not email or not password:
+        return {'success': False, 'error': 'Email and password are required'}, 400
+    
+    user = User.query.filter_by(email=email).first()
+    password_ok = user.check_password(password) if user else passwords.verify(None, password)
+    if not password_ok:
+        return {'success': False, 'error': 'Invalid email or password'}, 401
+    if not user.is_active:
+        return {'success': False, 'error': 'Account is deactivated'}, 403
+    if user.email_verified is False:
+        return {'success': False, 'error': 'Email address is not verified'}, 403
+    
+    # check_password() may have upgraded the hash to the current scheme; keep it, as /login does
+    db.session.commit()
+    token, expires_in = api_tokens.issue(user)
+    return {'success': True, 'access_token': token, 'token_type': 'Bearer', 'expires_in': expires_in}
+
+
+@app.route('/api/token/revoke', methods=['POST'])
+def api_token_revoke():
+    """Revoke the bearer token this request was made with"""
+    token = bearer_token()
+    claims = api_tokens.verify(token) if token else None
+    if claims is None:
+        return {'success': False, 'error': 'Invalid or expired token'}, 401, {'WWW-Authenticate': 'Bearer'}
+    api_tokens.revoke(claims)
+    return {'success': True}
+
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -1051,6 +1039,7 @@ def google_callback():
 # ============ PASSWORD RESET ROUTES ============
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
+@rate_limiter.limit('email', account=form_field('email'))
 def forgot_password():
     """Forgot password page"""
     if current_user.is_authenticated:
@@ -1244,43 +1233,259 @@ def complete_onboarding():
 @login_required
 def dashboard():
     """User dashboard"""
-    total_analyses = AnalysisHistory.query.filter_by(user_id=current_user.id).count()
-    
-    # Get analyses from this month
-    from datetime import datetime, timedelta
-    month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    recent_analyses = AnalysisHistory.query.filter(
-        AnalysisHistory.user_id == current_user.id,
-        AnalysisHistory.created_at >= month_start
-    ).count()
+    # Counters are maintained per user as analyses are saved (see UserStats)
+    stats = UserStats.summary(current_user.id)
     
     # Get recent history (last 5)
     recent_history = AnalysisHistory.query.filter_by(user_id=current_user.id)\
         .order_by(AnalysisHistory.created_at.desc()).limit(5).all()
     
     return render_template('dashboard.html',
-                         total_analyses=total_analyses,
-                         recent_analyses=recent_analyses,
+                         total_analyses=stats['total'],
+                         recent_analyses=stats['this_month'],
+                         disease_counts=stats['by_disease'],
                          recent_history=recent_history)
 
 
 @app.route('/history')
 @login_required
 def history():
-    """View analysis history"""
-    analyses = AnalysisHistory.query.filter_by(user_id=current_user.id)\
-        .order_by(AnalysisHistory.created_at.desc()).all()
-    return render_template('history.html', analyses=analyses)
+    """View analysis history, one page at a time (?cursor= from the previous page, plus optional filters)"""
+    try:
+        filters = parse_filters(request.args)
+        analyses, next_cursor = history_page(current_user.id, filters, request.args.get('cursor'),
+                                             app.config['HISTORY_PAGE_SIZE'])
+    except HistoryQueryError as e:
+        flash(str(e), 'warning')
+        filters = {}
+        analyses, next_cursor = history_page(current_user.id, limit=app.config['HISTORY_PAGE_SIZE'])
+    
+    return render_template('history.html', analyses=analyses, next_cursor=next_cursor, filters=filters)
+
+
+def analysis_summary(analysis):
+    """JSON fields of an analysis for history and search results"""
+    return {
+        'id': analysis.id,
+        'patient_name': analysis.patient_name,
+        'patient_id': analysis.patient_id,
+        'patient_age': analysis.patient_age,
+        'scan_date': analysis.scan_date.isoformat() if analysis.scan_date else None,
+        'disease_type': analysis.disease_type,
+        'prediction': analysis.prediction,
+        'confidence': analysis.confidence,
+        'slice_count': analysis.slice_count,
+        'created_at': analysis.created_at.isoformat(),
+        'thumbnail_url': thumbnail_url(analysis.image_path) if analysis.image_path else None,
+        'report_url': url_for('analysis_report', analysis_id=analysis.id)
+    }
+
+
+@app.route('/api/history')
+@login_required
+def api_history():
+    """JSON history page; pass next_cursor back as ?cursor= to get the following page"""
+    try:
+        limit = min(int(request.args.get('limit', app.config['HISTORY_PAGE_SIZE'])), app.config['HISTORY_MAX_PAGE_SIZE'])
+    except ValueError:
+        return {'success': False, 'error': 'limit must be a number'}, 400
+    if limit < 1:
+        return {'success': False, 'error': 'limit must be at least 1'}, 400
+    
+    try:
+        analyses, next_cursor = history_page(current_user.id, parse_filters(request.args), request.args.get('cursor'), limit)
+    except HistoryQueryError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    return {
+        'success': True,
+        'analyses': [analysis_summary(analysis) for analysis in analyses],
+        'next_cursor': next_cursor
+    }
+
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    """Search the user's analyses by patient name, patient ID, prediction or notes (?q=, &page=, &limit=)"""
+    try:
+        page = int(request.args.get('page', 1))
+        limit = min(int(request.args.get('limit', app.config['HISTORY_PAGE_SIZE'])), app.config['HISTORY_MAX_PAGE_SIZE'])
+    except ValueError:
+        return {'success': False, 'error': 'page and limit must be numbers'}, 400
+    if page < 1 or limit < 1:
+        return {'success': False, 'error': 'page and limit must be at least 1'}, 400
+    
+    try:
+        analyses, has_more = search_analyses(current_user.id, request.args.get('q', ''), page, limit,
+                                               candidates=app.config['SEARCH_CANDIDATES'])
+    except SearchQueryError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    return {
+        'success': True,
+        'query': request.args.get('q', ''),
+        'results': [analysis_summary(analysis) for analysis in analyses],
+        'page': page,
+        'has_more': has_more
+    }
 
 
 # ============ MAIN APPLICATION ROUTES ============
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Reject request bodies over MAX_CONTENT_LENGTH"""
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    error_msg = f'Upload is too large. The maximum size is {limit_mb:.0f} MB.'
+    if request.path.startswith('/api/'):
+        return {'success': False, 'error': error_msg}, 413
+    return render_template('detect.html', error=error_msg), 413
+
+
 @app.route('/')
 def landing():
     """Landing page"""
     return render_template('landing.html')
 
 
+class AnalysisInputError(Exception):
+    """An upload that cannot be analysed; the message is shown to the user"""
+
+
+def run_analysis(files, disease_type, patient_info, aggregation=None):
+    """
+    Analyse an uploaded image or series for the current user and save the result
+    Shared by the detect page and /api/analyses; returns the committed AnalysisHistory row.
+    """
+    # The form's date field sends YYYY-MM-DD; 'N/A' or nothing means no scan date was entered
+    scan_date = (patient_info.get('scan_date') or '').strip()
+    if scan_date and scan_date.upper() != 'N/A':
+        try:
+            scan_date = datetime.strptime(scan_date, '%Y-%m-%d').date()
+        except ValueError:
+            raise AnalysisInputError('Scan date must be a date in YYYY-MM-DD format.')
+        if scan_date > (datetime.utcnow() + timedelta(days=1)).date():
+            raise AnalysisInputError('Scan date cannot be in the future.')
+    else:
+        scan_date = None
+    
+    # Read the upload into memory and decode it directly from the buffer
+    file = files[0]
+    filename = secure_filename(file.filename)
+    data = file.read()
+    class_mapping = DISEASE_CONFIG[disease_type]['class_mapping']
+    input_size = DISEASE_CONFIG[disease_type]['input_size']
+    series_details = None
+    slice_count = None
+    
+    if detect_volume_format(file.filename, data):
+        # DICOM series / NIfTI volume: slices are decoded lazily and analysed in batches
+        volume_files = [(file.filename, data)] + [(f.filename, f.read()) for f in files[1:]]
+        try:
+            volume = load_volume(volume_files, max_slices=app.config['SERIES_MAX_SLICES'],
+                                 max_pixels=app.config['MAX_IMAGE_PIXELS'])
+        except VolumeError as e:
+            raise AnalysisInputError(str(e))
+        
+        if aggregation not in AGGREGATION_METHODS:
+            aggregation = app.config['SERIES_AGGREGATION']
+        
+        # Pixel data is only decoded here, so a damaged slice surfaces during the analysis
+        try:
+            series = analyze_series(
+                lambda position: decode_for_model(volume.image(position), input_size),
+                len(volume),
+                lambda images: predict_probabilities(disease_type, images),
+                aggregation=aggregation,
+                batch_size=app.config['SERIES_BATCH_SIZE'],
+                stop_confidence=app.config['SERIES_STOP_CONFIDENCE'],
+                min_slices=app.config['SERIES_MIN_SLICES']
+            )
+        except VolumeError as e:
+            raise AnalysisInputError(str(e))
+        probabilities = series.probabilities
+        slice_count = len(series.slice_probabilities)
+        series_details = json.dumps({
+            'aggregation': series.aggregation,
+            'stopped_early': series.stopped_early,
+            'slices_total': volume.slice_count,
+            'slices_selected': len(volume),
+            'slices': [
+                {
+                    'slice_index': volume.indices[position],
+                    'prediction': class_mapping[int(np.argmax(slice_probs))],
+                    'confidence': round(float(np.max(slice_probs)), 4),
+                    'probabilities': [round(float(p), 4) for p in slice_probs]
+                }
+                for position, slice_probs in sorted(series.slice_probabilities.items())
+            ]
+        })
+        
+        # Store the most representative slice rather than the whole volume
+        position = series.representative_position
+        stem = filename[:-7] if filename.lower().endswith('.nii.gz') else os.path.splitext(filename)[0]
+        filename = f"{stem}_slice{volume.indices[position]}.png"
+        stored_data = encode_png(volume.image(position))
+        image_path, upload_saved = upload_store.save(stored_data, filename)
+        derivative_cache.generate_async(image_path, stored_data)
+    else:
+        try:
+            image = open_image(data, max_pixels=app.config['MAX_IMAGE_PIXELS'])
+            # Decode close to the model's input size (RGB conversion happens at tensor time). This is
+            # the full decode, so a truncated or corrupt file fails here, before anything is stored.
+            image = decode_for_model(image, input_size)
+        except ImageTooLargeError as e:
+            raise AnalysisInputError(f'{e}. Please upload a smaller image.')
+        except UnidentifiedImageError:
+            raise AnalysisInputError('The uploaded file is not a supported image.')
+        except (OSError, Image.DecompressionBombError):
+            raise AnalysisInputError('The uploaded image could not be decoded; it may be damaged or incomplete.')
+        
+        # Persist the original bytes in the background while inference runs
+        image_path, upload_saved = upload_store.save(data, filename)
+        derivative_cache.generate_async(image_path, data)
+        
+        probabilities = predict_probabilities(disease_type, [image])[0]
+    
+    predicted_class_idx = int(np.argmax(probabilities))
+    predicted_class = class_mapping[predicted_class_idx]
+    confidence = round(float(probabilities[predicted_class_idx]), 4)
+    
+    # The first write of the request: inference is done, so the write transaction stays short.
+    # The blob index row commits with the analysis, and index() waits for the blob to be written first.
+    upload_store.index(upload_saved)
+    
+    # Link the analysis to the patient record (created on first sight, updated if name or age changed)
+    patient_age = int(patient_info['age']) if patient_info['age'].isdigit() else None
+    patient_ref_id = patient_cache.resolve(db.session, current_user.id, patient_info['id'],
+                                           patient_info['name'] if patient_info['name'] not in ('', 'N/A') else None,
+                                           patient_age)
+    
+    # Save to database
+    analysis = AnalysisHistory(
+        user_id=current_user.id,
+        patient_ref_id=patient_ref_id,
+        patient_name=patient_info['name'],
+        patient_id=patient_info['id'],
+        patient_age=patient_age,
+        scan_date=scan_date,
+        disease_type=disease_type,
+        prediction=predicted_class,
+        confidence=confidence,
+        slice_count=slice_count,
+        series_details=series_details,
+        image_path=image_path
+    )
+    db.session.add(analysis)
+    db.session.commit()
+    
+    # Render the report now so the first download is served from the cache
+    report_cache.render_async(analysis.id, report_fields(analysis))
+    
+    return analysis
+
+
 @app.route('/detect', methods=['GET', 'POST'])
 @login_required  # Require login for detection
 def detect():
@@ -1307,80 +1512,20 @@ def detect():
             'scan_date': request.form.get('scan_date', 'N/A')
         }
         
-        # Save uploaded file
-        file = request.files['file']
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        
-        # Preprocess and run inference
-        image = Image.open(filepath).convert('RGB')
-        model = models[disease_type]
-        class_mapping = DISEASE_CONFIG[disease_type]['class_mapping']
-        
-        # Check if this is a Keras or PyTorch model
-        if hasattr(model, 'model_type') and model.model_type == 'keras':
-            # Keras/TensorFlow model (EfficientNetB3 for dementia)
-            # Resize to expected input size (128x128 for this specific model)
-            img_array = np.array(image.resize((128, 128)))
-            img_array = img_array / 255.0  # Normalize to [0, 1]
-            img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
-            
-            # Predict
-            predictions = model.predict(img_array, verbose=0)
-            predicted_class_idx = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_class_idx]) * 100
-            predicted_class = class_mapping[predicted_class_idx]
-            confidence = round(confidence, 2)
-        else:
-            # PyTorch model (ViT or ConvNeXt)
-            inputs = feature_extractor(images=image, return_tensors="pt")
-            pixel_values = inputs['pixel_values']
-            
-            with torch.no_grad():
-                outputs = model(pixel_values=pixel_values)
-                logits = outputs.logits
-                
-                if disease_type == 'stroke':
-                    # Binary classification with 1 output node (ConvNeXt)
-                    # Apply sigmoid to get probability of positive class (Stroke)
-                    prob = torch.sigmoid(logits).item()
-                    
-                    # Threshold at 0.5
-                    if prob >= 0.5:
-                        predicted_class_idx = 1 # Stroke
-                        confidence = prob * 100
-                    else:
-                        predicted_class_idx = 0 # Normal
-                        confidence = (1 - prob) * 100
-                        
-                    predicted_class = class_mapping[predicted_class_idx]
-                    confidence = round(confidence, 2)
-                else:
-                    # Multi-class classification (ViT)
-                    predicted_class_idx = logits.argmax(-1).item()
-                    predicted_class = class_mapping[predicted_class_idx]
-                    probabilities = F.softmax(logits, dim=-1)
-                    confidence = probabilities[0][predicted_class_idx].item() * 100
-                    confidence = round(confidence, 2)
-        
-        # Save to database
-        analysis = AnalysisHistory(
-            user_id=current_user.id,
-            patient_name=patient_info['name'],
-            patient_id=patient_info['id'],
-            patient_age=int(patient_info['age']) if patient_info['age'].isdigit() else None,
-            disease_type=disease_type,
-            prediction=predicted_class,
-            confidence=confidence / 100,
-            image_path=filename
-        )
-        db.session.add(analysis)
-        db.session.commit()
+        try:
+            analysis = run_analysis(request.files.getlist('file'), disease_type, patient_info,
+                                    request.form.get('aggregation'))
+        except AnalysisInputError as e:
+            flash(str(e), 'warning')
+            return redirect(request.url)
         
-        image_url = url_for('static', filename=f'uploads/{filename}')
+        predicted_class = analysis.prediction
+        confidence = round(analysis.confidence * 100, 2)
+        slice_count = analysis.slice_count
+        series_details = analysis.series_details
+        image_path = analysis.image_path
+        
+        image_url = url_for('serve_upload', image_path=image_path)
         
         return render_template('detect.html',
                              prediction=predicted_class,
@@ -1389,12 +1534,228 @@ def detect():
                              disease_type=disease_type,
                              disease_name=DISEASE_CONFIG[disease_type]['name'],
                              patient_info=patient_info,
+                             slice_count=slice_count,
+                             series=json.loads(series_details) if series_details else None,
+                             analysis_id=analysis.id,
                              selected_disease=disease_type)
     
     selected_disease = request.args.get('disease', '')
     return render_template('detect.html', selected_disease=selected_disease)
 
 
+@app.route('/api/analyses', methods=['POST'])
+@login_required
+def api_create_analysis():
+    """Analyse an upload for an API client (multipart form with the same fields as the detect page)"""
+    files = request.files.getlist('file')
+    if not files or files[0].filename == '':
+        return {'success': False, 'error': 'No image file uploaded'}, 400
+    
+    disease_type = request.form.get('disease')
+    if disease_type not in DISEASE_CONFIG:
+        return {'success': False, 'error': f"disease must be one of: {', '.join(DISEASE_CONFIG)}"}, 400
+    if disease_type not in models:
+        return {'success': False, 'error': f"{DISEASE_CONFIG[disease_type]['name']} model is not yet configured"}, 503
+    
+    patient_info = {
+        'name': request.form.get('patient_name', 'N/A'),
+        'id': request.form.get('patient_id', 'N/A'),
+        'age': request.form.get('patient_age', 'N/A'),
+        'scan_date': request.form.get('scan_date', 'N/A')
+    }
+    
+    try:
+        analysis = run_analysis(files, disease_type, patient_info, request.form.get('aggregation'))
+    except AnalysisInputError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    return {
+        'success': True,
+        'id': analysis.id,
+        'disease_type': disease_type,
+        'prediction': analysis.prediction,
+        'confidence': analysis.confidence,
+        'patient': patient_info,
+        'slice_count': analysis.slice_count,
+        'series': json.loads(analysis.series_details) if analysis.series_details else None,
+        'image_url': url_for('serve_upload', image_path=analysis.image_path, _external=True),
+        'report_url': url_for('analysis_report', analysis_id=analysis.id, _external=True)
+    }, 201
+
+
+def user_owns_upload(image_path):
+    """Check that the current user has an analysis referencing this upload"""
+    return db.session.query(AnalysisHistory.id).filter_by(
+        user_id=current_user.id, image_path=image_path
+    ).first() is not None
+
+
+@app.template_global()
+def thumbnail_url(image_path):
+    """Thumbnail URL for history and dashboard listings"""
+    return url_for('serve_thumbnail', image_path=image_path)
+
+
+@app.route('/uploads/<path:image_path>')
+@login_required
+def serve_upload(image_path):
+    """Serve a stored upload to a user who has an analysis referencing it"""
+    if not user_owns_upload(image_path):
+        abort(404)
+    
+    source = upload_store.open(image_path)
+    if source is None:
+        abort(404)
+    
+    # Content-addressed blobs never change, so browsers may cache them indefinitely
+    max_age = 31536000 if upload_store.is_content_addressed(image_path) else None
+    # After compaction the stored bytes may be WebP behind a .png image_path; name and type follow the stored object
+    return send_file(source, mimetype=upload_store.media_type(image_path),
+                     download_name=upload_store.download_name(image_path), max_age=max_age)
+
+
+@app.route('/thumbnails/<path:image_path>')
+@login_required
+def serve_thumbnail(image_path):
+    """Serve the cached thumbnail of a stored upload, generating it on first request"""
+    if not user_owns_upload(image_path):
+        abort(404)
+    
+    try:
+        thumbnail_path = derivative_cache.get(image_path, 'thumbnail')
+    except RENDER_ERRORS as e:
+        print(f"✗ Could not render thumbnail of {image_path}: {e}")
+        thumbnail_path = None
+    if thumbnail_path is None:
+        abort(404)
+    
+    max_age = 31536000 if upload_store.is_content_addressed(image_path) else None
+    return send_file(thumbnail_path, mimetype='image/jpeg', max_age=max_age)
+
+
+@app.route('/analyses/<int:analysis_id>/report')
+@login_required
+def analysis_report(analysis_id):
+    """Download the PDF report of a stored analysis, rendered once and then served from the cache"""
+    analysis = AnalysisHistory.query.filter_by(id=analysis_id, user_id=current_user.id).first_or_404()
+    fields = report_fields(analysis)
+    etag = ReportCache.fingerprint(fields)
+    
+    # The browser already has this version of the report
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    pdf_path = report_cache.cached(analysis.id, etag)
+    if pdf_path is None:
+        try:
+            pdf_path = report_cache.render_async(analysis.id, fields).result(timeout=app.config['REPORT_RENDER_TIMEOUT'])
+        except FutureTimeoutError:
+            flash('The report is still being generated. Please try the download again in a moment.', 'warning')
+            return redirect(url_for('history'))
+        except Exception as e:
+            flash(f'Error generating report: {str(e)}', 'danger')
+            return redirect(url_for('history'))
+    
+    response = send_file(pdf_path, as_attachment=True, mimetype='application/pdf',
+                         download_name=f"NeuroSight_Report_{secure_filename(fields['patient_id']) or 'patient'}_{analysis.id}.pdf",
+                         etag=etag, conditional=True)
+    # Reports change when notes are edited, so clients must revalidate before reusing a copy
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/analyses/<int:analysis_id>/notes', methods=['POST'])
+@login_required
+def update_analysis_notes(analysis_id):
+    """Update the doctor's notes on an analysis and drop its cached report"""
+    analysis = AnalysisHistory.query.filter_by(id=analysis_id, user_id=current_user.id).first_or_404()
+    data = request.get_json(silent=True) if request.is_json else request.form
+    notes = (data or {}).get('notes', '')
+    
+    analysis.notes = notes.strip() or None
+    analysis.report_path = None
+    db.session.commit()
+    report_cache.invalidate(analysis.id)
+    
+    if request.is_json:
+        return {'success': True, 'message': 'Notes updated'}, 200
+    flash('Notes updated.', 'success')
+    return redirect(url_for('history'))
+
+
+@app.route('/api/patients/<path:patient_id>/timeline')
+@login_required
+def api_patient_timeline(patient_id):
+    """A patient's analyses in scan-date order with per-disease trends (?disease= for one disease)"""
+    patient = Patient.query.filter_by(user_id=current_user.id, external_id=patient_id).first()
+    if patient is None:
+        return {'success': False, 'error': 'Patient not found'}, 404
+    
+    analyses, trends = patient_timeline(patient, request.args.get('disease'))
+    return {
+        'success': True,
+        'patient': {'id': patient.external_id, 'name': patient.name, 'age': patient.age},
+        'trends': {disease_type: trend.to_dict() for disease_type, trend in trends.items()},
+        'analyses': [analysis_summary(analysis) for analysis in analyses]
+    }
+
+
+@app.route('/patients/<path:patient_id>/export')
+@login_required
+def export_patient_reports(patient_id):
+    """Download every analysis of a patient as one PDF, or as a zip of per-analysis PDFs with ?format=zip"""
+    export_format = request.args.get('format', 'pdf')
+    if export_format not in ('pdf', 'zip'):
+        return {'success': False, 'error': 'Export format must be pdf or zip'}, 400
+    
+    patient = Patient.query.filter_by(user_id=current_user.id, external_id=patient_id).first_or_404()
+    analyses = AnalysisHistory.query.filter_by(patient_ref_id=patient.id)
+    total = analyses.count()
+    if total == 0:
+        abort(404)
+    
+    # The zip streams report by report; a combined PDF only exists once every page is rendered,
+    # so keep it well inside the worker timeout
+    max_combined = app.config['EXPORT_MAX_COMBINED_REPORTS']
+    if export_format == 'pdf' and total > max_combined:
+        flash(f'This patient has {total} reports, more than fit in one PDF ({max_combined}). '
+              f'Download them as a zip instead.', 'warning')
+        return redirect(url_for('history'))
+    
+    # Rows are streamed from the database in batches (a server-side cursor where the driver supports it)
+    ordered = analyses.order_by(AnalysisHistory.created_at, AnalysisHistory.id)\
+        .yield_per(app.config['EXPORT_BATCH_SIZE'])
+    
+    def combined_reports():
+        for analysis in ordered:
+            fields = report_fields(analysis)
+            yield fields, report_image_source(fields['image_path'])
+    
+    def report_files():
+        for index, analysis in enumerate(ordered, start=1):
+            fields = report_fields(analysis)
+            cached_path = report_cache.cached(analysis.id, ReportCache.fingerprint(fields))
+            if cached_path is not None:
+                with open(cached_path, 'rb') as f:
+                    data = f.read()
+            else:
+                data = render_report(fields, report_image_source(fields['image_path']))
+            name = f"{index:04d}_{analysis.created_at:%Y%m%d}_{analysis.disease_type}_{analysis.id}.pdf"
+            yield name, analysis.created_at.timetuple()[:6], data
+    
+    export_name = f"NeuroSight_Patient_{secure_filename(patient_id) or 'patient'}_{datetime.now():%Y%m%d}"
+    if export_format == 'zip':
+        body, mimetype, filename = iter_zip(report_files()), 'application/zip', f"{export_name}.zip"
+    else:
+        body, mimetype, filename = iter_combined_pdf(combined_reports()), 'application/pdf', f"{export_name}.pdf"
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @app.route('/generate-report', methods=['POST'])
 @login_required
 def generate_report():
@@ -1412,277 +1773,34 @@ def generate_report():
         disease_name = DISEASE_CONFIG.get(disease, {}).get('name', 'Unknown')
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        pdf_filename = f"NeuroSight_Report_{patient_id}_{timestamp}.pdf"
-        pdf_path = os.path.join(REPORTS_FOLDER, pdf_filename)
-        
-        doc = SimpleDocTemplate(pdf_path, pagesize=letter,
-                                rightMargin=50, leftMargin=50,
-                                topMargin=50, bottomMargin=50)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Custom Styles - Premium Design
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=28,
-            textColor=colors.HexColor('#1E40AF'),
-            spaceAfter=10,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
-        
-        subtitle_style = ParagraphStyle(
-            'CustomSubtitle',
-            parent=styles['Normal'],
-            fontSize=14,
-            textColor=colors.HexColor('#64748B'),
-            spaceAfter=20,
-            alignment=TA_CENTER,
-            fontName='Helvetica'
-        )
-        
-        section_heading_style = ParagraphStyle(
-            'SectionHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            textColor=colors.HexColor('#1E3A8A'),
-            spaceBefore=15,
-            spaceAfter=10,
-            fontName='Helvetica-Bold',
-            borderWidth=0,
-            borderColor=colors.HexColor('#3B82F6'),
-            borderPadding=5,
-            leftIndent=0
-        )
-        
-        body_style = ParagraphStyle(
-            'CustomBody',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#334155'),
-            leading=16,
-            fontName='Helvetica'
-        )
-        
-        # Header with Logo and Title
-        story.append(Paragraph("🧠 NeuroSight", title_style))
-        story.append(Paragraph("AI-Powered Brain Disease Detection Report", subtitle_style))
-        
-        # Decorative line
-        story.append(Spacer(1, 0.1*inch))
-        line_table = Table([['']], colWidths=[6.5*inch])
-        line_table.setStyle(TableStyle([
-            ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#3B82F6')),
-        ]))
-        story.append(line_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Report metadata
-        report_date = datetime.now().strftime('%B %d, %Y at %I:%M %p')
-        meta_data = [[Paragraph(f"<b>Report Generated:</b> {report_date}", body_style)]]
-        meta_table = Table(meta_data, colWidths=[6.5*inch])
-        meta_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F8FAFC')),
-            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#CBD5E1')),
-            ('LEFTPADDING', (0, 0), (-1, -1), 12),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        story.append(meta_table)
-        story.append(Spacer(1, 0.4*inch))
-        
-        # Patient Information Section
-        story.append(Paragraph("📋 Patient Information", section_heading_style))
-        story.append(Spacer(1, 0.15*inch))
-        
-        patient_data = [
-            [Paragraph('<b>Patient Name:</b>', body_style), Paragraph(patient_name, body_style)],
-            [Paragraph('<b>Patient ID:</b>', body_style), Paragraph(patient_id, body_style)],
-            [Paragraph('<b>Age:</b>', body_style), Paragraph(str(patient_age), body_style)],
-            [Paragraph('<b>Scan Date:</b>', body_style), Paragraph(scan_date, body_style)]
-        ]
-        patient_table = Table(patient_data, colWidths=[2*inch, 4.5*inch])
-        patient_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#EFF6FF')),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#DBEAFE')),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 12),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ]))
-        story.append(patient_table)
-        story.append(Spacer(1, 0.4*inch))
-        
-        # Diagnostic Results Section
-        story.append(Paragraph("🔬 Diagnostic Results", section_heading_style))
-        story.append(Spacer(1, 0.15*inch))
-        
-        # Determine result color based on prediction
-        result_color = colors.HexColor('#FEF3C7') if 'Normal' in str(prediction) or 'Control' in str(prediction) else colors.HexColor('#FEE2E2')
-        
-        results_data = [
-            [Paragraph('<b>Disease Type:</b>', body_style), Paragraph(disease_name, body_style)],
-            [Paragraph('<b>Prediction:</b>', body_style), Paragraph(f'<b>{prediction}</b>', body_style)],
-            [Paragraph('<b>Confidence Score:</b>', body_style), Paragraph(f'<b>{confidence}%</b>', body_style)]
-        ]
-        results_table = Table(results_data, colWidths=[2*inch, 4.5*inch])
-        results_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F0F9FF')),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('BACKGROUND', (1, 1), (1, 1), result_color),  # Highlight prediction
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#BFDBFE')),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 12),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ]))
-        story.append(results_table)
-        story.append(Spacer(1, 0.4*inch))
-        
-        # Brain Scan Image Section
-        if image_path:
-            story.append(Paragraph("🖼️ Brain Scan Image", section_heading_style))
-            story.append(Spacer(1, 0.15*inch))
-            try:
-                # Extract filename from URL path if needed (e.g., /static/uploads/file.jpg -> file.jpg)
-                if image_path.startswith('/static/uploads/'):
-                    filename = image_path.replace('/static/uploads/', '')
-                    img_full_path = os.path.join(UPLOAD_FOLDER, filename)
-                elif image_path.startswith('static/uploads/'):
-                    filename = image_path.replace('static/uploads/', '')
-                    img_full_path = os.path.join(UPLOAD_FOLDER, filename)
-                else:
-                    # Assume it's just the filename
-                    img_full_path = os.path.join(UPLOAD_FOLDER, image_path)
-                
-                print(f"DEBUG: Looking for image at: {img_full_path}")  # Debug logging
-                
-                if os.path.exists(img_full_path):
-                    # Create a bordered image container
-                    img = RLImage(img_full_path, width=4*inch, height=4*inch)
-                    img_data = [[img]]
-                    img_table = Table(img_data, colWidths=[4*inch])
-                    img_table.setStyle(TableStyle([
-                        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#3B82F6')),
-                        ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                        ('TOPPADDING', (0, 0), (-1, -1), 10),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                    ]))
-                    story.append(img_table)
-                    story.append(Spacer(1, 0.4*inch))
-                else:
-                    print(f"DEBUG: Image file not found at: {img_full_path}")  # Debug logging
-                    story.append(Paragraph(f"<i>Image file not found at expected location</i>", body_style))
-                    story.append(Spacer(1, 0.3*inch))
-            except Exception as e:
-                print(f"DEBUG: Error loading image: {str(e)}")  # Debug logging
-                story.append(Paragraph(f"<i>Image could not be loaded: {str(e)}</i>", body_style))
-                story.append(Spacer(1, 0.3*inch))
-        
-        # Result Analysis Section
-        story.append(Paragraph("📊 Result Analysis", section_heading_style))
-        story.append(Spacer(1, 0.15*inch))
-        
-        # Generate analysis based on confidence
-        try:
-            conf_value = float(confidence.strip('%')) if isinstance(confidence, str) else confidence
-        except:
-            conf_value = 0
-        
-        # Confidence interpretation with color coding
-        if conf_value >= 90:
-            conf_interpretation = "Very High - The model is highly confident in this prediction."
-            conf_color = colors.HexColor('#D1FAE5')
-        elif conf_value >= 75:
-            conf_interpretation = "High - The model shows strong confidence in this prediction."
-            conf_color = colors.HexColor('#DBEAFE')
-        elif conf_value >= 60:
-            conf_interpretation = "Moderate - The model shows reasonable confidence, but further clinical evaluation is recommended."
-            conf_color = colors.HexColor('#FEF3C7')
-        else:
-            conf_interpretation = "Low - The model has limited confidence. Additional testing is strongly recommended."
-            conf_color = colors.HexColor('#FEE2E2')
-        
-        # Confidence level box
-        conf_data = [[Paragraph(f'<b>Confidence Level:</b> {conf_interpretation}', body_style)]]
-        conf_table = Table(conf_data, colWidths=[6.5*inch])
-        conf_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), conf_color),
-            ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#94A3B8')),
-            ('LEFTPADDING', (0, 0), (-1, -1), 15),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-            ('TOPPADDING', (0, 0), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        story.append(conf_table)
-        story.append(Spacer(1, 0.25*inch))
-        
-        # Clinical Recommendations
-        clinical_text = """
-        <b>Clinical Recommendation:</b><br/><br/>
-        This AI-assisted analysis should be used as a <b>supplementary diagnostic tool</b>. 
-        The results must be reviewed and validated by qualified medical professionals. 
-        Further clinical examination, additional imaging, and comprehensive patient history 
-        should be considered before making any diagnostic or treatment decisions.
-        """
-        story.append(Paragraph(clinical_text, body_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Important Notes Box
-        notes_text = """
-        <b>⚠️ Important Notes:</b><br/>
-        • This is an AI-generated prediction and not a definitive diagnosis<br/>
-        • Results should be interpreted by qualified healthcare professionals<br/>
-        • Additional tests may be required for confirmation<br/>
-        • Patient symptoms and medical history must be considered<br/>
-        • This report is for medical professional use only
-        """
-        notes_data = [[Paragraph(notes_text, body_style)]]
-        notes_table = Table(notes_data, colWidths=[6.5*inch])
-        notes_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FEF3C7')),
-            ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#F59E0B')),
-            ('LEFTPADDING', (0, 0), (-1, -1), 15),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-            ('TOPPADDING', (0, 0), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        story.append(notes_table)
-        
-        # Footer
-        story.append(Spacer(1, 0.5*inch))
-        footer_line = Table([['']], colWidths=[6.5*inch])
-        footer_line.setStyle(TableStyle([
-            ('LINEABOVE', (0, 0), (-1, 0), 1, colors.HexColor('#CBD5E1')),
-        ]))
-        story.append(footer_line)
-        story.append(Spacer(1, 0.15*inch))
-        
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.HexColor('#64748B'),
-            alignment=TA_CENTER
-        )
-        story.append(Paragraph("<b>NeuroSight</b> - AI-Powered Brain Disease Detection", footer_style))
-        story.append(Paragraph("Rajalakshmi Engineering College, Thandalam, Chennai", footer_style))
-        story.append(Paragraph("Contact: asuproject0112@gmail.com", footer_style))
-        
-        doc.build(story)
-        
-        return send_file(pdf_path, as_attachment=True, download_name=pdf_filename, mimetype='application/pdf')
+        pdf_filename = f"NeuroSight_Report_{secure_filename(patient_id) or 'patient'}_{timestamp}.pdf"
+        
+        # Extract the stored name from a URL path if needed (e.g., /uploads/<sha256>.png -> <sha256>.png)
+        image_name = image_path
+        for prefix in ('/uploads/', '/static/uploads/', 'static/uploads/'):
+            if image_name.startswith(prefix):
+                image_name = image_name[len(prefix):]
+                break
+        
+        # Embed the cached report-sized rendition rather than the full-resolution upload,
+        # and only of an upload this user has analysed (the path comes from the form)
+        img_source = report_image_source(image_name) if image_name and user_owns_upload(image_name) else None
+        
+        # Render in memory and stream it; nothing is written under static/
+        pdf_buffer = io.BytesIO()
+        build_report(pdf_buffer, {
+            'patient_name': patient_name,
+            'patient_id': patient_id,
+            'patient_age': patient_age,
+            'scan_date': scan_date,
+            'disease_name': disease_name,
+            'prediction': prediction,
+            'confidence': confidence,
+            'image_path': image_name
+        }, img_source)
+        
+        pdf_buffer.seek(0)
+        return send_file(pdf_buffer, as_attachment=True, download_name=pdf_filename, mimetype='application/pdf')
     
     except Exception as e:
         flash(f'Error generating report: {str(e)}', 'danger')
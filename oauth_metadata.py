@@ -0,0 +1,212 @@
+"""
+OAuth provider metadata cache for NeuroSight
+Keeps the OpenID discovery document and JWKS in memory and on disk, hands them to the authlib
+client so a login never waits on them, and refreshes them in the background before they expire.
+Run `python oauth_metadata.py --stub-provider 8089` for a local identity provider stand-in.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class OAuthMetadataCache:
+    """
+    Discovery document plus JWKS for one OpenID provider
+    Entries live for the provider's Cache-Control max-age (or ttl when it sends none) and are
+    refreshed once refresh_at of that lifetime has passed. A failed refresh keeps serving the
+    last good copy and retries after retry_interval seconds.
+    """
+
+    def __init__(self, discovery_url, cache_path, ttl=3600, timeout=5.0, refresh_at=0.8, retry_interval=60):
+        self.discovery_url = discovery_url
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.refresh_at = refresh_at
+        self.retry_interval = retry_interval
+        self.metadata = None  # Discovery document with the key set under 'jwks'
+        self.fetched_at = None
+        self.expires_at = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _get(self, session, url):
+        response = session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        match = MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+        return response.json(), int(match.group(1)) if match else self.ttl
+
+    def fetch(self):
+        """Download the discovery document and key set; returns (metadata, lifetime in seconds)"""
+        with requests.Session() as session:
+            discovery, discovery_age = self._get(session, self.discovery_url)
+            if not discovery.get('jwks_uri'):
+                raise ValueError('Discovery document has no jwks_uri')
+            jwks, jwks_age = self._get(session, discovery['jwks_uri'])
+        return dict(discovery, jwks=jwks), min(discovery_age, jwks_age)
+
+    def refresh(self):
+        """Fetch fresh metadata, save it to disk and pass it to the attached clients"""
+        start = time.perf_counter()
+        metadata, lifetime = self.fetch()
+        fetched_at = time.time()
+        self._store(metadata, fetched_at, fetched_at + lifetime)
+        self._save()
+        print(f"✓ OAuth metadata refreshed from {self.discovery_url} in {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"(valid {lifetime}s)")
+
+    def _store(self, metadata, fetched_at, expires_at):
+        with self._lock:
+            self.metadata, self.fetched_at, self.expires_at = metadata, fetched_at, expires_at
+            clients = list(self._clients)
+        for client in clients:
+            self._apply(client)
+
+    def _apply(self, client):
+        # authlib only fetches metadata that is missing '_loaded_at', and the key set when 'jwks' is missing
+        client.server_metadata.update(self.metadata)
+        client.server_metadata['_loaded_at'] = self.fetched_at
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump({'discovery_url': self.discovery_url, 'fetched_at': self.fetched_at,
+                       'expires_at': self.expires_at, 'metadata': self.metadata}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self):
+        """Load the copy saved on disk, if it is for this provider; returns True if one was loaded"""
+        try:
+            with open(self.cache_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get('discovery_url') != self.discovery_url or not saved.get('metadata'):
+            return False
+        self._store(saved['metadata'], saved['fetched_at'], saved['expires_at'])
+        return True
+
+    @property
+    def fresh(self):
+        return self.expires_at is not None and time.time() < self.expires_at
+
+    def attach(self, client):
+        """Keep an authlib OAuth client's server_metadata filled from this cache"""
+        with self._lock:
+            self._clients.append(client)
+        if self.metadata is not None:
+            self._apply(client)
+
+    def start(self, client=None):
+        """
+        Load the disk copy (fetching now only if there is none), then refresh in the background
+        A provider that cannot be reached at startup is retried in the background; until then
+        authlib falls back to fetching the metadata itself.
+        """
+        if client is not None:
+            self.attach(client)
+        if not self.load():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️  Could not prefetch OAuth metadata from {self.discovery_url}: {e}")
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='oauth-metadata', daemon=True)
+            self._thread.start()
+
+    def _next_refresh_in(self):
+        if self.expires_at is None:
+            return 0
+        refresh_time = self.fetched_at + (self.expires_at - self.fetched_at) * self.refresh_at
+        return max(0, refresh_time - time.time())
+
+    def _run(self):
+        delay = self._next_refresh_in()
+        while True:
+            time.sleep(delay)
+            try:
+                # Another worker may have refreshed the shared disk copy already
+                if not (self.load() and self._next_refresh_in() > 0):
+                    self.refresh()
+                delay = self._next_refresh_in()
+            except Exception as e:
+                print(f"⚠️  OAuth metadata refresh failed ({e}), retrying in {self.retry_interval}s")
+                delay = self.retry_interval
+
+
+def serve_stub_provider(port):
+    """Serve a discovery document and key set on localhost, standing in for accounts.google.com"""
+    import base64
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    def b64(number):
+        return base64.urlsafe_b64encode(number.to_bytes((number.bit_length() + 7) // 8, 'big')).rstrip(b'=').decode('ascii')
+
+    public = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key().public_numbers()
+    key = {'kty': 'RSA', 'kid': 'neurosight-stub', 'use': 'sig', 'alg': 'RS256', 'n': b64(public.n), 'e': b64(public.e)}
+    base_url = f"http://localhost:{port}"
+    documents = {
+        '/.well-known/openid-configuration': {
+            'issuer': base_url,
+            'authorization_endpoint': f"{base_url}/authorize",
+            'token_endpoint': f"{base_url}/token",
+            'userinfo_endpoint': f"{base_url}/userinfo",
+            'jwks_uri': f"{base_url}/jwks",
+            'id_token_signing_alg_values_supported': ['RS256']
+        },
+        '/jwks': {'keys': [key]}
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            document = documents.get(self.path)
+            if document is None:
+                self.send_error(404)
+                return
+            body = json.dumps(document).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'public, max-age=300')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f"✓ Stub identity provider at {base_url}/.well-known/openid-configuration")
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or refresh the cached OAuth provider metadata')
+    parser.add_argument('--refresh', action='store_true', help='Fetch the metadata now and update the cache file')
+    parser.add_argument('--stub-provider', type=int, metavar='PORT', help='Run a local stub identity provider instead')
+    args = parser.parse_args()
+
+    if args.stub_provider:
+        serve_stub_provider(args.stub_provider).serve_forever()
+    else:
+        from neurosight_app_with_auth import google_metadata
+
+        if args.refresh:
+            google_metadata.refresh()
+        print(f"\n🔑 {google_metadata.discovery_url}")
+        print(f"   cache file: {google_metadata.cache_path}")
+        if google_metadata.metadata is None:
+            print("   not cached")
+        else:
+            print(f"   issuer: {google_metadata.metadata.get('issuer')}")
+            print(f"   keys: {len(google_metadata.metadata['jwks'].get('keys', []))}")
+            print(f"   fetched: {time.ctime(google_metadata.fetched_at)}")
+            print(f"   expires: {time.ctime(google_metadata.expires_at)} ({'fresh' if google_metadata.fresh else 'stale'})")
@@ -0,0 +1,119 @@
+"""
+Password hashing service for NeuroSight
+Hashing and verification run on a small, bounded thread pool instead of the request thread
+(scrypt, PBKDF2 and Argon2 all release the GIL), so a burst of logins can use at most
+max_workers cores. Verifications beyond max_pending are refused instead of queueing up.
+
+The scheme is a werkzeug method string ('scrypt:32768:8:1', 'pbkdf2:sha256:600000') or
+'argon2[:time_cost:memory_cost:parallelism]' (needs argon2-cffi). Hashes made with other
+parameters still verify and are flagged by needs_rehash().
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordServiceBusy(ServiceUnavailable):
+    """Raised when max_pending verifications are already queued or running"""
+
+    def __init__(self, retry_after=1):
+        super().__init__(retry_after=retry_after)
+
+
+def _argon2_hasher(method):
+    from argon2 import PasswordHasher
+    params = [int(value) for value in method.split(':')[1:]]
+    names = ('time_cost', 'memory_cost', 'parallelism')
+    return PasswordHasher(**dict(zip(names, params)))
+
+
+class PasswordService:
+    """Hashes and verifies passwords on a bounded pool of worker threads"""
+
+    def __init__(self, method='scrypt', max_workers=2, max_pending=32):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        self.configure(method, max_workers, max_pending)
+
+    def configure(self, method='scrypt', max_workers=2, max_pending=32):
+        """(Re)build the service for a scheme and pool size; call once at startup"""
+        self.method = method
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._argon2 = _argon2_hasher(method) if method.startswith('argon2') else None
+        self._canonical = None
+        self._dummy_hash = None
+        old_pool, self._pool = self._pool, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def _submit(self, fn, *args, limited):
+        with self._lock:
+            if limited and self._pending >= self.max_pending:
+                raise PasswordServiceBusy()
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    @property
+    def pending(self):
+        """Hash operations queued or running"""
+        return self._pending
+
+    def _hash(self, password):
+        if self._argon2 is not None:
+            return self._argon2.hash(password)
+        return generate_password_hash(password, self.method)
+
+    def _verify(self, password_hash, password):
+        if password_hash.startswith('$argon2'):
+            from argon2.exceptions import VerificationError, InvalidHashError
+            hasher = self._argon2 or _argon2_hasher('argon2')
+            try:
+                return hasher.verify(password_hash, password)
+            except (VerificationError, InvalidHashError):
+                return False
+        return check_password_hash(password_hash, password)
+
+    def hash(self, password):
+        """Hash a new password with the configured scheme (waits for a worker; not subject to max_pending)"""
+        return self._submit(self._hash, password, limited=False).result()
+
+    def verify(self, password_hash, password):
+        """
+        Check a password against its stored hash; raises PasswordServiceBusy when the queue is full
+        A missing hash is checked against a dummy one, so unknown accounts take as long as known ones.
+        """
+        if not password_hash:
+            if self._dummy_hash is None:
+                self._dummy_hash = self._hash('neurosight-dummy-password')
+            self._submit(self._verify, self._dummy_hash, password, limited=True).result()
+            return False
+        return self._submit(self._verify, password_hash, password, limited=True).result()
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with another scheme or other parameters than the configured ones"""
+        if not password_hash:
+            return False
+        if self._argon2 is not None:
+            return not password_hash.startswith('$argon2') or self._argon2.check_needs_rehash(password_hash)
+        if self._canonical is None:
+            # werkzeug stores the method with its defaults filled in, e.g. 'scrypt' -> 'scrypt:32768:8:1'
+            self._canonical = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._canonical
+
+
+# Shared by the models and the app; the app calls passwords.configure() with its settings
+passwords = PasswordService()
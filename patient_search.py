@@ -0,0 +1,204 @@
+"""
+Patient search for NeuroSight
+Full-text index over patient name, patient id, prediction and notes of analysis_history.
+SQLite keeps a contentless FTS5 table in sync with triggers; Postgres uses a GIN index on
+a tsvector expression. Queries match word prefixes, so 'joh smi' finds "John Smith" and
+'P-10' finds patient "P-1001". The index returns the most recent `candidates` matches,
+which are then ranked by where each term matched (patient id, then name, prediction, notes;
+whole words above prefixes), so a broad term such as 'lesion' costs no more than a precise one.
+
+    python patient_search.py --install   # Create the index (Postgres: CONCURRENTLY)
+    python patient_search.py --rebuild   # Re-index every analysis
+"""
+import re
+import unicodedata
+
+from sqlalchemy import text
+from sqlalchemy.orm import defer
+
+from models import db, AnalysisHistory
+
+
+SEARCH_TABLE = 'analysis_search'
+POSTGRES_INDEX = 'ix_analysis_history_search'
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+# Score of a term found in each field (doubled for a whole-word match)
+FIELD_WEIGHTS = (('patient_id', 4), ('patient_name', 3), ('prediction', 2), ('notes', 1))
+
+# Each user's rows carry an 'owner' token, so the user filter is part of the full-text match
+_SQLITE_VALUES = "'u' || {row}.user_id, {row}.patient_name, {row}.patient_id, {row}.prediction, {row}.notes"
+_SQLITE_COLUMNS = "rowid, owner, patient_name, patient_id, prediction, notes"
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        owner, patient_name, patient_id, prediction, notes,
+        content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON analysis_history BEGIN
+        INSERT INTO {SEARCH_TABLE}({_SQLITE_COLUMNS}) VALUES (new.id, {_SQLITE_VALUES.format(row='new')});
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON analysis_history BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, {_SQLITE_COLUMNS}) VALUES ('delete', old.id, {_SQLITE_VALUES.format(row='old')});
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF user_id, patient_name, patient_id, prediction, notes
+        ON analysis_history BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, {_SQLITE_COLUMNS}) VALUES ('delete', old.id, {_SQLITE_VALUES.format(row='old')});
+        INSERT INTO {SEARCH_TABLE}({_SQLITE_COLUMNS}) VALUES (new.id, {_SQLITE_VALUES.format(row='new')});
+    END""",
+]
+SQLITE_FILL = (f"INSERT INTO {SEARCH_TABLE}({_SQLITE_COLUMNS}) "
+               f"SELECT id, {_SQLITE_VALUES.format(row='analysis_history')} FROM analysis_history")
+
+# The query must repeat this expression exactly for Postgres to use the index
+POSTGRES_VECTOR = ("to_tsvector('simple'::regconfig, coalesce(patient_name, '') || ' ' || coalesce(patient_id, '') "
+                   "|| ' ' || coalesce(prediction, '') || ' ' || coalesce(notes, ''))")
+
+
+class SearchQueryError(ValueError):
+    """Unusable search text; the message is shown to the client"""
+
+
+def _fold(value):
+    """Lower case without accents, as the FTS5 tokenizer sees it"""
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def search_terms(query):
+    terms = [_fold(term) for term in TOKEN_PATTERN.findall(query or '')][:MAX_TERMS]
+    if not terms:
+        raise SearchQueryError('Enter a patient name, patient ID or keyword to search for')
+    return terms
+
+
+def relevance(analysis, terms):
+    """Sum over the terms of the weight of the best field each one matches"""
+    fields = [(set(TOKEN_PATTERN.findall(_fold(getattr(analysis, name) or ''))), weight) for name, weight in FIELD_WEIGHTS]
+    score = 0
+    for term in terms:
+        score += max([weight * 2 for words, weight in fields if term in words] +
+                     [weight for words, weight in fields if any(word.startswith(term) for word in words)] + [0])
+    return score
+
+
+def search_index_ready(engine):
+    """True if the search index exists"""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            found = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE})
+        elif engine.dialect.name == 'postgresql':
+            found = connection.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND i.indisvalid"
+            ), {'name': POSTGRES_INDEX})
+        else:
+            return False
+        return found.first() is not None
+
+
+def install_search_index(engine, rebuild=False):
+    """Create the search index if it is missing (or re-index everything); returns True if it was built"""
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY builds the index without blocking writes, and cannot run in a transaction
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            if rebuild:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {POSTGRES_INDEX}"))
+            elif search_index_ready(engine):
+                return False
+            else:
+                # A build interrupted earlier leaves an invalid index behind
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {POSTGRES_INDEX}"))
+            connection.execute(text(
+                f"CREATE INDEX CONCURRENTLY {POSTGRES_INDEX} ON analysis_history USING gin ({POSTGRES_VECTOR})"
+            ))
+        return True
+
+    if engine.dialect.name != 'sqlite':
+        raise RuntimeError(f"Patient search is not supported on {engine.dialect.name}")
+
+    connection = engine.raw_connection()
+    try:
+        # Manage the transaction by hand: BEGIN IMMEDIATE makes concurrent workers take turns,
+        # and the index is filled in the same transaction as the triggers are created
+        sqlite = connection.driver_connection
+        isolation_level, sqlite.isolation_level = sqlite.isolation_level, None
+        cursor = sqlite.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,)).fetchone()
+            if exists and not rebuild:
+                cursor.execute('ROLLBACK')
+                return False
+            if exists:
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('delete-all')")
+            else:
+                for statement in SQLITE_DDL:
+                    cursor.execute(statement)
+            cursor.execute(SQLITE_FILL)
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            sqlite.isolation_level = isolation_level
+    finally:
+        connection.close()
+    return True
+
+
+def search_analyses(user_id, query, page=1, limit=20, candidates=1000):
+    """
+    One page of a user's analyses matching the search text, best match first
+    Returns (analyses, has_more).
+    """
+    terms = search_terms(query)
+    params = {'candidates': candidates}
+
+    # Newest matches first; one-letter terms match whole words only, since as prefixes they match nearly everything
+    if db.engine.dialect.name == 'postgresql':
+        params.update(user_id=user_id, query=' & '.join(term if len(term) == 1 else f"{term}:*" for term in terms))
+        rows = db.session.execute(text(
+            f"SELECT id FROM analysis_history "
+            f"WHERE user_id = :user_id AND {POSTGRES_VECTOR} @@ to_tsquery('simple', :query) "
+            f"ORDER BY created_at DESC, id DESC LIMIT :candidates"
+        ), params)
+    else:
+        # owner:u<id> AND "term"* AND ...; terms are quoted so FTS5 syntax in the input is inert
+        params['match'] = f'owner:"u{int(user_id)}" ' + ' '.join(
+            f'"{term}"' if len(term) == 1 else f'"{term}"*' for term in terms)
+        rows = db.session.execute(text(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match ORDER BY rowid DESC LIMIT :candidates"
+        ), params)
+
+    ids = [row[0] for row in rows]
+    if not ids:
+        return [], False
+    # bm25 / ts_rank would need term statistics over every match; scoring the candidates here does not.
+    # Rows are fetched by primary key alone (a user_id condition would send SQLite down the user's
+    # whole index range); the ids are already that user's, and are checked again below.
+    matches = [analysis for analysis in AnalysisHistory.query.filter(AnalysisHistory.id.in_(ids))
+               .options(defer(AnalysisHistory.series_details)) if analysis.user_id == user_id]
+    matches.sort(key=lambda analysis: (relevance(analysis, terms), analysis.created_at, analysis.id), reverse=True)
+    offset = (page - 1) * limit
+    return matches[offset:offset + limit], len(matches) > offset + limit
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from neurosight_app_with_auth import app
+
+    parser = argparse.ArgumentParser(description='Create or rebuild the patient search index')
+    parser.add_argument('--install', action='store_true', help='Create the index if it is missing')
+    parser.add_argument('--rebuild', action='store_true', help='Re-index every analysis')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.install or args.rebuild:
+            start = time.perf_counter()
+            if install_search_index(db.engine, rebuild=args.rebuild):
+                print(f"✅ Search index built in {time.perf_counter() - start:.1f}s")
+            else:
+                print("⊙ Search index already exists")
+        print(f"{'✓' if search_index_ready(db.engine) else '✗'} Search index ({db.engine.dialect.name})")
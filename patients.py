@@ -0,0 +1,178 @@
+"""
+Patient records for NeuroSight
+Analyses point at a row in `patients`, one per (user, patient ID). Saving an analysis looks the
+patient up in a small per-process cache and only upserts when the patient is new to this
+process or their name or age changed. A patient's timeline is read through the
+(patient_ref_id, created_at, id) index, with the per-disease trends kept in patient_trends.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.orm import Session, defer
+
+from models import Patient, PatientTrend, AnalysisHistory
+
+
+MISSING_IDS = {'', 'n/a', 'na', 'none', '-'}
+
+
+def clean_external_id(value):
+    """The patient ID as stored, or None when no real ID was entered (the forms default to 'N/A')"""
+    value = (value or '').strip()
+    return None if value.lower() in MISSING_IDS else value[:100]
+
+
+def upsert_patients(connection, rows):
+    """
+    Insert or update patients in one statement; rows are dicts with user_id, external_id, name, age
+    Later rows for the same patient win. Returns {(user_id, external_id): patient id}.
+    """
+    latest = {}
+    for row in rows:
+        latest[(row['user_id'], row['external_id'])] = row
+    if not latest:
+        return {}
+    now = datetime.utcnow()
+    values = [dict(row, created_at=now, updated_at=now) for row in latest.values()]
+    table = Patient.__table__
+
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.external_id],
+            set_={'name': statement.excluded.name, 'age': statement.excluded.age, 'updated_at': now}
+        ).returning(table.c.id, table.c.user_id, table.c.external_id)
+        return {(user_id, external_id): patient_id for patient_id, user_id, external_id in connection.execute(statement)}
+
+    # Other databases: update or insert one patient at a time
+    ids = {}
+    for key, row in latest.items():
+        found = connection.execute(select(table.c.id).where(
+            table.c.user_id == row['user_id'], table.c.external_id == row['external_id'])).scalar()
+        if found is None:
+            found = connection.execute(table.insert().values(dict(row, created_at=now, updated_at=now))).inserted_primary_key[0]
+        else:
+            connection.execute(table.update().where(table.c.id == found).values(name=row['name'], age=row['age'], updated_at=now))
+        ids[key] = found
+    return ids
+
+
+def link_analyses(engine, batch_size=2000, progress=None):
+    """
+    Create or update the patients of analyses not yet linked to one, and link them
+    One batch of analyses per transaction, oldest first, so each patient ends up with the latest
+    name and age entered. Returns (analyses linked, patient upserts).
+    """
+    table = AnalysisHistory.__table__
+    link = update(table).where(table.c.id == bindparam('analysis_id')).values(patient_ref_id=bindparam('patient_ref_id'))
+    last_id = 0
+    linked = patients = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.user_id, table.c.patient_id, table.c.patient_name, table.c.patient_age)
+                .where(table.c.id > last_id, table.c.patient_ref_id.is_(None))
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return linked, patients
+            last_id = rows[-1].id
+
+            keyed = [(row, clean_external_id(row.patient_id)) for row in rows]
+            keyed = [(row, external_id) for row, external_id in keyed if external_id is not None]
+            ids = upsert_patients(conn, [
+                {'user_id': row.user_id, 'external_id': external_id,
+                 'name': row.patient_name if row.patient_name not in (None, '', 'N/A') else None,
+                 'age': row.patient_age}
+                for row, external_id in keyed
+            ])
+            if keyed:
+                conn.execute(link, [{'analysis_id': row.id, 'patient_ref_id': ids[(row.user_id, external_id)]}
+                                    for row, external_id in keyed])
+            linked += len(keyed)
+            patients += len(ids)
+        if progress:
+            progress(last_id, linked)
+
+
+class PatientCache:
+    """
+    Per-process LRU of (user, patient ID) -> (patient id, name, age)
+    Entries made inside a transaction are only kept once it commits, so a rolled back insert
+    never leaves a cached id behind.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        event.listen(Session, 'after_commit', self._session_committed)
+        event.listen(Session, 'after_soft_rollback', self._session_rolled_back)
+
+    def resolve(self, session, user_id, external_id, name=None, age=None):
+        """Patient id for this user's patient ID, creating or updating the patient as needed; None without an ID"""
+        external_id = clean_external_id(external_id)
+        if external_id is None:
+            return None
+        key = (user_id, external_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and entry[1:] == (name, age):
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        row = {'user_id': user_id, 'external_id': external_id, 'name': name, 'age': age}
+        patient_id = upsert_patients(session.connection(), [row])[key]
+        session.info.setdefault('patient_cache_pending', {})[key] = (patient_id, name, age)
+        return patient_id
+
+    def invalidate(self, user_id, external_id):
+        with self._lock:
+            self._entries.pop((user_id, external_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _session_committed(self, session):
+        pending = session.info.pop('patient_cache_pending', None)
+        if not pending:
+            return
+        with self._lock:
+            for key, entry in pending.items():
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _session_rolled_back(self, session, previous_transaction):
+        session.info.pop('patient_cache_pending', None)
+
+
+def patient_timeline(patient, disease_type=None):
+    """
+    A patient's analyses in scan-date order, and their trends by disease
+    Returns (analyses, {disease_type: PatientTrend}).
+    """
+    analyses = AnalysisHistory.query.filter(AnalysisHistory.patient_ref_id == patient.id)\
+        .options(defer(AnalysisHistory.series_details))
+    trends = PatientTrend.query.filter(PatientTrend.patient_id == patient.id, PatientTrend.analysis_count > 0)
+    if disease_type:
+        analyses = analyses.filter(AnalysisHistory.disease_type == disease_type)
+        trends = trends.filter(PatientTrend.disease_type == disease_type)
+    # Scan dates are entered by hand and need not follow the order of analysis, so sort here (one patient's rows)
+    ordered = sorted(analyses, key=lambda analysis: (PatientTrend.timeline_date(analysis), analysis.id))
+    return ordered, {trend.disease_type: trend for trend in trends}
@@ -0,0 +1,206 @@
+"""
+Rate limiting for NeuroSight
+Sliding-window counters per client IP and per account, checked before a view does any password
+hashing or email work. Counters live in process memory, or in Redis (or any Redis-compatible
+server) so that every worker shares them.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+
+UNIT_SECONDS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+RATE_PATTERN = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)?s?\s*$')
+
+
+def parse_rate(value):
+    """Parse '10/minute', '5/15minutes' or '5/300' (seconds) into (limit, window seconds); None disables"""
+    if not value:
+        return None
+    match = RATE_PATTERN.match(str(value).lower())
+    if not match or not (match.group(2) or match.group(3)):
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    count, multiplier, unit = match.groups()
+    window = int(multiplier or 1) * UNIT_SECONDS[unit or 'second']
+    return int(count), window
+
+
+class RateLimitExceeded(TooManyRequests):
+    """Raised by RateLimiter.check; retry_after is the number of seconds to wait"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after=retry_after)
+
+
+class MemoryStore:
+    """Per-process counters; each key keeps its current and previous window count"""
+
+    SWEEP_EVERY = 1024  # Increments between sweeps of expired keys
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # key -> [bucket, previous count, current count, window]
+        self._increments = 0
+
+    def increment(self, key, bucket, window):
+        """Count a hit in this window; returns (previous window count, current window count)"""
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None or entry[0] < bucket - 1:
+                entry = [bucket, 0, 0, window]
+            elif entry[0] == bucket - 1:
+                entry = [bucket, entry[2], 0, window]
+            entry[2] += 1
+            self._counters[key] = entry
+
+            self._increments += 1
+            if self._increments % self.SWEEP_EVERY == 0:
+                self._sweep()
+            return entry[1], entry[2]
+
+    def decrement(self, key, bucket):
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is not None and entry[0] == bucket and entry[2] > 0:
+                entry[2] -= 1
+
+    def _sweep(self):
+        now = time.time()
+        expired = [key for key, (bucket, _, _, window) in self._counters.items() if bucket < now // window - 1]
+        for key in expired:
+            del self._counters[key]
+
+
+class RedisStore:
+    """Counters shared by all workers; one key per window, expiring once it can no longer count"""
+
+    def __init__(self, client, prefix='neurosight:ratelimit:'):
+        self.client = client  # redis.Redis or a compatible client
+        self.prefix = prefix
+
+    def increment(self, key, bucket, window):
+        current = f"{self.prefix}{key}:{bucket}"
+        pipe = self.client.pipeline()
+        pipe.incr(current)
+        pipe.expire(current, window * 2 + 1)
+        pipe.get(f"{self.prefix}{key}:{bucket - 1}")
+        count, _, previous = pipe.execute()
+        return int(previous or 0), int(count)
+
+    def decrement(self, key, bucket):
+        self.client.decr(f"{self.prefix}{key}:{bucket}")
+
+
+def _retry_after(previous, current, limit, window, elapsed):
+    """Seconds until one more hit fits, given the counts before the rejected hit"""
+    if current < limit:
+        # Wait for the previous window's share to decay enough
+        wait = window * (1 - (limit - current - 1) / previous) - elapsed
+    else:
+        # The current window is full; wait into the next one for its share to decay
+        wait = (window - elapsed) + window * (1 - (limit - 1) / current)
+    return max(1, math.ceil(wait))
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limits, one (per IP, per account) rate pair per scope
+    The count for a window is the current fixed window plus the previous one weighted by how much
+    of it still overlaps, so limits do not reset all at once on a window boundary. Rejected hits
+    are not counted. If the shared store is unreachable, the limiter falls back to process memory.
+    """
+
+    def __init__(self, rules, store=None, enabled=True):
+        self.rules = rules  # scope -> (ip rate, account rate); a rate is (limit, window) or None
+        self.store = store or MemoryStore()
+        self.enabled = enabled
+        self._fallback = MemoryStore() if store is not None else None
+        self._degraded = False
+
+    def _increment(self, key, bucket, window):
+        if self._fallback is None:
+            return self.store, self.store.increment(key, bucket, window)
+        try:
+            counts = self.store.increment(key, bucket, window)
+        except Exception as e:
+            if not self._degraded:
+                print(f"⚠️  Rate limit store unavailable ({e}), using in-process counters")
+                self._degraded = True
+            return self._fallback, self._fallback.increment(key, bucket, window)
+        if self._degraded:
+            print("✓ Rate limit store reachable again")
+            self._degraded = False
+        return self.store, counts
+
+    def _count(self, key, rate, now):
+        """Count a hit; returns (store, bucket, seconds to wait or 0). A rejected hit is not counted"""
+        limit, window = rate
+        bucket = int(now // window)
+        elapsed = now - bucket * window
+        store, (previous, current) = self._increment(key, bucket, window)
+        if previous * (1 - elapsed / window) + current <= limit:
+            return store, bucket, 0
+        self._uncount(store, key, bucket)
+        return store, bucket, _retry_after(previous, current - 1, limit, window, elapsed)
+
+    @staticmethod
+    def _uncount(store, key, bucket):
+        try:
+            store.decrement(key, bucket)
+        except Exception:
+            pass
+
+    def hit(self, key, rate, now=None):
+        """Count a hit against key; returns 0 if allowed, otherwise the seconds to wait"""
+        return self._count(key, rate, time.time() if now is None else now)[2]
+
+    def check(self, scope, ip, account=None, now=None):
+        """Raise RateLimitExceeded if this IP, or this account, is over the scope's limit"""
+        ip_rate, account_rate = self.rules[scope]
+        now = time.time() if now is None else now
+        retry_after = 0
+        ip_hit = None
+        if ip_rate and ip:
+            key = f"{scope}:ip:{ip}"
+            store, bucket, retry_after = self._count(key, ip_rate, now)
+            ip_hit = (store, key, bucket)
+        if not retry_after and account_rate and account:
+            # Accounts are keyed by a digest so email addresses are not stored in the counter keys
+            digest = hashlib.sha256(str(account).strip().lower().encode('utf-8')).hexdigest()[:24]
+            retry_after = self._count(f"{scope}:account:{digest}", account_rate, now)[2]
+            if retry_after and ip_hit is not None:
+                # The request is rejected, so it must not use up the IP's allowance either
+                self._uncount(*ip_hit)
+        if retry_after:
+            raise RateLimitExceeded(retry_after)
+
+    def limit(self, scope, account=None, methods=('POST',)):
+        """
+        Decorator that checks the scope's limits before the view runs
+        account is a callable returning the account identifier (e.g. the submitted email) or None
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled and request.method in methods:
+                    self.check(scope, request.remote_addr, account() if account else None)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def create_rate_limiter(config, rules):
+    """Build the limiter from app config (RATE_LIMIT_STORAGE_URL = redis://... or unset for in-process)"""
+    storage_url = config.get('RATE_LIMIT_STORAGE_URL')
+    store = None
+    if storage_url:
+        import redis
+        store = RedisStore(redis.Redis.from_url(storage_url, socket_timeout=0.5, socket_connect_timeout=0.5))
+    parsed = {scope: (parse_rate(ip_rate), parse_rate(account_rate)) for scope, (ip_rate, account_rate) in rules.items()}
+    return RateLimiter(parsed, store=store, enabled=config.get('RATE_LIMIT_ENABLED', True))
@@ -0,0 +1,63 @@
+"""
+Rebuild the patient trends (patient_trends) from analysis_history
+Run once after migrate_patients.py, and again whenever trends may have drifted
+(e.g. after analyses were changed or deleted with raw SQL)
+"""
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from neurosight_app_with_auth import app, db
+from models import AnalysisHistory, PatientTrend
+
+
+def rebuild_patient_trends(patient_ids=None, batch_size=5000):
+    """Recompute the trends of the given patients (all patients by default) in one transaction"""
+    with app.app_context():
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                # Hold off new analyses so none is added to a trend that is about to be replaced
+                db.session.execute(text('LOCK TABLE analysis_history IN SHARE MODE'))
+
+            trends = PatientTrend.query
+            analyses = db.session.query(
+                AnalysisHistory.id, AnalysisHistory.patient_ref_id, AnalysisHistory.disease_type,
+                AnalysisHistory.scan_date, AnalysisHistory.created_at,
+                AnalysisHistory.prediction, AnalysisHistory.confidence
+            ).filter(AnalysisHistory.patient_ref_id.isnot(None))
+            if patient_ids:
+                trends = trends.filter(PatientTrend.patient_id.in_(patient_ids))
+                analyses = analyses.filter(AnalysisHistory.patient_ref_id.in_(patient_ids))
+            deleted = trends.delete(synchronize_session=False)
+
+            points = defaultdict(list)
+            for analysis in analyses.yield_per(batch_size):
+                points[(analysis.patient_ref_id, analysis.disease_type)].append(PatientTrend.point(analysis))
+
+            rows = []
+            for (patient_id, disease_type), trend_points in points.items():
+                trend_points.sort(key=lambda point: (point['date'], point['analysis_id']))
+                rows.append(dict(PatientTrend.summarise(trend_points), patient_id=patient_id, disease_type=disease_type))
+            db.session.bulk_insert_mappings(PatientTrend, rows)
+            db.session.commit()
+
+            patients = len({patient_id for patient_id, _ in points})
+            print(f"✓ Removed {deleted} old trends")
+            print(f"✅ Rebuilt {len(rows)} trends for {patients} patients")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Rebuild failed: {e}")
+            raise
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild the per-patient trend summaries')
+    parser.add_argument('--patient-id', type=int, action='append', help='Only rebuild this patient (repeatable; patients.id)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  REBUILD PATIENT TRENDS")
+    print("=" * 60)
+    rebuild_patient_trends(args.patient_id)
@@ -0,0 +1,34 @@
+"""
+Rebuild the dashboard counters (user_stats) from analysis_history
+The app fills an empty table at startup; run this whenever the counters may have drifted
+(e.g. after analyses were deleted with raw SQL) or after changing STATS_TIMEZONE
+"""
+from neurosight_app_with_auth import app, db
+from models import UserStats
+
+
+def rebuild_user_stats(user_ids=None, batch_size=5000):
+    """Recompute the counters of the given users (all users by default) in one transaction"""
+    with app.app_context():
+        try:
+            deleted, counters, users = UserStats.rebuild(user_ids, batch_size)
+            db.session.commit()
+            print(f"✓ Removed {deleted} old counters")
+            print(f"✅ Rebuilt {counters} counters for {users} users")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Rebuild failed: {e}")
+            raise
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild the per-user dashboard counters')
+    parser.add_argument('--user-id', type=int, action='append', help='Only rebuild this user (repeatable)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  REBUILD USER STATS")
+    print("=" * 60)
+    rebuild_user_stats(args.user_id)
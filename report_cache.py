@@ -0,0 +1,109 @@
+"""
+Persistent PDF cache for NeuroSight analysis reports
+Each analysis is rendered once per version of its report fields, on a background worker
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+_renderer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report-renderer')
+
+
+def _report_render_error(future):
+    error = future.exception()
+    if error is not None:
+        print(f"✗ Failed to render report: {error}")
+
+
+class ReportCache:
+    """
+    On-disk cache of rendered reports, one directory per analysis
+    Files are named by a fingerprint of the report fields, which doubles as the
+    ETag; editing an analysis changes the fingerprint, so stale PDFs are never served.
+    render(analysis_id, fields, target) writes a PDF to target and on_cached(analysis_id, path)
+    is called once it is in place; both run on the worker thread. current(analysis_id) returns
+    the fingerprint of the analysis as it is now (None once deleted), so a render that was
+    overtaken by an edit neither prunes the newer version nor records itself.
+    """
+
+    def __init__(self, root, render, on_cached=None, current=None):
+        self.root = os.path.abspath(root)
+        self.render = render
+        self.on_cached = on_cached
+        self.current = current
+        self._lock = threading.Lock()
+        self._pending = {}  # (analysis_id, etag) -> Future, so concurrent requests share one render
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(fields):
+        """Stable hash of the report fields, used as the file name and ETag"""
+        encoded = json.dumps(fields, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:32]
+
+    def _directory(self, analysis_id):
+        return os.path.join(self.root, str(int(analysis_id)))
+
+    def path(self, analysis_id, etag):
+        return os.path.join(self._directory(analysis_id), f"{etag}.pdf")
+
+    def cached(self, analysis_id, etag):
+        """Path of the cached PDF for this version of the analysis, or None"""
+        path = self.path(analysis_id, etag)
+        return path if os.path.isfile(path) else None
+
+    def render_async(self, analysis_id, fields):
+        """Render a report in the background; returns a Future resolving to the PDF path"""
+        etag = self.fingerprint(fields)
+        key = (analysis_id, etag)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = _renderer.submit(self._render, analysis_id, etag, fields)
+                future.add_done_callback(_report_render_error)
+                future.add_done_callback(lambda _: self._forget(key))
+                self._pending[key] = future
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _render(self, analysis_id, etag, fields):
+        path = self.path(analysis_id, etag)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per render, so workers rendering the same version never share a temporary file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            os.close(fd)
+            try:
+                self.render(analysis_id, fields, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        if self.current is not None and self.current(analysis_id) != etag:
+            return path  # The analysis changed while this version rendered
+        self._remove_versions(analysis_id, keep=os.path.basename(path))
+        if self.on_cached is not None:
+            self.on_cached(analysis_id, path)
+        return path
+
+    def _remove_versions(self, analysis_id, keep=None):
+        directory = self._directory(analysis_id)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name != keep and name.endswith('.pdf'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def invalidate(self, analysis_id):
+        """Drop every cached version of an analysis's report"""
+        self._remove_versions(analysis_id)
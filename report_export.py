@@ -0,0 +1,66 @@
+"""
+Bulk report export for NeuroSight
+Sends many analysis reports as a zip of per-analysis PDFs, streamed one report at a time, or as
+one combined PDF. A PDF's cross-reference table is only written when ReportLab saves it, so the
+combined PDF is built in full (spooled to disk past SPOOL_SIZE) before its first byte is sent.
+"""
+import tempfile
+import zipfile
+
+from report_renderer import build_combined_report
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Combined PDFs are only complete once ReportLab saves them; beyond this size they spill to disk
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class _ChunkWriter:
+    """Write-only sink for ZipFile that hands back whatever has been written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Stream a zip archive of (name, date_time, data) entries
+    Only one entry is held in memory at a time. PDFs are already compressed, so entries are stored.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, date_time, data in entries:
+            archive.writestr(zipfile.ZipInfo(name, date_time=date_time), data)
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+    # Central directory
+    yield writer.drain()
+
+
+def iter_combined_pdf(reports):
+    """
+    Stream one PDF holding every report in reports, an iterable of (report, image_source)
+    Nothing is sent until the whole PDF is built, so callers cap the number of reports.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        build_combined_report(spool, reports)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
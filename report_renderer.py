@@ -0,0 +1,389 @@
+"""
+PDF report rendering for NeuroSight
+Styles and static blocks are built once at import; each render only fills in the per-analysis fields
+"""
+import copy
+import io
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
+from reportlab.platypus.doctemplate import ActionFlowable
+from reportlab.platypus import Image as RLImage
+from reportlab.lib.enums import TA_CENTER
+
+
+# Bump when the layout changes so cached reports are re-rendered
+REPORT_TEMPLATE_VERSION = 1
+
+
+class _StaticParagraph(Paragraph):
+    """
+    Paragraph whose markup is parsed once and whose line breaks are computed once per width
+    Renders use a shallow copy (see _fresh), which shares the parsed fragments and the line cache.
+    """
+
+    def breakLines(self, width):
+        cache = self.__dict__.get('_line_cache')
+        if cache is None:
+            # Pieces produced by split() are ordinary, uncached paragraphs
+            return super().breakLines(width)
+        key = tuple(width) if isinstance(width, (list, tuple)) else width
+        lines = cache.get(key)
+        if lines is None:
+            lines = cache[key] = super().breakLines(width)
+        return lines
+
+
+def _static(text, style):
+    paragraph = _StaticParagraph(text, style)
+    paragraph._line_cache = {}
+    return paragraph
+
+
+def _fresh(paragraph):
+    """Per-document instance of a static paragraph; layout state is per instance"""
+    return copy.copy(paragraph)
+
+
+def _padded(left_right, top_bottom):
+    return [
+        ('LEFTPADDING', (0, 0), (-1, -1), left_right),
+        ('RIGHTPADDING', (0, 0), (-1, -1), left_right),
+        ('TOPPADDING', (0, 0), (-1, -1), top_bottom),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), top_bottom),
+    ]
+
+
+class ReportTemplate:
+    """Styles, table styles and static blocks of the report, shared by every render"""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+
+        # Custom Styles - Premium Design
+        self.title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=28,
+            textColor=colors.HexColor('#1E40AF'),
+            spaceAfter=10,
+            alignment=TA_CENTER,
+            fontName='Helvetica-Bold'
+        )
+        self.subtitle_style = ParagraphStyle(
+            'CustomSubtitle',
+            parent=styles['Normal'],
+            fontSize=14,
+            textColor=colors.HexColor('#64748B'),
+            spaceAfter=20,
+            alignment=TA_CENTER,
+            fontName='Helvetica'
+        )
+        self.section_heading_style = ParagraphStyle(
+            'SectionHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            textColor=colors.HexColor('#1E3A8A'),
+            spaceBefore=15,
+            spaceAfter=10,
+            fontName='Helvetica-Bold',
+            borderWidth=0,
+            borderColor=colors.HexColor('#3B82F6'),
+            borderPadding=5,
+            leftIndent=0
+        )
+        self.body_style = ParagraphStyle(
+            'CustomBody',
+            parent=styles['Normal'],
+            fontSize=11,
+            textColor=colors.HexColor('#334155'),
+            leading=16,
+            fontName='Helvetica'
+        )
+        self.footer_style = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=colors.HexColor('#64748B'),
+            alignment=TA_CENTER
+        )
+
+        # Table styles
+        self.divider_style = TableStyle([
+            ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#3B82F6')),
+        ])
+        self.meta_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F8FAFC')),
+            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#CBD5E1')),
+        ] + _padded(12, 8))
+        self.patient_style = TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#EFF6FF')),
+            ('BACKGROUND', (1, 0), (1, -1), colors.white),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#DBEAFE')),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ] + _padded(12, 10))
+        self.results_styles = {}
+        for normal in (True, False):
+            # Highlight the prediction: amber for normal/control results, red otherwise
+            result_color = colors.HexColor('#FEF3C7') if normal else colors.HexColor('#FEE2E2')
+            self.results_styles[normal] = TableStyle([
+                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F0F9FF')),
+                ('BACKGROUND', (1, 0), (1, -1), colors.white),
+                ('BACKGROUND', (1, 1), (1, 1), result_color),
+                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#BFDBFE')),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ] + _padded(12, 10))
+        self.image_style = TableStyle([
+            ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#3B82F6')),
+            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ] + _padded(10, 10))
+        self.disclaimer_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FEF3C7')),
+            ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#F59E0B')),
+        ] + _padded(15, 12))
+        self.footer_line_style = TableStyle([
+            ('LINEABOVE', (0, 0), (-1, 0), 1, colors.HexColor('#CBD5E1')),
+        ])
+
+        # Confidence interpretation with color coding, highest threshold first
+        self.confidence_levels = []
+        for threshold, interpretation, color in (
+            (90, "Very High - The model is highly confident in this prediction.", '#D1FAE5'),
+            (75, "High - The model shows strong confidence in this prediction.", '#DBEAFE'),
+            (60, "Moderate - The model shows reasonable confidence, but further clinical evaluation is recommended.", '#FEF3C7'),
+            (None, "Low - The model has limited confidence. Additional testing is strongly recommended.", '#FEE2E2'),
+        ):
+            box = _static(f'<b>Confidence Level:</b> {interpretation}', self.body_style)
+            box_style = TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(color)),
+                ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#94A3B8')),
+            ] + _padded(15, 12))
+            self.confidence_levels.append((threshold, box, box_style))
+
+        # Static blocks
+        self.title = _static("🧠 NeuroSight", self.title_style)
+        self.subtitle = _static("AI-Powered Brain Disease Detection Report", self.subtitle_style)
+        self.headings = {
+            key: _static(text, self.section_heading_style) for key, text in (
+                ('patient', "📋 Patient Information"),
+                ('results', "🔬 Diagnostic Results"),
+                ('image', "🖼️ Brain Scan Image"),
+                ('analysis', "📊 Result Analysis"),
+                ('notes', "📝 Doctor's Notes"),
+            )
+        }
+        self.labels = {
+            key: _static(f'<b>{text}</b>', self.body_style) for key, text in (
+                ('patient_name', 'Patient Name:'),
+                ('patient_id', 'Patient ID:'),
+                ('patient_age', 'Age:'),
+                ('scan_date', 'Scan Date:'),
+                ('disease_name', 'Disease Type:'),
+                ('prediction', 'Prediction:'),
+                ('confidence', 'Confidence Score:'),
+            )
+        }
+        self.image_missing = _static("<i>Image file not found at expected location</i>", self.body_style)
+        self.clinical = _static("""
+        <b>Clinical Recommendation:</b><br/><br/>
+        This AI-assisted analysis should be used as a <b>supplementary diagnostic tool</b>.
+        The results must be reviewed and validated by qualified medical professionals.
+        Further clinical examination, additional imaging, and comprehensive patient history
+        should be considered before making any diagnostic or treatment decisions.
+        """, self.body_style)
+        self.disclaimer = _static("""
+        <b>⚠️ Important Notes:</b><br/>
+        • This is an AI-generated prediction and not a definitive diagnosis<br/>
+        • Results should be interpreted by qualified healthcare professionals<br/>
+        • Additional tests may be required for confirmation<br/>
+        • Patient symptoms and medical history must be considered<br/>
+        • This report is for medical professional use only
+        """, self.body_style)
+        self.footer = [
+            _static("<b>NeuroSight</b> - AI-Powered Brain Disease Detection", self.footer_style),
+            _static("Rajalakshmi Engineering College, Thandalam, Chennai", self.footer_style),
+            _static("Contact: asuproject0112@gmail.com", self.footer_style),
+        ]
+
+    def confidence_level(self, confidence):
+        """(interpretation paragraph, table style) for a confidence percentage"""
+        for threshold, box, box_style in self.confidence_levels:
+            if threshold is None or confidence >= threshold:
+                return box, box_style
+
+
+TEMPLATE = ReportTemplate()
+
+
+def _details_table(template, rows, style):
+    data = [[_fresh(template.labels[key]), Paragraph(value, template.body_style)] for key, value in rows]
+    return Table(data, colWidths=[2*inch, 4.5*inch], style=style)
+
+
+def _document(target):
+    return SimpleDocTemplate(target, pagesize=letter,
+                             rightMargin=50, leftMargin=50,
+                             topMargin=50, bottomMargin=50)
+
+
+def report_story(report, image_source=None, template=None):
+    """
+    Flowables of one analysis report
+    report holds patient_name, patient_id, patient_age, scan_date, disease_name,
+    prediction, confidence (percent), image_path and optionally notes and generated_at.
+    image_source is a path or stream of the scan to embed, None if it could not be found.
+    """
+    t = template or TEMPLATE
+
+    # Field values are user input; escape them before they reach Paragraph markup
+    prediction = escape(str(report.get('prediction', 'N/A')))
+    confidence = report.get('confidence', 'N/A')
+    notes = (report.get('notes') or '').strip()
+    report_date = (report.get('generated_at') or datetime.now()).strftime('%B %d, %Y at %I:%M %p')
+
+    # Header with Logo and Title
+    story = [
+        _fresh(t.title),
+        _fresh(t.subtitle),
+        Spacer(1, 0.1*inch),
+        Table([['']], colWidths=[6.5*inch], style=t.divider_style),
+        Spacer(1, 0.3*inch),
+        Table([[Paragraph(f"<b>Report Generated:</b> {report_date}", t.body_style)]],
+              colWidths=[6.5*inch], style=t.meta_style),
+        Spacer(1, 0.4*inch),
+    ]
+
+    # Patient Information Section
+    story += [
+        _fresh(t.headings['patient']),
+        Spacer(1, 0.15*inch),
+        _details_table(t, [
+            (key, escape(str(report.get(key, 'N/A'))))
+            for key in ('patient_name', 'patient_id', 'patient_age', 'scan_date')
+        ], t.patient_style),
+        Spacer(1, 0.4*inch),
+    ]
+
+    # Diagnostic Results Section
+    normal = 'Normal' in prediction or 'Control' in prediction
+    story += [
+        _fresh(t.headings['results']),
+        Spacer(1, 0.15*inch),
+        _details_table(t, [
+            ('disease_name', escape(str(report.get('disease_name', 'Unknown')))),
+            ('prediction', f'<b>{prediction}</b>'),
+            ('confidence', f'<b>{escape(str(confidence))}%</b>'),
+        ], t.results_styles[normal]),
+        Spacer(1, 0.4*inch),
+    ]
+
+    # Brain Scan Image Section
+    if report.get('image_path'):
+        story += [_fresh(t.headings['image']), Spacer(1, 0.15*inch)]
+        try:
+            if image_source is not None:
+                img = RLImage(image_source, width=4*inch, height=4*inch)
+                story += [Table([[img]], colWidths=[4*inch], style=t.image_style), Spacer(1, 0.4*inch)]
+            else:
+                print(f"⚠️  Report image not in the upload store: {report['image_path']}")
+                story += [_fresh(t.image_missing), Spacer(1, 0.3*inch)]
+        except Exception as e:
+            print(f"✗ Could not embed report image {report['image_path']}: {e}")
+            story += [Paragraph(f"<i>Image could not be loaded: {escape(str(e))}</i>", t.body_style),
+                      Spacer(1, 0.3*inch)]
+
+    # Result Analysis Section
+    try:
+        conf_value = float(confidence.strip('%')) if isinstance(confidence, str) else float(confidence)
+    except (TypeError, ValueError):
+        conf_value = 0  # 'N/A' or missing
+    box, box_style = t.confidence_level(conf_value)
+    story += [
+        _fresh(t.headings['analysis']),
+        Spacer(1, 0.15*inch),
+        Table([[_fresh(box)]], colWidths=[6.5*inch], style=box_style),
+        Spacer(1, 0.25*inch),
+    ]
+
+    # Doctor's notes, when the analysis has any
+    if notes:
+        story += [
+            _fresh(t.headings['notes']),
+            Spacer(1, 0.15*inch),
+            Paragraph(escape(notes).replace('\n', '<br/>'), t.body_style),
+            Spacer(1, 0.25*inch),
+        ]
+
+    # Clinical Recommendations and Important Notes Box
+    story += [
+        _fresh(t.clinical),
+        Spacer(1, 0.2*inch),
+        Table([[_fresh(t.disclaimer)]], colWidths=[6.5*inch], style=t.disclaimer_style),
+    ]
+
+    # Footer
+    story += [
+        Spacer(1, 0.5*inch),
+        Table([['']], colWidths=[6.5*inch], style=t.footer_line_style),
+        Spacer(1, 0.15*inch),
+    ]
+    story += [_fresh(line) for line in t.footer]
+    return story
+
+
+def build_report(target, report, image_source=None, template=None):
+    """Render a report PDF to target (a path or binary file object such as a BytesIO)"""
+    _document(target).build(report_story(report, image_source, template))
+
+
+class _NextReport(ActionFlowable):
+    """Marker at the end of a report's story; reaching it queues the next report"""
+
+    def __init__(self, story):
+        ActionFlowable.__init__(self)
+        self.story = story
+
+    def apply(self, doc):
+        doc.queue_next(self.story)
+
+
+def build_combined_report(target, reports, template=None):
+    """
+    Render many reports into one PDF, one after another on fresh pages
+    reports is an iterable of (report, image_source), consumed lazily: each report's
+    flowables are built only when layout reaches it, so rows can come straight from a cursor.
+    """
+    doc = _document(target)
+    reports = iter(reports)
+    progress = {'queued': 0}
+
+    def queue_next(story):
+        item = next(reports, None)
+        if item is None:
+            return
+        if progress['queued']:
+            story.append(PageBreak())
+        progress['queued'] += 1
+        story.extend(report_story(item[0], item[1], template))
+        story.append(_NextReport(story))
+
+    doc.queue_next = queue_next
+    story = []
+    queue_next(story)
+    doc.build(story)
+
+
+def render_report(report, image_source=None):
+    """Render a report into memory and return the PDF bytes"""
+    buffer = io.BytesIO()
+    build_report(buffer, report, image_source)
+    return buffer.getvalue()
@@ -0,0 +1,90 @@
+"""
+Series-level analysis for NeuroSight
+Runs the slices of a study through a disease model in batches and aggregates them into one prediction
+"""
+import numpy as np
+
+
+AGGREGATION_METHODS = ('mean', 'max', 'attention')
+
+
+class SeriesResult:
+    """Study-level prediction plus the per-slice probabilities that produced it"""
+
+    def __init__(self, probabilities, slice_probabilities, aggregation, stopped_early):
+        self.probabilities = probabilities              # Aggregated class probabilities
+        self.slice_probabilities = slice_probabilities  # {position: class probabilities}
+        self.aggregation = aggregation
+        self.stopped_early = stopped_early
+
+    @property
+    def predicted_index(self):
+        return int(np.argmax(self.probabilities))
+
+    @property
+    def confidence(self):
+        """Aggregated probability of the predicted class (0-1)"""
+        return float(self.probabilities[self.predicted_index])
+
+    @property
+    def representative_position(self):
+        """Slice that most strongly supports the study-level prediction"""
+        predicted = self.predicted_index
+        return max(self.slice_probabilities, key=lambda p: self.slice_probabilities[p][predicted])
+
+
+def center_out_order(count):
+    """Slice positions ordered from the middle of the study outwards"""
+    middle = (count - 1) // 2
+    return sorted(range(count), key=lambda position: (abs(position - middle), position))
+
+
+def aggregate_probabilities(probabilities, method='mean'):
+    """
+    Combine per-slice class probabilities (n_slices x n_classes) into one distribution
+    mean      - average over slices
+    max       - per-class maximum over slices, renormalised
+    attention - slices weighted by how decisive they are (softmax of negative entropy)
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if method == 'mean':
+        return probabilities.mean(axis=0)
+    if method == 'max':
+        peak = probabilities.max(axis=0)
+        return peak / peak.sum()
+    if method == 'attention':
+        entropy = -(probabilities * np.log(probabilities + 1e-12)).sum(axis=1)
+        weights = np.exp(-(entropy - entropy.min()))
+        weights /= weights.sum()
+        return weights @ probabilities
+    raise ValueError(f"Unknown aggregation method: {method}")
+
+
+def analyze_series(get_image, count, predict, aggregation='mean', batch_size=4,
+                   stop_confidence=0.95, min_slices=4):
+    """
+    Analyse up to `count` slices, stopping once the aggregated confidence reaches stop_confidence
+    get_image(position) returns the decoded slice; predict(images) returns an
+    (n x n_classes) probability array for a batch. Slices are visited from the
+    centre of the study outwards, so the most informative ones are seen first.
+    """
+    if count < 1:
+        raise ValueError('A series needs at least one slice to analyse')
+    order = center_out_order(count)
+    slice_probabilities = {}
+    aggregated = None
+    stopped_early = False
+
+    for start in range(0, count, batch_size):
+        positions = order[start:start + batch_size]
+        batch = predict([get_image(position) for position in positions])
+        for position, probabilities in zip(positions, batch):
+            slice_probabilities[position] = np.asarray(probabilities, dtype=np.float64)
+
+        aggregated = aggregate_probabilities(list(slice_probabilities.values()), aggregation)
+        analysed = len(slice_probabilities)
+        if analysed < count and analysed >= min_slices and aggregated.max() >= stop_confidence:
+            stopped_early = True
+            break
+
+    return SeriesResult(aggregated, slice_probabilities, aggregation, stopped_early)
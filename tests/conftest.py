@@ -0,0 +1,62 @@
+"""
+Shared fixtures: a minimal Flask app on a throwaway SQLite database
+The full app (neurosight_app_with_auth) loads the ML models, so tests build only what they use.
+"""
+import os
+import socket
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, init_db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY='test'
+    )
+    init_db(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+class Inbox:
+    """aiosmtpd handler keeping every delivered envelope; recipients at blocked.example are refused"""
+
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith('@blocked.example'):
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    """A local SMTP server; yields (controller, inbox)"""
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    inbox = Inbox()
+    controller = controller_module.Controller(inbox, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller, inbox
+    controller.stop()
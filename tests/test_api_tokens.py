@@ -0,0 +1,85 @@
+"""API bearer tokens: issue, verify, expiry, revocation and the users behind them"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from api_tokens import ApiTokens, purge_expired_revocations
+from identity_cache import IdentityCache
+from models import db, RevokedToken, User
+
+
+@pytest.fixture
+def user(app):
+    user = User(email='gateway@example.com', full_name='PACS Gateway', role='doctor', hospital='General')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def tokens(app):
+    return ApiTokens('test-secret', ttl=3600, revocation_refresh=0)
+
+
+def test_issued_token_verifies_with_its_claims(tokens, user):
+    token, expires_in = tokens.issue(user)
+    claims = tokens.verify(token)
+    assert expires_in == 3600
+    assert (claims['sub'], claims['role'], claims['hospital']) == (user.id, 'doctor', 'General')
+    assert timedelta(seconds=3590) < claims['exp'].replace(tzinfo=None) - datetime.utcnow() <= timedelta(seconds=3600)
+
+
+def test_forged_and_foreign_tokens_are_rejected(tokens, user):
+    token, _ = tokens.issue(user)
+    assert tokens.verify(token[:-2] + ('A' if token[-1] != 'A' else 'B') + token[-1]) is None
+    assert tokens.verify(ApiTokens('other-secret').issue(user)[0]) is None
+    assert tokens.verify('not-a-token') is None
+
+
+def test_expired_token_is_rejected(app, user):
+    token, _ = ApiTokens('test-secret', ttl=3600).issue(user)
+    assert ApiTokens('test-secret', ttl=-1).verify(token) is None
+
+
+def test_revoked_token_is_rejected_here_and_in_other_workers(tokens, user):
+    other_worker = ApiTokens('test-secret', revocation_refresh=0)
+    token, _ = tokens.issue(user)
+    other_token, _ = tokens.issue(user)
+    assert other_worker.verify(token) is not None  # Loads the (empty) revoked list
+
+    tokens.revoke(tokens.verify(token))
+
+    assert tokens.verify(token) is None
+    assert other_worker.verify(token) is None  # Reloaded from revoked_tokens
+    assert tokens.verify(other_token) is not None
+
+
+def test_revoked_list_reload_does_not_write(tokens, user):
+    token, _ = tokens.issue(user)
+    claims = tokens.verify(token)
+    tokens.revoke(claims)
+    db.session.add(RevokedToken(jti='old', user_id=user.id, expires_at=datetime.utcnow() - timedelta(hours=1)))
+    db.session.commit()
+
+    tokens.verify(token)
+    assert RevokedToken.query.count() == 2  # The expired row is ignored, not deleted
+    assert purge_expired_revocations() == 1
+    assert [row.jti for row in RevokedToken.query] == [claims['jti']]
+
+
+def test_tokens_of_deactivated_and_deleted_users_stop_working(tokens, user):
+    identities = IdentityCache(ttl=0)
+    token, _ = tokens.issue(user)
+    identity = tokens.authenticate(token, identities)
+    assert identity.id == user.id and identity.role == 'doctor' and identity.is_active
+
+    user.is_active = False
+    db.session.commit()
+    assert tokens.authenticate(token, identities) is None
+
+    with db.engine.begin() as connection:
+        connection.execute(text('DELETE FROM users WHERE id = :id'), {'id': user.id})
+    db.session.expire_all()
+    assert tokens.authenticate(token, identities) is None
+    assert tokens.authenticate('not-a-token', identities) is None
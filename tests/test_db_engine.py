@@ -0,0 +1,164 @@
+"""Database engine profiles: the SQLite write lock and the options chosen per URL"""
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from db_engine import database_url, engine_options, sqlite_connection_class
+
+CONFIG = {
+    'DB_STATEMENT_CACHE_SIZE': 500,
+    'SQLITE_BUSY_TIMEOUT': 200, 'SQLITE_MMAP_SIZE': 1024 * 1024, 'SQLITE_WRITE_LOCK': True,
+    'DB_POOL_SIZE': 6, 'DB_MAX_OVERFLOW': 2, 'DB_POOL_TIMEOUT': 10.0, 'DB_POOL_RECYCLE': 1800,
+    'DB_PREPARE_THRESHOLD': 5,
+}
+
+
+@pytest.fixture
+def connect(tmp_path):
+    """Connections to one database file, sharing one engine's write lock"""
+    factory = sqlite_connection_class(busy_timeout=200)
+    connections = []
+
+    def connect(**kwargs):
+        connection = sqlite3.connect(tmp_path / 'test.db', factory=factory, check_same_thread=False, **kwargs)
+        connections.append(connection)
+        return connection
+
+    setup = connect()
+    setup.execute('CREATE TABLE items (value INTEGER)')
+    setup.commit()
+    yield connect
+    for connection in connections:
+        connection.close()
+
+
+def test_pragmas_are_applied(connect):
+    connection = connect()
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert connection.execute('PRAGMA busy_timeout').fetchone()[0] == 200
+    assert connection.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+
+def test_reads_do_not_take_the_lock(connect):
+    connection = connect()
+    connection.execute('SELECT * FROM items').fetchall()
+    connection.execute('  pragma user_version').fetchall()
+    assert not connection.holds_write_lock and not connection.write_lock.locked()
+
+
+@pytest.mark.parametrize('end', [
+    lambda connection: connection.commit(),
+    lambda connection: connection.rollback(),
+    lambda connection: connection.close(),
+])
+def test_commit_rollback_and_close_release_the_lock(connect, end):
+    connection = connect()
+    connection.execute('INSERT INTO items VALUES (1)')
+    assert connection.holds_write_lock and connection.write_lock.locked()
+    end(connection)
+    assert not connection.write_lock.locked()
+
+
+@pytest.mark.parametrize('statement', ['COMMIT', 'end', 'ROLLBACK', 'rollback transaction'])
+def test_ending_statements_release_the_lock(connect, statement):
+    connection = connect(isolation_level=None)  # Transactions managed with statements
+    cursor = connection.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.executemany('INSERT INTO items VALUES (?)', [(1,), (2,)])
+    assert connection.holds_write_lock
+    cursor.execute(statement)
+    assert not connection.holds_write_lock and not connection.write_lock.locked()
+
+
+def test_rollback_to_a_savepoint_keeps_the_lock(connect):
+    connection = connect(isolation_level=None)
+    connection.execute('BEGIN')
+    connection.execute('SAVEPOINT first')
+    connection.execute('INSERT INTO items VALUES (1)')
+    connection.execute('ROLLBACK TO first')
+    assert connection.holds_write_lock
+    connection.execute('COMMIT')
+    assert not connection.write_lock.locked()
+
+
+def test_second_writer_times_out(connect):
+    writer, waiting = connect(), connect()
+    writer.execute('INSERT INTO items VALUES (1)')
+    start = time.monotonic()
+    with pytest.raises(sqlite3.OperationalError, match='write lock'):
+        waiting.execute('INSERT INTO items VALUES (2)')
+    assert 0.15 < time.monotonic() - start < 2
+    assert not waiting.holds_write_lock
+    writer.commit()
+    waiting.execute('INSERT INTO items VALUES (2)')  # Free again once the first writer commits
+    waiting.commit()
+
+
+def test_waiting_writer_goes_on_when_the_lock_is_released(connect):
+    writer, waiting = connect(), connect()
+    writer.execute('INSERT INTO items VALUES (1)')
+    done = threading.Event()
+
+    def write():
+        waiting.execute('INSERT INTO items VALUES (2)')
+        waiting.commit()
+        done.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    assert not done.wait(0.05)
+    writer.commit()
+    thread.join(1)
+    assert done.is_set()
+    assert writer.execute('SELECT count(*) FROM items').fetchone()[0] == 2
+
+
+def test_engine_sessions_release_the_lock(tmp_path):
+    url = f"sqlite:///{tmp_path / 'engine.db'}"
+    engine = create_engine(url, **engine_options(url, CONFIG))
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE items (value INTEGER)'))
+        lock = connection.connection.driver_connection.write_lock
+        assert lock.locked()
+    assert not lock.locked()
+    with pytest.raises(RuntimeError):
+        with engine.begin() as connection:
+            connection.execute(text('INSERT INTO items VALUES (1)'))
+            raise RuntimeError
+    assert not lock.locked()
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT count(*) FROM items')).scalar() == 0
+    engine.dispose()
+
+
+def test_sqlite_options():
+    assert engine_options('sqlite://', CONFIG) == {'query_cache_size': 500}
+    assert engine_options('sqlite:///:memory:', CONFIG) == {'query_cache_size': 500}
+
+    options = engine_options('sqlite:///app.db', CONFIG)
+    factory = options['connect_args']['factory']
+    assert options['connect_args']['timeout'] == 0.2
+    assert factory.lock_timeout == 0.2 and factory.write_lock is not None
+    assert 'busy_timeout = 200' in factory.PRAGMAS and 'mmap_size = 1048576' in factory.PRAGMAS
+    # Each engine gets its own lock
+    assert engine_options('sqlite:///app.db', CONFIG)['connect_args']['factory'].write_lock is not factory.write_lock
+
+    unlocked = engine_options('sqlite:///app.db', dict(CONFIG, SQLITE_WRITE_LOCK=False))
+    assert unlocked['connect_args']['factory'].write_lock is None
+
+
+def test_postgres_options():
+    pool = {'query_cache_size': 500, 'pool_size': 6, 'max_overflow': 2, 'pool_timeout': 10.0,
+            'pool_recycle': 1800, 'pool_pre_ping': True}
+    assert engine_options('postgresql://db/neurosight', CONFIG) == pool
+    assert engine_options('postgresql+psycopg://db/neurosight', CONFIG) == dict(
+        pool, connect_args={'prepare_threshold': 5})
+
+
+def test_database_url():
+    assert database_url('postgres://u:p@host/db') == 'postgresql://u:p@host/db'
+    assert database_url('postgresql://u:p@host/db') == 'postgresql://u:p@host/db'
+    assert database_url('sqlite:///app.db') == 'sqlite:///app.db'
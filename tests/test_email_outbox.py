@@ -0,0 +1,67 @@
+"""End-to-end outbox delivery against a local aiosmtpd server"""
+import pytest
+from flask_mail import Mail, Message
+
+from conftest import free_port
+from email_outbox import OutboxSender
+from mail_transport import MailTransport
+from models import db, EmailOutbox
+
+pytest.importorskip('aiosmtpd')
+
+
+def make_sender(app, port):
+    app.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+        MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_DEFAULT_SENDER='noreply@example.com',
+        EMAIL_SEND_TIMEOUT=120, EMAIL_MAX_ATTEMPTS=2, EMAIL_RETRY_BASE_SECONDS=30,
+        EMAIL_RETRY_MAX_SECONDS=3600, EMAIL_POLL_INTERVAL=10
+    )
+    return OutboxSender(app, MailTransport(Mail(app), timeout=5))
+
+
+@pytest.fixture
+def sender(app, smtp_server):
+    controller, _ = smtp_server
+    return make_sender(app, controller.port)
+
+
+def queue_otp(sender):
+    msg = Message('Your code', recipients=['doctor@example.com', 'nurse@example.com'],
+                  sender='noreply@example.com', html='<p>Code 123456</p>', body='Code 123456')
+    return [row.id for row in sender.queue(msg, 'otp')]
+
+
+def test_queued_messages_are_delivered_and_their_bodies_cleared(sender, smtp_server):
+    _, inbox = smtp_server
+    ids = queue_otp(sender)
+
+    assert sender.deliver_due() == 2
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in inbox.envelopes) == ['doctor@example.com', 'nurse@example.com']
+    assert all(b'Code 123456' in envelope.content for envelope in inbox.envelopes)
+    db.session.expire_all()
+    for row_id in ids:
+        row = db.session.get(EmailOutbox, row_id)
+        assert row.status == 'sent' and row.sent_at is not None
+        assert row.html_body is None and row.text_body is None
+    assert sender.deliver_due() == 0  # Nothing is sent twice
+
+
+def test_undeliverable_messages_are_retried_then_cleared(app):
+    sender = make_sender(app, free_port())  # Nothing listening: every attempt fails to connect
+    ids = queue_otp(sender)
+
+    sender.deliver_due()
+    db.session.expire_all()
+    row = db.session.get(EmailOutbox, ids[0])
+    assert row.status == 'pending' and row.attempts == 1
+    assert row.text_body == 'Code 123456'  # Kept for the retry
+
+    EmailOutbox.query.update({'next_attempt_at': row.created_at})
+    db.session.commit()
+    sender.deliver_due()
+    db.session.expire_all()
+    row = db.session.get(EmailOutbox, ids[0])
+    assert row.status == 'failed' and row.last_error
+    assert row.html_body is None and row.text_body is None
@@ -0,0 +1,84 @@
+"""Email templates: compiled HTML with inlined styles, and the plain-text part generated from it"""
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from email_templates import EmailTemplates, html_to_text_template, tidy_text
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+@pytest.fixture
+def templates():
+    return EmailTemplates(TEMPLATE_FOLDER)
+
+
+def user(**fields):
+    return SimpleNamespace(**dict(full_name='Ann <Lee> & Co', email='ann@example.com', **fields))
+
+
+def test_every_email_template_compiles(templates):
+    assert templates.names() == ['otp', 'password_reset', 'welcome']
+    assert templates.precompile() == 3
+
+
+def test_otp_email(templates):
+    html, text = templates.render('otp', user=user(), otp_code='123456')
+    assert 'font-family' in html and '@inline' not in html  # Shared styles inlined
+    assert 'Ann &lt;Lee&gt; &amp; Co' in html and '123456' in html
+
+    # Plain text: no markup or styles, values unescaped, lists kept
+    assert '<' not in text.replace('Ann <Lee>', '') and '{' not in text and 'font-family' not in text
+    assert 'Hello Ann <Lee> & Co,' in text and '\n123456\n' in text
+    assert '1. Return to the registration page\n2. Enter the 6-digit code above' in text
+    assert '- Never share this code with anyone' in text
+    assert '\n\n\n' not in text and text.endswith('.\n')
+
+
+def test_links_are_spelled_out_once(templates):
+    url = 'https://neurosight.example/reset/abc?x=1&y=2'
+    html, text = templates.render('password_reset', user=user(), reset_url=url)
+    assert 'href="https://neurosight.example/reset/abc?x=1&amp;y=2"' in html
+    assert f'Reset Password ({url})' in text
+    # The URL printed for copying is not followed by itself again
+    assert text.count(url) == 2
+
+
+def test_message_has_both_parts(templates):
+    message = templates.message('otp', 'Your code', ['ann@example.com'], sender='noreply@example.com',
+                                user=user(), otp_code='654321')
+    assert message.subject == 'Your code' and message.recipients == ['ann@example.com']
+    assert '654321' in message.html and '654321' in message.body and '<' not in message.body.replace('Ann <Lee>', '')
+
+
+def test_text_template_conversion():
+    source = ('<html><head><title>{{ subject }}</title><style>p { color: red; }</style></head><body>'
+              '{% block content %}<h1>Hi {{ name }}</h1><p>One<br>two &amp; <a href="mailto:x@example.com">mail us</a></p>'
+              '<ul><li>{% if a %}A{% endif %}</li></ul>{% endblock %}</body></html>')
+    converted = html_to_text_template(source)
+    assert '{% block content %}' in converted and '{% endblock %}' in converted
+    assert 'color: red' not in converted and '{{ subject }}' not in converted
+    assert '(mailto:' not in converted
+    assert tidy_text(converted) == ('{% block content %}\n\nHi {{ name }}\n\nOne\ntwo & mail us\n\n'
+                                    '- {% if a %}A{% endif %}\n\n{% endblock %}\n')
+    assert html_to_text_template('{% extends "email/_base.html" %}') == '{% extends "email/_base.txt" %}'
+
+
+def test_inlined_changes_reload_and_a_text_file_on_disk_wins(tmp_path):
+    folder = tmp_path / 'email'
+    folder.mkdir()
+    (folder / 'styles.css').write_text('p { color: red; }')
+    (folder / 'note.html').write_text('<style>/* @inline email/styles.css */</style><p>{{ body }}</p>')
+    templates = EmailTemplates(str(tmp_path), auto_reload=True)
+    assert templates.render('note', body='x') == ('<style>p { color: red; }</style><p>x</p>', 'x\n')
+
+    # Only the inlined file changes (mtime moved past the filesystem's resolution)
+    (folder / 'styles.css').write_text('p { color: blue; }')
+    stamp = time.time() + 5
+    os.utime(folder / 'styles.css', (stamp, stamp))
+    assert templates.render('note', body='x')[0] == '<style>p { color: blue; }</style><p>x</p>'
+
+    (folder / 'note.txt').write_text('Text: {{ body }}')
+    assert EmailTemplates(str(tmp_path)).render('note', body='x')[1] == 'Text: x\n'
@@ -0,0 +1,105 @@
+"""History pages: cursor round trip, filters and bad input"""
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from history_pages import HistoryQueryError, decode_cursor, encode_cursor, history_page, parse_filters
+from models import db, AnalysisHistory, User
+
+
+@pytest.fixture
+def doctors(app):
+    users = [User(email=f'doctor{i}@example.com', full_name=f'Doctor {i}', role='doctor') for i in range(2)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def add(user_id, created_at, disease_type='ms', prediction='MS', confidence=0.9):
+    db.session.add(AnalysisHistory(user_id=user_id, disease_type=disease_type, prediction=prediction,
+                                   confidence=confidence, created_at=created_at))
+
+
+def walk(user_id, filters=None, limit=3):
+    """Every page in turn; returns the ids in the order they were listed"""
+    ids, cursor, pages = [], None, 0
+    while True:
+        analyses, cursor = history_page(user_id, filters, cursor, limit)
+        ids += [analysis.id for analysis in analyses]
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+def test_pages_cover_every_analysis_once_newest_first(doctors):
+    doctor, other = doctors
+    start = datetime(2025, 1, 1, 9, 0)
+    for minute in range(10):
+        add(doctor, start + timedelta(minutes=minute))
+    for _ in range(3):
+        add(doctor, start + timedelta(minutes=5))  # Same timestamp: ordered by id
+    add(other, start)
+    db.session.commit()
+
+    expected = [analysis.id for analysis in AnalysisHistory.query.filter_by(user_id=doctor)
+                .order_by(AnalysisHistory.created_at.desc(), AnalysisHistory.id.desc())]
+    ids, pages = walk(doctor)
+    assert ids == expected and len(ids) == 13
+    assert pages == 5  # 13 rows in pages of 3
+    assert walk(other)[0] == [AnalysisHistory.query.filter_by(user_id=other).one().id]
+
+
+def test_exact_multiple_of_the_page_size_has_no_empty_last_page(doctors):
+    for minute in range(6):
+        add(doctors[0], datetime(2025, 1, 1, 9, minute))
+    db.session.commit()
+    first, cursor = history_page(doctors[0], limit=3)
+    second, last_cursor = history_page(doctors[0], cursor=cursor, limit=3)
+    assert len(first) == len(second) == 3 and last_cursor is None
+
+
+def test_cursor_round_trip(doctors):
+    add(doctors[0], datetime(2025, 1, 2, 3, 4, 5, 678901))
+    db.session.commit()
+    analysis = AnalysisHistory.query.one()
+    assert decode_cursor(encode_cursor(analysis)) == (analysis.created_at, analysis.id)
+
+
+def test_filters(doctors):
+    doctor = doctors[0]
+    add(doctor, datetime(2025, 1, 1, 23, 59), 'ms', 'MS', 0.95)
+    add(doctor, datetime(2025, 1, 2, 0, 0), 'ms', 'No MS', 0.55)
+    add(doctor, datetime(2025, 1, 3, 12, 0), 'stroke', 'Stroke', 0.8)
+    db.session.commit()
+
+    def listed(**args):
+        analyses, _ = history_page(doctor, parse_filters(MultiDict(args)))
+        return [(analysis.disease_type, analysis.prediction) for analysis in analyses]
+
+    assert listed(disease='ms') == [('ms', 'No MS'), ('ms', 'MS')]
+    assert listed(prediction='Stroke') == [('stroke', 'Stroke')]
+    assert listed(min_confidence='0.8') == [('stroke', 'Stroke'), ('ms', 'MS')]
+    assert listed(max_confidence='0.6') == [('ms', 'No MS')]
+    # Both dates are inclusive whole days
+    assert listed(date_from='2025-01-02', date_to='2025-01-02') == [('ms', 'No MS')]
+    assert listed(date_to='2025-01-01') == [('ms', 'MS')]
+    assert listed(disease='ms', date_from='2025-01-02', min_confidence='0.5') == [('ms', 'No MS')]
+    assert len(listed(disease='', prediction='')) == 3  # Empty values are ignored
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'date_from': '02/01/2025'}, 'date_from must be a date in YYYY-MM-DD format'),
+    ({'date_to': '2025-13-01'}, 'date_to must be a date in YYYY-MM-DD format'),
+    ({'min_confidence': 'high'}, 'min_confidence must be a number between 0 and 1'),
+    ({'max_confidence': '1.5'}, 'max_confidence must be a number between 0 and 1'),
+])
+def test_bad_filters_are_reported(args, message):
+    with pytest.raises(HistoryQueryError, match=message):
+        parse_filters(MultiDict(args))
+
+
+@pytest.mark.parametrize('cursor', ['not a cursor', 'AAAA', '8J-YgA', 'MjAyNS0wMS0wMXx4'])
+def test_bad_cursors_are_reported(doctors, cursor):
+    with pytest.raises(HistoryQueryError, match='Invalid cursor'):
+        history_page(doctors[0], cursor=cursor)
@@ -0,0 +1,33 @@
+"""Identity cache: identities of users deleted behind the cache's back"""
+import pytest
+from sqlalchemy import text
+
+from identity_cache import IdentityCache, UserDeleted
+from models import db, User
+
+
+@pytest.fixture
+def cache(app):
+    return IdentityCache(ttl=60)
+
+
+def test_identity_of_a_deleted_user_raises_user_deleted(cache):
+    user = User(email='doctor@example.com', full_name='Doctor', role='doctor')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    cache.load(user_id)  # Cached
+    db.session.remove()
+
+    # Deleted by another process (e.g. db_manager.py), so this process's cache still has it
+    with db.engine.begin() as connection:
+        connection.execute(text('DELETE FROM users WHERE id = :id'), {'id': user_id})
+
+    identity = cache.load(user_id)
+    assert identity.full_name == 'Doctor'  # Served from the cache
+    with pytest.raises(UserDeleted) as deleted:
+        identity.created_at  # Needs the row
+    assert deleted.value.user_id == user_id
+
+    cache.invalidate(user_id)
+    assert cache.load(user_id) is None
@@ -0,0 +1,48 @@
+"""Derivative renditions: concurrent first renders and undecodable uploads"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from image_derivatives import RENDER_ERRORS, DerivativeCache
+from upload_store import LocalBackend, UploadStore
+
+
+@pytest.fixture
+def legacy_root(tmp_path):
+    return tmp_path / 'legacy'
+
+
+@pytest.fixture
+def cache(tmp_path, legacy_root):
+    store = UploadStore(LocalBackend(str(tmp_path / 'blobs')), legacy_backend=LocalBackend(str(legacy_root)))
+    return DerivativeCache(str(tmp_path / 'derivatives'), store)
+
+
+def part_files(cache):
+    return [name for _, _, names in os.walk(cache.root) for name in names if name.endswith('.part')]
+
+
+def test_concurrent_first_requests_render_one_valid_thumbnail(cache, legacy_root):
+    buffer = io.BytesIO()
+    Image.new('RGB', (1024, 768), 'gray').save(buffer, format='PNG')
+    (legacy_root / 'scan.png').write_bytes(buffer.getvalue())
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = set(pool.map(lambda _: cache.get('scan.png', 'thumbnail'), range(16)))
+
+    assert paths == {cache.path('scan.png', 'thumbnail')}
+    with Image.open(paths.pop()) as thumbnail:
+        assert max(thumbnail.size) == 256
+    assert part_files(cache) == []
+
+
+def test_undecodable_upload_raises_render_error_and_leaves_no_temp_file(cache, legacy_root):
+    (legacy_root / 'broken.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'not really a png')
+
+    with pytest.raises(RENDER_ERRORS):
+        cache.get('broken.png', 'thumbnail')
+    assert not os.path.exists(cache.path('broken.png', 'thumbnail'))
+    assert part_files(cache) == []
@@ -0,0 +1,94 @@
+"""Pooled SMTP transport against a local aiosmtpd server: reuse, reconnects and per-message failures"""
+import smtplib
+
+import pytest
+from flask_mail import Mail, Message
+
+from conftest import free_port
+from mail_transport import MailTransport
+
+pytest.importorskip('aiosmtpd')
+
+
+def make_transport(app, port, **kwargs):
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_DEFAULT_SENDER='noreply@example.com')
+    return MailTransport(Mail(app), timeout=5, **kwargs)
+
+
+@pytest.fixture
+def transport(app, smtp_server):
+    transport = make_transport(app, smtp_server[0].port)
+    yield transport
+    transport.close()
+
+
+def message(recipient, subject='Hello'):
+    return Message(subject, recipients=[recipient], body=f'For {recipient}')
+
+
+def delivered(inbox):
+    return [envelope.rcpt_tos[0] for envelope in inbox.envelopes]
+
+
+def test_batches_share_one_pooled_connection(transport, smtp_server):
+    _, inbox = smtp_server
+    assert transport.send_batch([message('a@example.com'), message('b@example.com')]) == [None, None]
+    transport.send(message('c@example.com'))
+
+    assert delivered(inbox) == ['a@example.com', 'b@example.com', 'c@example.com']
+    stats = transport.metrics.snapshot()
+    assert stats['handshakes'] == 1 and stats['reconnects'] == 0
+    assert stats['sent'] == 3 and stats['messages_per_handshake'] == 3.0
+
+
+def test_dropped_session_is_reconnected_once(transport, smtp_server):
+    _, inbox = smtp_server
+    transport.send(message('a@example.com'))
+    transport._idle[0].connection.host.close()  # The server side of a dropped session, as smtplib sees it
+
+    assert transport.send_batch([message('b@example.com'), message('c@example.com')]) == [None, None]
+    assert delivered(inbox) == ['a@example.com', 'b@example.com', 'c@example.com']
+    stats = transport.metrics.snapshot()
+    assert stats['handshakes'] == 2 and stats['reconnects'] == 1
+
+
+def test_idle_connections_are_replaced_before_use(app, smtp_server):
+    transport = make_transport(app, smtp_server[0].port, idle_timeout=0)
+    transport.send(message('a@example.com'))
+    transport.send(message('b@example.com'))
+    transport.close()
+    assert len(smtp_server[1].envelopes) == 2
+    assert transport.metrics.reconnects == 1 and transport.metrics.handshakes == 2
+
+
+def test_a_refused_message_does_not_stop_the_batch(transport, smtp_server):
+    _, inbox = smtp_server
+    errors = transport.send_batch([message('a@example.com'), message('x@blocked.example'), message('b@example.com')])
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], smtplib.SMTPRecipientsRefused)
+    assert delivered(inbox) == ['a@example.com', 'b@example.com']
+    assert transport.metrics.failed == 1 and transport.metrics.handshakes == 1
+    assert len(transport._idle) == 1  # The connection is still good and back in the pool
+
+
+def test_unreachable_server_fails_every_message(app):
+    transport = make_transport(app, free_port())
+    errors = transport.send_batch([message('a@example.com'), message('b@example.com')])
+    assert len(errors) == 2 and isinstance(errors[0], OSError) and errors[1] is errors[0]
+    assert transport._idle == []
+    with pytest.raises(OSError):
+        transport.send(message('a@example.com'))
+
+
+def test_pool_size_bounds_open_connections(app, smtp_server):
+    transport = make_transport(app, smtp_server[0].port, pool_size=2)
+    with transport.connection() as first, transport.connection() as second:
+        assert first is not second
+        # A third borrower would wait for a slot
+        assert not transport._slots.acquire(blocking=False)
+    with transport.connection() as again:
+        assert again in (first, second)
+    assert len(transport._idle) == 2 and transport.metrics.handshakes == 2
+    transport.close()
+    assert transport._idle == [] and first.connection.host is None
@@ -0,0 +1,69 @@
+"""OAuth metadata cache against the stub identity provider"""
+import socket
+import threading
+
+import pytest
+
+import oauth_metadata
+from oauth_metadata import OAuthMetadataCache, serve_stub_provider
+
+pytest.importorskip('cryptography')
+
+
+class Client:
+    """The part of an authlib client the cache fills in"""
+
+    def __init__(self):
+        self.server_metadata = {}
+
+
+@pytest.fixture(scope='module')
+def provider():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = serve_stub_provider(port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{port}/.well-known/openid-configuration"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_persist_reload_and_expire(provider, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'oauth' / 'google.json')
+    cache = OAuthMetadataCache(provider, cache_path, ttl=3600)
+    client = Client()
+    cache.attach(client)
+
+    cache.refresh()
+    assert cache.metadata['issuer'] == provider.rsplit('/.well-known', 1)[0]
+    assert cache.metadata['jwks']['keys'][0]['kid'] == 'neurosight-stub'
+    assert cache.expires_at - cache.fetched_at == 300  # The provider's max-age, not ttl
+    assert cache.fresh
+    assert client.server_metadata['jwks'] == cache.metadata['jwks']
+    assert client.server_metadata['_loaded_at'] == cache.fetched_at  # So authlib does not fetch it again
+    assert 239 < cache._next_refresh_in() <= 240  # At refresh_at (80%) of the lifetime
+
+    # Another worker starts from the saved copy without contacting the provider
+    reloaded = OAuthMetadataCache(provider, cache_path)
+    assert reloaded.load()
+    assert (reloaded.metadata, reloaded.fetched_at, reloaded.expires_at) == \
+        (cache.metadata, cache.fetched_at, cache.expires_at)
+    assert not OAuthMetadataCache('https://other.example/.well-known/openid-configuration', cache_path).load()
+
+    now = cache.expires_at + 1
+    monkeypatch.setattr(oauth_metadata.time, 'time', lambda: now)
+    assert not reloaded.fresh
+    assert reloaded._next_refresh_in() == 0
+
+
+def test_failed_refresh_keeps_the_last_good_copy(provider, tmp_path):
+    cache = OAuthMetadataCache(provider, str(tmp_path / 'google.json'))
+    cache.refresh()
+    good = cache.metadata
+
+    cache.discovery_url = provider.replace('openid-configuration', 'missing')
+    with pytest.raises(Exception):
+        cache.refresh()
+    assert cache.metadata is good
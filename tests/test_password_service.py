@@ -0,0 +1,92 @@
+"""Password hashing service: upgrades on login and the bounded verification queue"""
+import threading
+import time
+
+import pytest
+
+from models import db, User
+from password_service import PasswordService, PasswordServiceBusy, passwords
+
+
+@pytest.fixture
+def scheme(app):
+    """Point the shared service at a cheap scheme, restoring the default afterwards"""
+    def configure(method):
+        passwords.configure(method, max_workers=2, max_pending=32)
+    yield configure
+    passwords.configure()
+
+
+def test_login_upgrades_a_hash_made_with_old_parameters(scheme):
+    scheme('pbkdf2:sha256:1000')
+    user = User(email='doctor@example.com', full_name='Doctor', role='doctor')
+    user.set_password('Correct-horse-1')
+    db.session.add(user)
+    db.session.commit()
+    old_hash = user.password_hash
+
+    scheme('pbkdf2:sha256:2000')
+    assert passwords.needs_rehash(old_hash)
+    assert not user.check_password('wrong password')
+    assert user.password_hash == old_hash  # Only a successful login upgrades
+
+    assert user.check_password('Correct-horse-1')
+    db.session.commit()
+    db.session.expire_all()
+    stored = db.session.get(User, user.id).password_hash
+    assert stored.startswith('pbkdf2:sha256:2000$') and not passwords.needs_rehash(stored)
+    assert db.session.get(User, user.id).check_password('Correct-horse-1')
+
+
+def test_hashes_from_another_scheme_verify_and_are_flagged():
+    pbkdf2 = PasswordService('pbkdf2:sha256:1000')
+    scrypt_hash = PasswordService('scrypt:1024:8:1').hash('secret')
+    assert pbkdf2.verify(scrypt_hash, 'secret')
+    assert pbkdf2.needs_rehash(scrypt_hash)
+    assert not pbkdf2.needs_rehash(pbkdf2.hash('secret'))
+
+
+def test_argon2_scheme():
+    pytest.importorskip('argon2')
+    service = PasswordService('argon2:1:8192:1')
+    password_hash = service.hash('secret')
+    assert password_hash.startswith('$argon2')
+    assert service.verify(password_hash, 'secret') and not service.verify(password_hash, 'other')
+    assert PasswordService('argon2:2:8192:1').needs_rehash(password_hash)
+    assert PasswordService('pbkdf2:sha256:1000').verify(password_hash, 'secret')  # Still verifies after a scheme change
+
+
+def test_missing_hash_never_verifies():
+    assert PasswordService('pbkdf2:sha256:1000').verify(None, 'anything') is False
+
+
+def test_verifications_beyond_max_pending_are_refused():
+    service = PasswordService('pbkdf2:sha256:1000', max_workers=1, max_pending=1)
+    password_hash = service.hash('secret')
+    started, release = threading.Event(), threading.Event()
+    verify = service._verify
+
+    def slow_verify(stored, password):
+        started.set()
+        release.wait(5)
+        return verify(stored, password)
+
+    service._verify = slow_verify
+    results = []
+    login = threading.Thread(target=lambda: results.append(service.verify(password_hash, 'secret')))
+    login.start()
+    assert started.wait(5)
+
+    with pytest.raises(PasswordServiceBusy) as busy:
+        service.verify(password_hash, 'secret')
+    assert busy.value.code == 503
+    assert ('Retry-After', '1') in busy.value.get_headers()
+
+    release.set()
+    login.join(5)
+    assert results == [True]
+    deadline = time.monotonic() + 5
+    while service.pending and time.monotonic() < deadline:  # Released by the future's done callback
+        time.sleep(0.01)
+    assert service.pending == 0
+    assert service.verify(password_hash, 'secret')  # Room again once the queue drains
@@ -0,0 +1,113 @@
+"""Patient search: FTS5 index kept in sync by triggers, per-user isolation and ranking"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from models import db, AnalysisHistory, User
+from patient_search import (SEARCH_TABLE, SearchQueryError, install_search_index, search_analyses,
+                            search_index_ready)
+
+
+@pytest.fixture
+def doctors(app):
+    # Ids 1 and 12: the owner token 'u1' must not match 'u12' as a prefix
+    db.session.add_all([User(id=user_id, email=f'doctor{user_id}@example.com', full_name=f'Doctor {user_id}',
+                             role='doctor') for user_id in (1, 12)])
+    db.session.commit()
+    assert install_search_index(db.engine)
+    return 1, 12
+
+
+def add(user_id, created_at=None, **fields):
+    fields.setdefault('prediction', 'No findings')
+    analysis = AnalysisHistory(user_id=user_id, disease_type='ms', confidence=0.9,
+                               created_at=created_at or datetime(2025, 1, 1), **fields)
+    db.session.add(analysis)
+    db.session.commit()
+    return analysis.id
+
+
+def found(user_id, query):
+    return [analysis.id for analysis in search_analyses(user_id, query)[0]]
+
+
+def test_install_is_idempotent_and_indexes_existing_rows(app):
+    db.session.add(User(id=1, email='doctor1@example.com', full_name='Doctor 1', role='doctor'))
+    db.session.commit()
+    existing = add(1, patient_name='John Smith')
+    assert not search_index_ready(db.engine)
+    assert install_search_index(db.engine)
+    assert not install_search_index(db.engine)
+    assert install_search_index(db.engine, rebuild=True)
+    assert search_index_ready(db.engine)
+    assert found(1, 'smith') == [existing]  # Indexed once, even after the rebuild
+
+
+def test_triggers_follow_insert_update_and_delete(doctors):
+    doctor = doctors[0]
+    analysis_id = add(doctor, patient_name='John Smith', patient_id='P-1001', notes='small lesion')
+    assert found(doctor, 'joh smi') == [analysis_id]
+    assert found(doctor, 'P-10') == [analysis_id]
+
+    analysis = db.session.get(AnalysisHistory, analysis_id)
+    analysis.patient_name = 'Jane Doe'
+    analysis.notes = None
+    db.session.commit()
+    assert found(doctor, 'smith') == [] and found(doctor, 'lesion') == []
+    assert found(doctor, 'jane doe') == [analysis_id]
+
+    db.session.delete(analysis)
+    db.session.commit()
+    assert found(doctor, 'jane') == []
+    # A contentless table cannot be read back, so count what the index still matches
+    assert db.session.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH 'jane'")).scalar() == 0
+
+
+def test_users_only_see_their_own_rows(doctors):
+    first, twelfth = doctors
+    own = add(first, patient_name='Shared Name')
+    other = add(twelfth, patient_name='Shared Name')
+    assert found(first, 'shared') == [own]
+    assert found(twelfth, 'shared') == [other]
+
+    # Moving a row to another user moves it in the index too
+    analysis = db.session.get(AnalysisHistory, own)
+    analysis.user_id = twelfth
+    db.session.commit()
+    assert found(first, 'shared') == []
+    assert sorted(found(twelfth, 'shared')) == sorted([own, other])
+
+
+def test_input_is_not_fts_syntax(doctors):
+    doctor = doctors[0]
+    analysis_id = add(doctor, patient_name='Owner Test')
+    assert found(doctor, 'owner:"u12" OR test') == []  # Every term must match; 'or' and 'u12' do not
+    assert found(doctor, 'owner* test') == [analysis_id]
+    with pytest.raises(SearchQueryError):
+        search_analyses(doctor, ' "*" ')
+
+
+def test_ranked_by_field_then_whole_word_then_newest(doctors):
+    doctor = doctors[0]
+    start = datetime(2025, 1, 1)
+    in_notes = add(doctor, start + timedelta(days=3), patient_name='Anna Kerr', notes='follow up with Lee')
+    in_prediction = add(doctor, start + timedelta(days=2), patient_name='Anna Kerr', prediction='Lee pattern')
+    in_name = add(doctor, start + timedelta(days=1), patient_name='Lee Park')
+    in_id = add(doctor, start, patient_name='Anna Kerr', patient_id='LEE-7')
+    name_prefix = add(doctor, start + timedelta(days=4), patient_name='Leela Park')
+    newer_name = add(doctor, start + timedelta(days=5), patient_name='Tom Lee')
+
+    # Whole word in: id 8, name 6 (newest first), prediction 4; name prefix 3; notes 2
+    assert found(doctor, 'lee') == [in_id, newer_name, in_name, in_prediction, name_prefix, in_notes]
+    # Every term must match, and the scores add up: 6 + 6 against 3 + 6
+    assert found(doctor, 'lee park') == [in_name, name_prefix]
+
+
+def test_pages_of_the_ranked_matches(doctors):
+    doctor = doctors[0]
+    ids = [add(doctor, datetime(2025, 1, 1) + timedelta(minutes=minute), patient_name='Page Test') for minute in range(5)]
+    first, more = search_analyses(doctor, 'page', page=1, limit=2)
+    last, no_more = search_analyses(doctor, 'page', page=3, limit=2)
+    assert [analysis.id for analysis in first] == [ids[4], ids[3]] and more
+    assert [analysis.id for analysis in last] == [ids[0]] and not no_more
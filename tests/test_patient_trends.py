@@ -0,0 +1,48 @@
+"""Patient trends maintained on analysis insert and delete match a full recompute"""
+import random
+from datetime import date, timedelta
+
+from models import db, AnalysisHistory, Patient, PatientTrend, User
+
+
+def recomputed(patient_id, disease_type):
+    analyses = AnalysisHistory.query.filter_by(patient_ref_id=patient_id, disease_type=disease_type)
+    points = sorted((PatientTrend.point(analysis) for analysis in analyses),
+                    key=lambda point: (point['date'], point['analysis_id']))
+    values = PatientTrend.summarise(points)
+    del values['updated_at']
+    return values
+
+
+def stored(patient_id, disease_type):
+    trend = db.session.get(PatientTrend, (patient_id, disease_type))
+    return {column: getattr(trend, column) for column in recomputed(patient_id, disease_type)}
+
+
+def test_trend_ends_follow_inserts_and_deletes_in_any_order(app):
+    user = User(email='doctor@example.com', full_name='Doctor', role='doctor')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(user_id=user.id, external_id='P-1')
+    db.session.add(patient)
+    db.session.commit()
+
+    rng = random.Random(7)
+    # Scan dates entered out of order, some repeated, some missing
+    for _ in range(30):
+        scan_date = rng.choice([None, date(2025, 1, 1) + timedelta(days=rng.randrange(10))])
+        db.session.add(AnalysisHistory(user_id=user.id, patient_ref_id=patient.id, disease_type='ms', scan_date=scan_date,
+                                       prediction=rng.choice(['MS', 'No MS']), confidence=rng.random()))
+        db.session.commit()
+        db.session.expire_all()
+        assert stored(patient.id, 'ms') == recomputed(patient.id, 'ms')
+
+    # Delete ends and middles alike, down to an empty trend
+    analyses = AnalysisHistory.query.all()
+    rng.shuffle(analyses)
+    for analysis in analyses:
+        db.session.delete(analysis)
+        db.session.commit()
+        db.session.expire_all()
+        assert stored(patient.id, 'ms') == recomputed(patient.id, 'ms')
+    assert db.session.get(PatientTrend, (patient.id, 'ms')).analysis_count == 0
@@ -0,0 +1,128 @@
+"""Patient records: upsert, the per-process cache and linking existing analyses"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, AnalysisHistory, Patient, User
+from patients import PatientCache, clean_external_id, link_analyses, upsert_patients
+
+
+@pytest.fixture
+def doctors(app):
+    users = [User(email=f'doctor{i}@example.com', full_name=f'Doctor {i}', role='doctor') for i in range(2)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+@pytest.fixture
+def cache(app):
+    cache = PatientCache(max_size=2)
+    yield cache
+    # The listeners are global to Session; leave none behind for the next test
+    event.remove(Session, 'after_commit', cache._session_committed)
+    event.remove(Session, 'after_soft_rollback', cache._session_rolled_back)
+
+
+def patients():
+    return {(patient.user_id, patient.external_id): (patient.id, patient.name, patient.age)
+            for patient in Patient.query}
+
+
+def test_clean_external_id():
+    assert clean_external_id('  P-1 ') == 'P-1'
+    assert clean_external_id('N/A') is None and clean_external_id(None) is None and clean_external_id(' - ') is None
+    assert len(clean_external_id('x' * 200)) == 100
+
+
+def test_upsert_inserts_then_updates_in_place(doctors):
+    doctor, other = doctors
+    first = upsert_patients(db.session.connection(), [
+        {'user_id': doctor, 'external_id': 'P-1', 'name': 'Ann', 'age': 40},
+        {'user_id': other, 'external_id': 'P-1', 'name': 'Bob', 'age': 50},
+    ])
+    db.session.commit()
+    assert len(set(first.values())) == 2  # The same patient ID belongs to each user separately
+
+    second = upsert_patients(db.session.connection(), [
+        {'user_id': doctor, 'external_id': 'P-1', 'name': 'Ann B', 'age': 41},
+        {'user_id': doctor, 'external_id': 'P-1', 'name': 'Ann C', 'age': 42},  # Later rows win
+        {'user_id': doctor, 'external_id': 'P-2', 'name': None, 'age': None},
+    ])
+    db.session.commit()
+    assert second[(doctor, 'P-1')] == first[(doctor, 'P-1')]
+    assert patients() == {(doctor, 'P-1'): (first[(doctor, 'P-1')], 'Ann C', 42),
+                          (other, 'P-1'): (first[(other, 'P-1')], 'Bob', 50),
+                          (doctor, 'P-2'): (second[(doctor, 'P-2')], None, None)}
+    assert upsert_patients(db.session.connection(), []) == {}
+
+
+def test_cache_keeps_committed_entries_and_upserts_changes(doctors, cache):
+    doctor = doctors[0]
+    assert cache.resolve(db.session, doctor, 'N/A') is None
+    patient_id = cache.resolve(db.session, doctor, 'P-1', 'Ann', 40)
+    db.session.commit()
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    assert cache.resolve(db.session, doctor, ' P-1 ', 'Ann', 40) == patient_id
+    assert cache.hits == 1
+    # A new name or age goes to the database, against the same patient
+    assert cache.resolve(db.session, doctor, 'P-1', 'Ann', 41) == patient_id
+    db.session.commit()
+    assert cache.misses == 2 and patients()[(doctor, 'P-1')] == (patient_id, 'Ann', 41)
+
+    cache.invalidate(doctor, 'P-1')
+    cache.resolve(db.session, doctor, 'P-1', 'Ann', 41)
+    assert cache.misses == 3
+
+
+def test_cache_drops_entries_of_a_rolled_back_transaction(doctors, cache):
+    doctor = doctors[0]
+    cache.resolve(db.session, doctor, 'P-1', 'Ann', 40)
+    db.session.rollback()
+    assert patients() == {}
+
+    # Not cached, so the patient is created again rather than pointing at the rolled back id
+    patient_id = cache.resolve(db.session, doctor, 'P-1', 'Ann', 40)
+    db.session.commit()
+    assert cache.misses == 2 and patients() == {(doctor, 'P-1'): (patient_id, 'Ann', 40)}
+
+
+def test_cache_evicts_least_recently_used(doctors, cache):
+    doctor = doctors[0]
+    for external_id in ('P-1', 'P-2'):
+        cache.resolve(db.session, doctor, external_id)
+    db.session.commit()
+    cache.resolve(db.session, doctor, 'P-1')  # P-2 is now the oldest
+    cache.resolve(db.session, doctor, 'P-3')
+    db.session.commit()
+    assert cache.hits == 1
+    cache.resolve(db.session, doctor, 'P-1')
+    cache.resolve(db.session, doctor, 'P-2')
+    assert cache.hits == 2 and cache.misses == 4
+
+
+def test_link_analyses_backfills_in_batches(doctors):
+    doctor, other = doctors
+    for user_id, patient_id, name, age in [(doctor, 'P-1', 'Ann', 40), (doctor, 'N/A', 'No ID', 30),
+                                           (doctor, 'P-1', 'Ann B', 41), (other, 'P-1', 'N/A', 50),
+                                           (doctor, 'P-2', '', None)]:
+        db.session.add(AnalysisHistory(user_id=user_id, patient_id=patient_id, patient_name=name, patient_age=age,
+                                       disease_type='ms', prediction='MS', created_at=datetime(2025, 1, 1)))
+    db.session.commit()
+
+    batches = []
+    assert link_analyses(db.engine, batch_size=2, progress=lambda last_id, linked: batches.append(linked)) == (4, 4)
+    assert batches == [1, 3, 4]
+    db.session.expire_all()
+
+    stored = patients()
+    assert {key: value[1:] for key, value in stored.items()} == {
+        (doctor, 'P-1'): ('Ann B', 41), (other, 'P-1'): (None, 50), (doctor, 'P-2'): (None, None)}
+    assert {(analysis.user_id, analysis.patient_id): analysis.patient_ref_id for analysis in AnalysisHistory.query} == {
+        (doctor, 'P-1'): stored[(doctor, 'P-1')][0], (doctor, 'N/A'): None,
+        (other, 'P-1'): stored[(other, 'P-1')][0], (doctor, 'P-2'): stored[(doctor, 'P-2')][0]}
+    # Linked analyses are skipped on a second run
+    assert link_analyses(db.engine) == (0, 0)
@@ -0,0 +1,99 @@
+"""Sliding-window rate limits in process memory and in Redis (fakeredis)"""
+import pytest
+
+from rate_limiter import MemoryStore, RateLimiter, RateLimitExceeded, RedisStore, parse_rate
+
+fakeredis = pytest.importorskip('fakeredis')
+
+WINDOW_START = 6000.0  # A multiple of every window used below
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryStore()
+    return RedisStore(fakeredis.FakeRedis())
+
+
+def test_parse_rate():
+    assert parse_rate('10/minute') == (10, 60)
+    assert parse_rate('5/15minutes') == (5, 900)
+    assert parse_rate('5/300') == (5, 300)
+    assert parse_rate('') is None
+    with pytest.raises(ValueError):
+        parse_rate('ten per minute')
+
+
+def test_full_window_rejects_until_the_previous_window_decays(store):
+    limiter = RateLimiter({}, store=store)
+    rate = (10, 60)
+    assert all(limiter.hit('k', rate, now=WINDOW_START + i) == 0 for i in range(10))
+
+    # Current window full: 50s to the next window, then 6s for the old 10 hits to weigh only 9
+    assert limiter.hit('k', rate, now=WINDOW_START + 10) == 50 + 6
+    assert limiter.hit('k', rate, now=WINDOW_START + 65) > 0
+    assert limiter.hit('k', rate, now=WINDOW_START + 66) == 0
+
+
+def test_previous_window_counts_by_its_remaining_overlap(store):
+    limiter = RateLimiter({}, store=store)
+    rate = (10, 60)
+    for i in range(10):
+        limiter.hit('k', rate, now=WINDOW_START + i)
+    # Halfway through the next window the old hits count as 5, leaving room for 5 more
+    halfway = WINDOW_START + 90
+    assert [limiter.hit('k', rate, now=halfway) for _ in range(6)][:5] == [0] * 5
+    assert limiter.hit('k', rate, now=halfway) > 0
+
+
+def test_rejected_hits_are_not_counted(store):
+    limiter = RateLimiter({}, store=store)
+    rate = (2, 60)
+    limiter.hit('k', rate, now=WINDOW_START)
+    limiter.hit('k', rate, now=WINDOW_START)
+    for _ in range(5):
+        assert limiter.hit('k', rate, now=WINDOW_START + 1) > 0
+    # Only the two allowed hits carry over, weighing 1 a half window later
+    assert limiter.hit('k', rate, now=WINDOW_START + 90) == 0
+    assert limiter.hit('k', rate, now=WINDOW_START + 90) > 0
+
+
+def test_account_rejection_gives_back_the_ip_hit(store):
+    limiter = RateLimiter({'login': ((3, 60), (1, 60))}, store=store)
+    limiter.check('login', '10.0.0.1', 'doctor@example.com', now=WINDOW_START)
+    for _ in range(5):
+        with pytest.raises(RateLimitExceeded):
+            limiter.check('login', '10.0.0.1', 'Doctor@example.com ', now=WINDOW_START + 1)
+    # The IP has used one of its three hits, not six
+    limiter.check('login', '10.0.0.1', 'nurse@example.com', now=WINDOW_START + 2)
+    limiter.check('login', '10.0.0.1', 'admin@example.com', now=WINDOW_START + 3)
+
+
+def test_rate_limit_exceeded_sets_retry_after_header(store):
+    limiter = RateLimiter({'otp': ((1, 60), None)}, store=store)
+    limiter.check('otp', '10.0.0.1', now=WINDOW_START)
+    with pytest.raises(RateLimitExceeded) as exceeded:
+        limiter.check('otp', '10.0.0.1', now=WINDOW_START)
+    assert exceeded.value.code == 429
+    assert ('Retry-After', '120') in exceeded.value.get_headers()
+
+
+def test_redis_keys_expire_after_they_stop_counting():
+    client = fakeredis.FakeRedis()
+    RateLimiter({}, store=RedisStore(client, prefix='t:')).hit('k', (5, 60), now=WINDOW_START)
+    key = f't:k:{int(WINDOW_START // 60)}'
+    assert int(client.get(key)) == 1
+    assert 60 < client.ttl(key) <= 121
+
+
+def test_unreachable_store_falls_back_to_process_memory():
+    class DownStore:
+        def increment(self, key, bucket, window):
+            raise ConnectionError('redis is down')
+
+        def decrement(self, key, bucket):
+            raise ConnectionError('redis is down')
+
+    limiter = RateLimiter({}, store=DownStore())
+    assert limiter.hit('k', (1, 60), now=WINDOW_START) == 0
+    assert limiter.hit('k', (1, 60), now=WINDOW_START) > 0
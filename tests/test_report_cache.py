@@ -0,0 +1,54 @@
+"""ReportCache: temporary files and renders overtaken by an edit"""
+import os
+
+import pytest
+
+from report_cache import ReportCache
+
+
+def write_pdf(analysis_id, fields, target):
+    with open(target, 'wb') as f:
+        f.write(f"%PDF {fields['notes']}".encode())
+
+
+def files(cache, analysis_id):
+    directory = cache._directory(analysis_id)
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_render_records_the_current_version_and_prunes_older_ones(tmp_path):
+    recorded = []
+    current = {'notes': 'old'}
+    cache = ReportCache(tmp_path, write_pdf, lambda analysis_id, path: recorded.append(path),
+                        lambda analysis_id: ReportCache.fingerprint(current))
+    old = cache.render_async(1, {'notes': 'old'}).result()
+    current = {'notes': 'new'}
+    new = cache.render_async(1, current).result()
+
+    assert files(cache, 1) == [os.path.basename(new)]
+    assert recorded == [old, new]
+
+
+def test_render_overtaken_by_an_edit_keeps_the_newer_pdf(tmp_path):
+    recorded = []
+    current = {'notes': 'new'}  # Edited while the old version was queued
+    cache = ReportCache(tmp_path, write_pdf, lambda analysis_id, path: recorded.append(path),
+                        lambda analysis_id: ReportCache.fingerprint(current))
+    new = cache.render_async(1, current).result()
+    stale = cache.render_async(1, {'notes': 'old'}).result()
+
+    assert os.path.isfile(new)  # Not pruned by the stale render
+    assert recorded == [new]  # report_path not written back to the stale version
+    assert set(files(cache, 1)) == {os.path.basename(new), os.path.basename(stale)}
+
+
+def test_failed_render_leaves_no_temporary_file(tmp_path):
+    def broken(analysis_id, fields, target):
+        with open(target, 'wb') as f:
+            f.write(b'%PDF half')
+        raise RuntimeError('renderer crashed')
+
+    cache = ReportCache(tmp_path, broken)
+    with pytest.raises(RuntimeError):
+        cache.render_async(1, {'notes': ''}).result()
+    assert files(cache, 1) == []
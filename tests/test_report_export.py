@@ -0,0 +1,48 @@
+"""Patient exports: the streamed zip and the combined PDF"""
+import io
+import re
+import zipfile
+
+from report_export import CHUNK_SIZE, iter_combined_pdf, iter_zip
+
+REPORT = {'patient_name': 'Jane Doe', 'patient_id': 'P-1', 'patient_age': '54', 'scan_date': '2025-01-01',
+          'disease_name': 'Multiple Sclerosis', 'prediction': 'No MS', 'confidence': 91.5,
+          'image_path': '', 'notes': ''}
+
+
+def test_zip_is_streamed_one_entry_at_a_time():
+    consumed = []
+
+    def entries():
+        for index in range(3):
+            consumed.append(index)
+            yield f'{index:04d}.pdf', (2025, 1, index + 1, 12, 0, 0), b'%PDF-' + bytes([index]) * 1000
+
+    chunks = iter_zip(entries())
+    first = next(chunks)
+    assert consumed == [0]  # The first entry is sent before the next is read
+    data = first + b''.join(chunks)
+    assert consumed == [0, 1, 2]
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ['0000.pdf', '0001.pdf', '0002.pdf']
+        info = archive.getinfo('0002.pdf')
+        assert info.date_time == (2025, 1, 3, 12, 0, 0) and info.compress_type == zipfile.ZIP_STORED
+        assert archive.read('0001.pdf') == b'%PDF-' + b'\x01' * 1000
+        assert archive.testzip() is None
+
+
+def test_empty_zip_is_a_valid_archive():
+    with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip([])))) as archive:
+        assert archive.namelist() == []
+
+
+def test_combined_pdf_holds_every_report():
+    reports = [(dict(REPORT, patient_id=f'P-{index}'), None) for index in range(5)]
+    chunks = list(iter_combined_pdf(iter(reports)))
+
+    assert all(len(chunk) <= CHUNK_SIZE for chunk in chunks)
+    pdf = b''.join(chunks)
+    assert pdf.startswith(b'%PDF-') and pdf.rstrip().endswith(b'%%EOF')
+    # Each report starts on a fresh page
+    assert len(re.findall(rb'/Type /Page\b', pdf)) >= len(reports)
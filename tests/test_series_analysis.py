@@ -0,0 +1,86 @@
+"""Series analysis: centre-out order, aggregation and early stopping"""
+import numpy as np
+import pytest
+
+from series_analysis import aggregate_probabilities, analyze_series, center_out_order
+
+
+class Model:
+    """predict() for slices whose 'image' is the slice position; records each batch"""
+
+    def __init__(self, probabilities):
+        self.probabilities = probabilities
+        self.batches = []
+
+    def __call__(self, images):
+        self.batches.append(list(images))
+        return np.array([self.probabilities(position) for position in images])
+
+
+def run(model, count, **kwargs):
+    return analyze_series(lambda position: position, count, model, **kwargs)
+
+
+def test_center_out_order():
+    assert center_out_order(5) == [2, 1, 3, 0, 4]
+    assert center_out_order(4) == [1, 0, 2, 3]
+    assert center_out_order(1) == [0]
+
+
+def test_aggregation_methods():
+    probabilities = [[0.9, 0.1], [0.5, 0.5], [0.2, 0.8]]
+    assert np.allclose(aggregate_probabilities(probabilities, 'mean'), [1.6 / 3, 1.4 / 3])
+    assert np.allclose(aggregate_probabilities(probabilities, 'max'), [0.9 / 1.7, 0.8 / 1.7])
+
+    attention = aggregate_probabilities(probabilities, 'attention')
+    assert np.isclose(attention.sum(), 1)
+    # The undecided slice carries the least weight, so the most decisive slice leads
+    assert attention[0] > aggregate_probabilities(probabilities, 'mean')[0]
+    # Equally decisive slices are weighted equally
+    assert np.allclose(aggregate_probabilities([[0.9, 0.1], [0.1, 0.9]], 'attention'), [0.5, 0.5])
+
+    with pytest.raises(ValueError, match='Unknown aggregation'):
+        aggregate_probabilities(probabilities, 'median')
+
+
+def test_stops_once_the_aggregate_is_confident():
+    model = Model(lambda position: [0.98, 0.02])
+    result = run(model, 20, batch_size=4, stop_confidence=0.95, min_slices=4)
+    assert result.stopped_early
+    assert model.batches == [[9, 8, 10, 7]]  # One batch, from the middle of the study
+    assert sorted(result.slice_probabilities) == [7, 8, 9, 10]
+    assert result.predicted_index == 0 and np.isclose(result.confidence, 0.98)
+
+
+def test_does_not_stop_before_min_slices():
+    model = Model(lambda position: [0.98, 0.02])
+    result = run(model, 20, batch_size=2, stop_confidence=0.95, min_slices=5)
+    assert result.stopped_early and len(model.batches) == 3 and len(result.slice_probabilities) == 6
+
+
+def test_uncertain_series_is_analysed_in_full():
+    model = Model(lambda position: [0.6, 0.4])
+    result = run(model, 10, batch_size=4)
+    assert not result.stopped_early
+    assert [len(batch) for batch in model.batches] == [4, 4, 2]
+    assert sorted(result.slice_probabilities) == list(range(10))
+
+
+def test_confident_series_analysed_in_full_is_not_early():
+    # Reaching the threshold on the last batch is not stopping early
+    result = run(Model(lambda position: [0.99, 0.01]), 3, batch_size=4, min_slices=1)
+    assert not result.stopped_early and len(result.slice_probabilities) == 3
+
+
+def test_representative_slice_supports_the_prediction():
+    result = run(Model(lambda position: [0.3, 0.7] if position == 1 else [0.45, 0.55]), 4, aggregation='mean')
+    assert result.predicted_index == 1
+    assert result.representative_position == 1
+
+
+def test_empty_series_is_rejected():
+    # With no slices there is nothing to aggregate (the result would have no probabilities)
+    model = Model(lambda position: [1.0, 0.0])
+    with pytest.raises(ValueError, match='at least one slice'):
+        run(model, 0)
+    assert model.batches == []
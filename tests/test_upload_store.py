@@ -0,0 +1,24 @@
+"""UploadStore on the local backend: names and types of compacted blobs"""
+from models import db, UploadBlob
+from upload_store import LocalBackend, UploadStore, shard_key
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'scan-bytes' * 100
+
+
+def test_compacted_blob_is_served_under_its_stored_extension(app, tmp_path):
+    store = UploadStore(LocalBackend(str(tmp_path / 'blobs')))
+    image_path, saved = store.save(PNG, 'brain.png')
+    store.index(saved)
+    db.session.commit()
+    digest = image_path[:-len('.png')]
+    assert store.download_name(image_path) == image_path
+    assert store.media_type(image_path) == 'image/png'
+
+    # As compact_uploads.py leaves a blob re-encoded to lossless WebP
+    blob = db.session.get(UploadBlob, digest)
+    blob.storage_key = shard_key(digest, '.webp')
+    blob.encoding = 'webp-lossless'
+    db.session.commit()
+
+    assert store.download_name(image_path) == f'{digest}.webp'
+    assert store.media_type(image_path) == 'image/webp'
@@ -0,0 +1,74 @@
+"""UploadStore on the S3 backend, against moto's in-process S3"""
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from models import db, UploadBlob  # noqa: E402
+from upload_store import S3Backend, UploadStore, create_upload_store, shard_key  # noqa: E402
+
+BUCKET = 'neurosight-test'
+PNG = b'\x89PNG\r\n\x1a\n' + b'scan-bytes' * 100
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def store(app, s3):
+    return UploadStore(S3Backend(s3, BUCKET, prefix='uploads'))
+
+
+def keys(s3):
+    return [item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET).get('Contents', [])]
+
+
+def test_save_writes_sharded_object_and_index_row(store, s3):
+    image_path, saved = store.save(PNG, 'brain.png')
+    store.index(saved)
+    db.session.commit()
+
+    digest = image_path[:-len('.png')]
+    assert keys(s3) == [f"uploads/{shard_key(digest, '.png')}"]
+    head = s3.head_object(Bucket=BUCKET, Key=f"uploads/{shard_key(digest, '.png')}")
+    assert head['ContentType'] == 'image/png'
+    blob = db.session.get(UploadBlob, digest)
+    assert blob.storage_key == shard_key(digest, '.png') and blob.size_bytes == len(PNG)
+
+
+def test_identical_upload_is_stored_once(store, s3):
+    first, saved = store.save(PNG, 'brain.png')
+    store.index(saved)
+    db.session.commit()
+
+    second, saved_again = store.save(PNG, 'copy-of-brain.png')
+    assert second == first
+    assert saved_again.result() is None  # Already indexed: nothing written
+    store.index(saved_again)
+    db.session.commit()
+
+    assert len(keys(s3)) == 1
+    assert UploadBlob.query.count() == 1
+
+
+def test_serve_reads_back_from_bucket(store):
+    image_path, saved = store.save(PNG, 'brain.png')
+    store.index(saved)
+    db.session.commit()
+
+    assert store.local_path(image_path) is None  # Served from memory, not a file
+    assert store.open(image_path).read() == PNG
+    assert store.media_type(image_path) == 'image/png'
+    assert store.read('0' * 64 + '.png') is None
+    assert store.backend.exists(shard_key('0' * 64, '.png')) is False
+
+
+def test_create_upload_store_builds_s3_backend(app, s3, tmp_path):
+    store = create_upload_store({'UPLOAD_STORE_BACKEND': 's3', 'UPLOAD_STORE_S3_BUCKET': BUCKET,
+                                 'UPLOAD_STORE_S3_PREFIX': 'uploads'}, legacy_root=str(tmp_path / 'legacy'))
+    assert isinstance(store.backend, S3Backend) and store.backend.prefix == 'uploads/'
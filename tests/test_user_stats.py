@@ -0,0 +1,79 @@
+"""Dashboard counters kept on analysis insert and delete, rebuild and backfill"""
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from models import db, AnalysisHistory, User, UserStats
+
+
+@pytest.fixture
+def users(app):
+    users = [User(email=f'doctor{i}@example.com', full_name=f'Doctor {i}', role='doctor') for i in range(2)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+@pytest.fixture
+def utc_months():
+    UserStats.zone = ZoneInfo('UTC')
+    yield
+    UserStats.zone = None
+
+
+def analyse(user_id, disease_type, created_at):
+    analysis = AnalysisHistory(user_id=user_id, disease_type=disease_type, prediction='x', confidence=0.9,
+                               created_at=created_at)
+    db.session.add(analysis)
+    db.session.commit()
+    return analysis
+
+
+def counters():
+    return {(row.user_id, row.period, row.disease_type): row.analysis_count
+            for row in UserStats.query if row.analysis_count}
+
+
+def test_counts_follow_inserts_and_deletes(users, utc_months):
+    doctor, other = users
+    now = datetime(2025, 3, 15, 12, 0)
+    analyse(doctor, 'ms', datetime(2025, 2, 10))
+    this_month = analyse(doctor, 'ms', now)
+    analyse(doctor, 'stroke', now)
+    analyse(other, 'ms', now)
+
+    assert UserStats.summary(doctor, now=now) == {'total': 3, 'this_month': 2, 'by_disease': {'ms': 2, 'stroke': 1}}
+    assert UserStats.summary(other, now=now) == {'total': 1, 'this_month': 1, 'by_disease': {'ms': 1}}
+
+    db.session.delete(this_month)
+    db.session.commit()
+    assert UserStats.summary(doctor, now=now) == {'total': 2, 'this_month': 1, 'by_disease': {'ms': 1, 'stroke': 1}}
+
+    # The counters kept as analyses came and went match a recount
+    kept = counters()
+    UserStats.rebuild()
+    db.session.commit()
+    assert counters() == kept
+
+
+def test_months_follow_the_configured_zone(users, utc_months):
+    late_on_the_31st = datetime(2025, 1, 31, 23, 30)  # UTC, as created_at is stored
+    assert UserStats.month_of(late_on_the_31st) == '2025-01'
+
+    UserStats.zone = ZoneInfo('Asia/Tokyo')  # Reset by the fixture
+    assert UserStats.month_of(late_on_the_31st) == '2025-02'
+    analyse(users[0], 'ms', late_on_the_31st)
+    assert UserStats.summary(users[0], now=datetime(2025, 2, 1, 0, 0))['this_month'] == 1
+
+
+def test_backfill_fills_an_empty_table_once(users, utc_months):
+    analyse(users[0], 'ms', datetime(2025, 3, 1))
+    analyse(users[1], 'stroke', datetime(2025, 3, 2))
+    expected = counters()
+    UserStats.query.delete()  # As on a database from before the counters existed
+    db.session.commit()
+
+    assert UserStats.backfill()
+    assert counters() == expected
+    assert not UserStats.backfill()  # Already filled
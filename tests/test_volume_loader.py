@@ -0,0 +1,82 @@
+"""Volume loading errors surface as VolumeError, and slice sizes are bounded"""
+import gzip
+import io
+
+import numpy as np
+import pytest
+
+nibabel = pytest.importorskip('nibabel')
+pydicom = pytest.importorskip('pydicom')
+
+from pydicom.dataset import Dataset, FileMetaDataset  # noqa: E402
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid  # noqa: E402
+
+from volume_loader import VolumeError, load_volume  # noqa: E402
+
+
+def dicom_bytes(rows=8, columns=8, pixels=True, instance=1):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'  # MR Image Storage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.SOPClassUID = meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.InstanceNumber = instance
+    dataset.Rows, dataset.Columns = rows, columns
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = 'MONOCHROME2'
+    dataset.BitsAllocated = dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 0
+    if pixels:
+        dataset.PixelData = np.arange(rows * columns, dtype=np.uint16).tobytes()
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def nifti_bytes(shape, compress=False):
+    image = nibabel.Nifti1Image(np.random.default_rng(0).random(shape).astype(np.float32), np.eye(4))
+    data = image.to_bytes()
+    return gzip.compress(data) if compress else data
+
+
+def test_dicom_slices_decode():
+    volume = load_volume([(f'{i}.dcm', dicom_bytes(instance=i)) for i in range(3)], max_slices=3)
+    assert volume.image(0).size == (8, 8)
+
+
+def test_dicom_without_pixel_data_raises_volume_error_on_decode():
+    volume = load_volume([('a.dcm', dicom_bytes(pixels=False))], max_slices=4)
+    with pytest.raises(VolumeError, match='Could not decode slice 1'):
+        volume.image(0)
+
+
+def test_dicom_slices_over_the_pixel_limit_are_rejected_from_the_header():
+    with pytest.raises(VolumeError, match='64x64 pixels'):
+        load_volume([('a.dcm', dicom_bytes(rows=64, columns=64))], max_slices=4, max_pixels=1000)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_nifti_slices_over_the_pixel_limit_are_rejected(compress):
+    name = 'brain.nii.gz' if compress else 'brain.nii'
+    data = nifti_bytes((40, 50, 6), compress)
+    with pytest.raises(VolumeError, match='pixels'):
+        load_volume([(name, data)], max_slices=4, max_pixels=40 * 50 - 1)
+    volume = load_volume([(name, data)], max_slices=4, max_pixels=40 * 50)
+    assert len(volume) == 4
+    assert volume.image(0).size == (40, 50)
+
+
+def test_truncated_nifti_gz_raises_volume_error_on_decode():
+    data = nifti_bytes((40, 50, 6), compress=True)
+    volume = load_volume([('brain.nii.gz', data[:len(data) // 2])], max_slices=6)
+    with pytest.raises(VolumeError):
+        volume.image(len(volume) - 1)
+
+
+def test_nifti_without_slices_is_rejected():
+    with pytest.raises(VolumeError, match='no slices'):
+        load_volume([('brain.nii', nifti_bytes((8, 8, 0)))], max_slices=4)
@@ -0,0 +1,253 @@
+"""
+Content-addressed upload store for NeuroSight
+Uploads are named by their SHA-256, sharded into subdirectories and stored once however often they are uploaded
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db, UploadBlob
+
+
+# Blob writes happen off the request thread
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+
+_DIGEST_RE = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)?$')
+
+
+class LocalBackend:
+    """Stores blobs as files under a root directory"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def write(self, key, data):
+        """Write to a temporary file and atomically move it into place"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per writer, so two uploads of the same content never share a temporary file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3Backend:
+    """
+    Stores blobs in an S3-compatible bucket
+    client is a boto3 S3 client; point endpoint_url at MinIO (or similar) to run against a local stand-in
+    """
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except Exception as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def write(self, key, data):
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def local_path(self, key):
+        return None
+
+
+def shard_key(digest, ext):
+    """Storage key for a blob: ab/cd/abcd...ef.png"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def _extension(filename):
+    if filename.lower().endswith('.nii.gz'):
+        return '.nii.gz'
+    return os.path.splitext(filename)[1].lower()
+
+
+def _report_write_error(future):
+    error = future.exception()
+    if error is not None:
+        print(f"✗ Failed to persist upload: {error}")
+
+
+class UploadStore:
+    """
+    Content-addressed store in front of a storage backend
+    AnalysisHistory.image_path holds '<sha256><ext>'; the upload_blobs index maps it to the
+    stored object, which may have been re-encoded or moved to the cold tier since.
+    Older rows hold flat '<timestamp>_<name>' files, served from legacy_backend.
+    """
+
+    def __init__(self, backend, legacy_backend=None, cold_backend=None):
+        self.backend = backend
+        self.legacy_backend = legacy_backend
+        self.cold_backend = cold_backend
+
+    def save(self, data, original_filename):
+        """
+        Write an upload in the background unless it is already stored
+        Returns (image_path, Future). Only reads the database, so no write transaction is
+        open while the caller runs inference; pass the Future to index() in the transaction
+        that saves the analysis.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        ext = _extension(original_filename)
+        storage_key = shard_key(digest, ext)
+
+        if db.session.get(UploadBlob, digest) is not None:
+            # Already stored (possibly compacted or in the cold tier); nothing to write or index
+            future = Future()
+            future.set_result(None)
+        else:
+            row = {
+                'sha256': digest,
+                'storage_key': storage_key,
+                'content_type': mimetypes.guess_type(original_filename)[0],
+                'size_bytes': len(data),
+                'original_filename': original_filename[:255],
+                'created_at': datetime.utcnow()
+            }
+            future = _writer.submit(self._write_if_missing, storage_key, data, row)
+            future.add_done_callback(_report_write_error)
+        return f"{digest}{ext}", future
+
+    def index(self, saved):
+        """
+        Wait for a save() to finish writing, then add its index row to the current transaction
+        Call right before committing, so the blob exists before any row references it.
+        """
+        row = saved.result()
+        if row is None:
+            return
+        # Identical scans share one blob; ON CONFLICT keeps concurrent uploads race-free
+        db.session.execute(text(
+            "INSERT INTO upload_blobs (sha256, storage_key, content_type, size_bytes, original_filename, created_at, tier) "
+            "VALUES (:sha256, :storage_key, :content_type, :size_bytes, :original_filename, :created_at, 'hot') "
+            "ON CONFLICT (sha256) DO NOTHING"
+        ), row)
+
+    def _write_if_missing(self, storage_key, data, row):
+        if not self.backend.exists(storage_key):
+            self.backend.write(storage_key, data)
+        return row
+
+    def backend_for(self, blob):
+        """Backend holding a blob, according to its retention tier"""
+        if blob.tier == 'cold' and self.cold_backend is not None:
+            return self.cold_backend
+        return self.backend
+
+    def locate(self, image_path):
+        """Return (backend, key) for an image_path, or (None, None) if it is unknown"""
+        match = _DIGEST_RE.match(image_path or '')
+        if match:
+            blob = db.session.get(UploadBlob, match.group(1))
+            if blob is not None:
+                return self.backend_for(blob), blob.storage_key
+        if self.legacy_backend is not None and image_path:
+            try:
+                if self.legacy_backend.exists(image_path):
+                    return self.legacy_backend, image_path
+            except ValueError:
+                pass
+        return None, None
+
+    def is_content_addressed(self, image_path):
+        return bool(_DIGEST_RE.match(image_path or ''))
+
+    def media_type(self, image_path):
+        """MIME type of the stored object, which may differ from image_path after compaction"""
+        _, key = self.locate(image_path)
+        return mimetypes.guess_type(key or image_path)[0] or 'application/octet-stream'
+
+    def download_name(self, image_path):
+        """File name to serve the blob under: image_path with the stored object's extension (e.g. .webp once compacted)"""
+        _, key = self.locate(image_path)
+        name = os.path.basename(image_path)
+        if key is None:
+            return name
+        return os.path.splitext(name)[0] + os.path.splitext(key)[1]
+
+    def read(self, image_path):
+        """Blob bytes, or None if the image is not stored"""
+        backend, key = self.locate(image_path)
+        return backend.read(key) if backend is not None else None
+
+    def local_path(self, image_path):
+        """Filesystem path of the blob when the backend is local, otherwise None"""
+        backend, key = self.locate(image_path)
+        return backend.local_path(key) if backend is not None else None
+
+    def open(self, image_path):
+        """A path or in-memory stream suitable for PIL/ReportLab, or None if missing"""
+        path = self.local_path(image_path)
+        if path is not None:
+            return path
+        data = self.read(image_path)
+        return io.BytesIO(data) if data is not None else None
+
+
+def create_upload_store(config, legacy_root):
+    """Build the upload store from app config (UPLOAD_STORE_BACKEND = 'local' or 's3')"""
+    legacy_backend = LocalBackend(legacy_root)
+    cold_backend = LocalBackend(config['UPLOAD_COLD_FOLDER']) if config.get('UPLOAD_COLD_FOLDER') else None
+    if config.get('UPLOAD_STORE_BACKEND', 'local') == 's3':
+        import boto3
+        client = boto3.client('s3', endpoint_url=config.get('UPLOAD_STORE_S3_ENDPOINT') or None)
+        backend = S3Backend(client, config['UPLOAD_STORE_S3_BUCKET'], config.get('UPLOAD_STORE_S3_PREFIX', ''))
+    else:
+        # Never under the static folder: blobs must only be reachable through the ownership check
+        backend = LocalBackend(config['UPLOAD_STORE_ROOT'])
+    return UploadStore(backend, legacy_backend, cold_backend)
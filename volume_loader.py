@@ -0,0 +1,259 @@
+"""
+Volume ingestion for NeuroSight
+Reads DICOM series and NIfTI volumes header-first and decodes only the slices chosen for analysis
+(a .nii.gz still has to be inflated up to the last chosen slice, since gzip cannot seek)
+"""
+import gzip
+import io
+
+import numpy as np
+import nibabel
+import pydicom
+from nibabel.fileholders import FileHolder
+from pydicom.errors import InvalidDicomError
+from pydicom.multival import MultiValue
+from PIL import Image
+
+try:
+    # pydicom >= 3 can decode a single frame of a multi-frame object
+    from pydicom.pixels import pixel_array as decode_frame
+except ImportError:
+    decode_frame = None
+
+
+NIFTI_EXTENSIONS = ('.nii', '.nii.gz')
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+# What a damaged or unsupported slice raises on decode: missing PixelData (AttributeError),
+# unsupported transfer syntax (RuntimeError / NotImplementedError), truncated data, ...
+DECODE_ERRORS = (AttributeError, KeyError, IndexError, TypeError, ValueError, RuntimeError,
+                 NotImplementedError, OSError, EOFError)
+
+
+class VolumeError(ValueError):
+    """Raised when an uploaded volume cannot be read"""
+
+
+class VolumeSlices:
+    """
+    Slices selected from a volume, windowed to 8-bit grayscale images
+    Pixel data is decoded lazily, the first time a slice is requested
+    """
+
+    def __init__(self, source_format, slice_count, indices, decode):
+        self.source_format = source_format  # 'dicom' or 'nifti'
+        self.slice_count = slice_count      # Number of slices in the whole volume
+        self.indices = indices              # Volume positions of the selected slices
+        self._decode = decode               # Callable: volume index -> PIL 'L' image
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def image(self, position):
+        """Decoded image for the selected slice at this position in indices; VolumeError if it cannot be decoded"""
+        if position not in self._cache:
+            try:
+                self._cache[position] = self._decode(self.indices[position])
+            except VolumeError:
+                raise
+            except DECODE_ERRORS as e:
+                raise VolumeError(f'Could not decode slice {self.indices[position] + 1} of the volume: {e}') from e
+        return self._cache[position]
+
+    @property
+    def images(self):
+        """All selected slices (decodes any not yet decoded)"""
+        return [self.image(position) for position in range(len(self.indices))]
+
+    def __repr__(self):
+        return f'<VolumeSlices {self.source_format} {len(self.indices)}/{self.slice_count}>'
+
+
+def detect_volume_format(filename, data):
+    """Return 'dicom', 'nifti' or None for an uploaded file"""
+    name = filename.lower()
+    if name.endswith(NIFTI_EXTENSIONS):
+        return 'nifti'
+    if name.endswith(DICOM_EXTENSIONS) or data[128:132] == b'DICM':
+        return 'dicom'
+    return None
+
+
+def select_slice_indices(count, max_slices):
+    """
+    Pick up to max_slices indices spread evenly over the central part of a volume
+    The outer slices of a brain volume are mostly skull and air, so they are skipped
+    """
+    if count <= max_slices:
+        return list(range(count))
+    margin = int(count * 0.2)
+    first, last = margin, count - 1 - margin
+    if max_slices == 1:
+        return [count // 2]
+    return sorted(set(np.linspace(first, last, max_slices).round().astype(int).tolist()))
+
+
+def apply_window(pixels, center=None, width=None):
+    """Map raw intensities to 8-bit with a window; defaults to a robust percentile window"""
+    pixels = np.asarray(pixels, dtype=np.float32)
+    if center is None or width is None:
+        low, high = np.percentile(pixels, (0.5, 99.5))
+    else:
+        low, high = center - width / 2.0, center + width / 2.0
+    if high <= low:
+        high = low + 1.0
+    scaled = (pixels - low) * (255.0 / (high - low))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def _first_value(value):
+    """DICOM window attributes may be multi-valued; use the first window"""
+    if value is None:
+        return None
+    if isinstance(value, MultiValue):
+        value = value[0]
+    return float(value)
+
+
+def _dicom_sort_key(header):
+    """Order slices along the scan axis, falling back to InstanceNumber"""
+    position = getattr(header, 'ImagePositionPatient', None)
+    orientation = getattr(header, 'ImageOrientationPatient', None)
+    if position is not None and orientation is not None:
+        row, col = np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float)
+        return float(np.dot(np.cross(row, col), np.array(position, dtype=float)))
+    return float(getattr(header, 'InstanceNumber', 0) or 0)
+
+
+def _dicom_to_image(header, pixels):
+    """Apply modality rescale and VOI windowing to one DICOM frame"""
+    slope = float(getattr(header, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(header, 'RescaleIntercept', 0) or 0)
+    pixels = np.asarray(pixels, dtype=np.float32) * slope + intercept
+
+    window = apply_window(
+        pixels,
+        center=_first_value(getattr(header, 'WindowCenter', None)),
+        width=_first_value(getattr(header, 'WindowWidth', None))
+    )
+    if getattr(header, 'PhotometricInterpretation', '') == 'MONOCHROME1':
+        window = 255 - window
+    return Image.fromarray(window)
+
+
+def _check_slice_size(width, height, max_pixels):
+    if max_pixels and width * height > max_pixels:
+        raise VolumeError(f"Volume slices are {width}x{height} pixels; the limit is {max_pixels:,} pixels")
+
+
+def load_dicom(files, max_slices, max_pixels=None):
+    """
+    Load a DICOM series (one file per slice) or a single multi-frame file
+    Headers are parsed for every file; pixel data only for the selected slices
+    """
+    try:
+        headers = [
+            (pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True), data)
+            for _, data in files
+        ]
+    except InvalidDicomError as e:
+        raise VolumeError(f'Invalid DICOM file: {e}')
+    for header, _ in headers:
+        _check_slice_size(int(getattr(header, 'Columns', 0) or 0), int(getattr(header, 'Rows', 0) or 0), max_pixels)
+
+    # A single enhanced/multi-frame object holds the whole volume
+    if len(headers) == 1 and int(getattr(headers[0][0], 'NumberOfFrames', 1) or 1) > 1:
+        header, data = headers[0]
+        frame_count = int(header.NumberOfFrames)
+        indices = select_slice_indices(frame_count, max_slices)
+        if decode_frame is not None:
+            def decode(i):
+                return _dicom_to_image(header, decode_frame(io.BytesIO(data), index=i))
+        else:
+            frames = []
+
+            def decode(i):
+                if not frames:
+                    frames.append(pydicom.dcmread(io.BytesIO(data)).pixel_array)
+                return _dicom_to_image(header, frames[0][i])
+        return VolumeSlices('dicom', frame_count, indices, decode)
+
+    headers.sort(key=lambda item: _dicom_sort_key(item[0]))
+    indices = select_slice_indices(len(headers), max_slices)
+
+    def decode(i):
+        dataset = pydicom.dcmread(io.BytesIO(headers[i][1]))
+        return _dicom_to_image(dataset, dataset.pixel_array)
+    return VolumeSlices('dicom', len(headers), indices, decode)
+
+
+def _axial_axis(affine):
+    """Voxel axis that runs inferior-superior, so slices are axial"""
+    codes = nibabel.aff2axcodes(affine)
+    for axis, code in enumerate(codes):
+        if code in ('S', 'I'):
+            return axis
+    return 2
+
+
+def load_nifti(filename, data, max_slices, max_pixels=None):
+    """
+    Load a NIfTI volume through nibabel's array proxy
+    Only the selected slices are converted to images. An uncompressed .nii is read at the
+    slices' offsets; a .nii.gz is inflated from the start up to each slice read.
+    """
+    stream = io.BytesIO(data)
+    if filename.lower().endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+    holder = FileHolder(fileobj=stream)
+    volume = None
+    for image_class in (nibabel.Nifti1Image, nibabel.Nifti2Image):
+        try:
+            volume = image_class.from_file_map({'header': holder, 'image': holder})
+            break
+        except Exception as e:
+            error = e
+            stream.seek(0)
+    if volume is None:
+        raise VolumeError(f'Invalid NIfTI file: {error}')
+
+    if len(volume.shape) < 3:
+        raise VolumeError('NIfTI file does not contain a 3D volume')
+
+    axis = _axial_axis(volume.affine)
+    slice_count = volume.shape[axis]
+    if slice_count == 0:
+        raise VolumeError('NIfTI volume has no slices')
+    height, width = [size for dimension, size in enumerate(volume.shape[:3]) if dimension != axis]
+    _check_slice_size(width, height, max_pixels)
+    indices = select_slice_indices(slice_count, max_slices)
+
+    def decode(i):
+        # dataobj slicing applies scl_slope/scl_inter and reads only this slice
+        slicer = [slice(None)] * 3 + [0] * (len(volume.shape) - 3)
+        slicer[axis] = i
+        pixels = np.asarray(volume.dataobj[tuple(slicer)])
+        # Radiological display: rotate so anterior is up
+        return Image.fromarray(np.ascontiguousarray(np.rot90(apply_window(pixels))))
+    return VolumeSlices('nifti', slice_count, indices, decode)
+
+
+def load_volume(files, max_slices, max_pixels=None):
+    """
+    Load the selected slices of an uploaded volume
+    files is a list of (filename, bytes) tuples making up one study; slices larger than
+    max_pixels are rejected from the headers, before any pixel data is decoded
+    """
+    if not files:
+        raise VolumeError('No volume files provided')
+
+    filename, data = files[0]
+    source_format = detect_volume_format(filename, data)
+    if source_format == 'nifti':
+        if len(files) > 1:
+            raise VolumeError('Please upload one NIfTI volume at a time')
+        return load_nifti(filename, data, max_slices, max_pixels)
+    if source_format == 'dicom':
+        return load_dicom(files, max_slices, max_pixels)
+    raise VolumeError(f'Unsupported volume file: {filename}')